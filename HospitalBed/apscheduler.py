@@ -2,8 +2,10 @@ import atexit
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from HospitalBed.settings import HL7_DIRECTORY
+from HospitalBed.settings import HL7_DIRECTORY, HL7_WATCH_DIRECTORY, HL7_TAIL_MODE
 from dashboard.services import HL7MessageParser, RFCLocationParser
+from dashboard.services.hl7_tail_services import HL7FileTailer
+from dashboard.services.watcher_services import HL7DirectoryWatcher
 
 
 def start():
@@ -11,8 +13,19 @@ def start():
 
     scheduler = BackgroundScheduler()
 
-    scheduler.add_job(HL7MessageParser.parse_hl7_messages_from_directory, 'interval',
-                      minutes=3, args=[HL7_DIRECTORY])
+    # in tail mode the files are read while they are written, otherwise the complete files are parsed and deleted
+    if HL7_TAIL_MODE:
+        parse_hl7_directory = HL7FileTailer.parse_hl7_messages_from_directory
+    else:
+        parse_hl7_directory = HL7MessageParser.parse_hl7_messages_from_directory
+
+    if HL7_WATCH_DIRECTORY:
+        # parse the hl7 files as soon as they are written
+        watcher = HL7DirectoryWatcher(HL7_DIRECTORY, parse_hl7_directory, watch_modifications=HL7_TAIL_MODE)
+        watcher.start()
+        atexit.register(watcher.stop)
+    else:
+        scheduler.add_job(parse_hl7_directory, 'interval', minutes=3, args=[HL7_DIRECTORY])
     scheduler.add_job(RFCLocationParser.call_rfc_and_parse_result, 'cron',
                       hour=0, minute=0)
     scheduler.start()
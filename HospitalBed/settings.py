@@ -25,6 +25,109 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # hl7 directory with the hl7 files
 HL7_DIRECTORY = "C:/Users/Leon/OneDrive/Bachelorarbeit/Eigene/Von echt/Leons_hl7"
 
+# watch the hl7 directory and parse new files as soon as they are written (instead of every 3 minutes)
+HL7_WATCH_DIRECTORY = True
+# time (in seconds) without new files, before a burst of files is parsed
+HL7_WATCH_DEBOUNCE = 1.0
+# max time (in seconds) a burst of files is collected, before it is parsed
+HL7_WATCH_MAX_DELAY = 10.0
+# interval (in seconds) for polling the hl7 directory, if inotify is not available
+HL7_WATCH_POLL_INTERVAL = 180.0
+
+# read only the messages appended to the hl7 files since the last run instead of deleting the parsed files
+HL7_TAIL_MODE = False
+# time (in seconds) without writes, after which the last message of a tailed hl7 file is complete,
+# if a newer hl7 file is written (the last message of the newest file is complete as soon as the next message starts)
+HL7_TAIL_IDLE_TIME = 1.0
+
+# extract the used fields directly from the hl7 segment strings instead of parsing the whole messages with hl7.parse
+HL7_FAST_EXTRACTOR = True
+
+# max size (in characters) of the buffered hl7 messages before sorted runs are spilled to temporary files
+HL7_SORT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# number of hl7 messages parsed together in one transaction with bulk writes (0 parses every message on its own)
+HL7_BATCH_SIZE = 0
+# number of hl7 messages committed together in one transaction, if they are parsed on their own
+# every message gets a savepoint, so that a failing message is rolled back without the rest of the chunk
+HL7_COMMIT_CHUNK_SIZE = 100
+# number of threads parsing the hl7 messages of disjoint patients concurrently (1 parses them in order)
+HL7_APPLY_WORKERS = 1
+# max number of hl7 messages waiting for every apply thread
+HL7_APPLY_QUEUE_SIZE = 1000
+# directory for the hl7 messages, that could not be parsed, with their errors
+HL7_QUARANTINE_DIRECTORY = os.path.join(HL7_DIRECTORY, "quarantine")
+
+# number of hl7 messages parsed together in one transaction by the backfill of archived hl7 files
+HL7_BACKFILL_BATCH_SIZE = 5000
+# interval (in seconds) between two progress reports of the backfill
+HL7_BACKFILL_PROGRESS_INTERVAL = 10.0
+
+# interval (in seconds) for polling the visibility of the replayed hl7 messages
+HL7_REPLAY_POLL_INTERVAL = 0.1
+# max time (in seconds) after the last replayed hl7 message, until all replayed messages have to be visible
+HL7_REPLAY_TIMEOUT = 60.0
+
+# write the tracing spans of every hl7 parsing run with the wall time, cpu time, queries and memory of its stages
+# the spans are aggregated per stage and message type, so the tracing is cheap enough to be enabled in production
+HL7_TRACING = False
+# directory for the json-lines trace files of the hl7 parsing runs and the max number of kept trace files
+HL7_TRACE_DIRECTORY = os.path.join(HL7_DIRECTORY, "traces")
+HL7_TRACE_MAX_FILES = 1000
+
+# number of worker processes for the parsing of the hl7 files (1 parses them in the scheduler thread)
+HL7_PARSE_WORKERS = 1
+# min size (in bytes) of all hl7 files, so that the worker processes are used
+# bigger files are split into chunks of HL7_PARSE_CHUNK_SIZE messages
+HL7_PARSE_POOL_MIN_BYTES = 4 * 1024 * 1024
+HL7_PARSE_CHUNK_SIZE = 1000
+
+# drop resent hl7 messages by their message control id (MSH-10)
+HL7_DEDUPLICATION = True
+# number of days the control ids of the parsed hl7 messages are stored
+HL7_DEDUP_RETENTION_DAYS = 30
+# expected number of stored control ids and false positive rate of the in-memory bloom filter in front of them
+# the filter is rebuilt with twice the number of stored control ids, as soon as it contains more than its capacity
+HL7_DEDUP_BLOOM_CAPACITY = 1000000
+HL7_DEDUP_BLOOM_ERROR_RATE = 0.01
+
+# number of sorted hl7 messages, in which an admission or transfer and its cancellation are compacted (0 disables it)
+HL7_COMPACTION_WINDOW = 1000
+
+# drain a backlog of hl7 messages by the recency of their visits, so that the current state is correct first
+# the messages of every visit keep their order and only HL7_PRIORITY_WINDOW messages are kept in memory at once
+HL7_PRIORITY_LANES = False
+# number of sorted hl7 messages, that are scheduled by the recency of their visits at once
+HL7_PRIORITY_WINDOW = 100000
+# max age (in seconds) of the last hl7 message of a visit, so that the visit is in the near-time lane
+HL7_PRIORITY_NEAR_TIME_AGE = 6 * 3600
+
+# backend of the occupancy history charts: "orm" runs a query per sample time, "sweep" counts the occupancy at all
+# sample times from the stays fetched once and "numpy" counts them vectorized (falls back to "sweep" without numpy)
+OCCUPANCY_HISTORY_BACKEND = "sweep"
+# number of sample times of the occupancy history charts from the start to the end of the period
+# (at most one per minute of the period, because the samples are keyed by their minute)
+OCCUPANCY_HISTORY_SAMPLES = 10
+
+# address of the mllp listener for the real-time hl7 messages
+MLLP_HOST = "0.0.0.0"
+MLLP_PORT = 2575
+# max number of received hl7 messages waiting for the parsing, before the senders are slowed down
+MLLP_QUEUE_SIZE = 1000
+
+# addresses of the prometheus servers allowed to scrape the /metrics view without login
+# the backlog and the ingested messages are internal, so every other address is rejected
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+# request.META key of the header, in which the load balancer appends the client address (e.g. "HTTP_X_FORWARDED_FOR")
+# the last address of the header is used, because it is set by the load balancer and can not be forged by the client
+# without a load balancer it has to be None, so that the address of the connection (REMOTE_ADDR) is used
+METRICS_CLIENT_IP_HEADER = None
+
+# max number of wards, rooms and beds cached in memory during the hl7 parsing
+HL7_LOCATION_CACHE_SIZE = 10000
+# max number of visits with their open stays cached in memory during the hl7 parsing
+HL7_OPEN_STAY_CACHE_SIZE = 100000
+
 # initial rfc stuff
 ASHOST = 'sbb243.sbb.dom'
 CLIENT = '003'
@@ -22,6 +22,7 @@ from dashboard.views.edit_user_data_views import ManageUserDataRepresentationVie
 from dashboard.views.location_data_views import LocationDataResponseView
 from dashboard.views.main_views import DashboardView, RegistrationView, \
     LoginView, LogoutView
+from dashboard.views.metrics_views import MetricsView
 
 urlpatterns = [
     # could be used later: path('admin/', admin.site.urls),
@@ -40,5 +41,8 @@ urlpatterns = [
     path("create/user-data-representation", ManageUserDataRepresentationView.as_view()),
 
     # data response for the template
-    path("get_data/", LocationDataResponseView.as_view())
+    path("get_data/", LocationDataResponseView.as_view()),
+
+    # metrics of the process for prometheus
+    path("metrics", MetricsView.as_view()),
 ]
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from dashboard.services.backfill_services import HL7Backfill
+
+
+class Command(BaseCommand):
+    help = "Loads archived HL7-files, gzip-compressed HL7-files and zip-archives of HL7-files into the database. " \
+           "The archives are neither extracted nor deleted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Archive directories or single HL7-files and archives.")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="The number of messages parsed in one transaction.")
+        parser.add_argument("--memory-budget", type=int, default=None,
+                            help="The max size (in characters) of the messages sorted in memory.")
+        parser.add_argument("--apply-workers", type=int, default=None,
+                            help="The number of threads parsing the messages of disjoint patients concurrently.")
+        parser.add_argument("--defer-indexes", action="store_true",
+                            help="Drop the secondary indexes during the parsing and recreate them at the end. "
+                                 "Only use it for an initial load, because the open stays are looked up without "
+                                 "their index.")
+        parser.add_argument("--progress-interval", type=float, default=None,
+                            help="The interval (in seconds) between two progress reports.")
+
+    def handle(self, *args, **options):
+        backfill = HL7Backfill(options["paths"], batch_size=options["batch_size"],
+                               memory_budget=options["memory_budget"], progress_interval=options["progress_interval"],
+                               report=self.stdout.write, apply_workers=options["apply_workers"])
+        backfill.run(defer_indexes=options["defer_indexes"])
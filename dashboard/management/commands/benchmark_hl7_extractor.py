@@ -0,0 +1,51 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from dashboard.services.hl7_services import HL7MessageParser
+
+
+class Command(BaseCommand):
+    help = "Compares the throughput of the fast HL7 field extractor with the parsing by the hl7 library."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="A HL7-file or a directory with HL7-files.")
+        parser.add_argument("--repeat", type=int, default=5, help="The number of runs of every extractor.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if os.path.isdir(path):
+            file_paths = [os.path.join(path, filename) for filename in os.listdir(path) if filename.endswith(".hl7")]
+        else:
+            file_paths = [path]
+
+        # read all message strings first, so that only the extraction is measured
+        hl7_message_strings = [hl7_message_string for file_path in file_paths
+                               for hl7_message_string in
+                               HL7MessageParser._generate_hl7_message_strings_from_file(file_path)]
+        if not hl7_message_strings:
+            self.stdout.write("There are no HL7-messages to extract.")
+            return
+
+        results = {}
+        for name, fast_extractor in (("hl7 library", False), ("fast extractor", True)):
+            # the best run is used, because it is the least disturbed by other processes
+            duration = min(self.__measure_extraction(hl7_message_strings, fast_extractor)
+                           for _ in range(options["repeat"]))
+            results[name] = len(hl7_message_strings) / duration
+            self.stdout.write(f"{name}: {len(hl7_message_strings)} messages in {duration:.3f} s "
+                              f"({results[name]:.1f} messages/s)")
+
+        self.stdout.write(f"speedup: {results['fast extractor'] / results['hl7 library']:.2f}x")
+
+    @staticmethod
+    def __measure_extraction(hl7_message_strings, fast_extractor: bool) -> float:
+        """Returns the duration of creating the Hl7Message instances and extracting their references."""
+
+        start = time.perf_counter()
+        for hl7_message_string in hl7_message_strings:
+            hl7_message = HL7MessageParser._create_hl7_message_from_string(hl7_message_string, fast_extractor)
+            if hl7_message:
+                hl7_message.get_references()
+        return time.perf_counter() - start
@@ -0,0 +1,81 @@
+import json
+import platform
+import shutil
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from dashboard.services.benchmark_services import ADTMessageGenerator, HL7IngestionBenchmark
+
+
+class Command(BaseCommand):
+    help = "Generates synthetic HL7 ADT-messages, parses them into a test database and reports the results as JSON. " \
+           "With several numbers of apply workers, every number is measured in a new test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wards", type=int, default=10, help="The number of generated wards.")
+        parser.add_argument("--rooms-per-ward", type=int, default=10, help="The number of rooms per ward.")
+        parser.add_argument("--beds-per-room", type=int, default=3, help="The number of beds per room.")
+        parser.add_argument("--patients", type=int, default=1000, help="The number of generated patients.")
+        parser.add_argument("--days", type=int, default=30, help="The number of days covered by the messages.")
+        parser.add_argument("--seed", type=int, default=0, help="The seed of the random generator.")
+        parser.add_argument("--messages-per-file", type=int, default=1, help="The number of messages per HL7-file.")
+        parser.add_argument("--batch-size", type=int, default=None, help="The batch size of the parsing.")
+        parser.add_argument("--workers", type=int, default=None, help="The number of parsing worker processes.")
+        parser.add_argument("--apply-workers", type=int, nargs="+", default=[None],
+                            help="The numbers of apply worker threads, e.g. 1 2 4 8 to measure the scaling.")
+        parser.add_argument("--output", default=None, help="A file for the JSON results instead of stdout.")
+
+    def handle(self, *args, **options):
+        runs = [self.__run(options, apply_workers) for apply_workers in options["apply_workers"]]
+
+        if len(runs) == 1:
+            results = runs[0]
+        else:
+            # the speedup of every number of apply workers compared to the first one
+            results = {"runs": runs,
+                       "speedup": {str(run["apply_workers"]): run["messages_per_second"] /
+                                   runs[0]["messages_per_second"] if runs[0]["messages_per_second"] else 0.0
+                                   for run in runs}}
+
+        results["options"] = {name: options[name] for name in (
+            "wards", "rooms_per_ward", "beds_per_room", "patients", "days", "seed", "messages_per_file",
+            "batch_size", "workers", "apply_workers")}
+        results["python"] = platform.python_version()
+        results["django"] = django.get_version()
+        results["database"] = connection.vendor
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    @staticmethod
+    def __run(options, apply_workers: int):
+        """Generates the HL7-files, parses them with the given number of apply workers and returns the results."""
+
+        directory = tempfile.mkdtemp()
+        try:
+            generator = ADTMessageGenerator(wards=options["wards"], rooms_per_ward=options["rooms_per_ward"],
+                                            beds_per_room=options["beds_per_room"], patients=options["patients"],
+                                            days=options["days"], seed=options["seed"])
+            trigger_events = generator.write_hl7_files(directory, options["messages_per_file"])
+
+            # the messages are parsed into a new test database, so that the real data is never changed
+            old_database_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                results = HL7IngestionBenchmark(directory, batch_size=options["batch_size"],
+                                                workers=options["workers"], apply_workers=apply_workers).run()
+            finally:
+                connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        finally:
+            shutil.rmtree(directory)
+
+        results["apply_workers"] = apply_workers
+        results["trigger_events"] = dict(trigger_events)
+        return results
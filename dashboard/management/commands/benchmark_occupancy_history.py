@@ -0,0 +1,79 @@
+import datetime
+import json
+import platform
+import shutil
+import tempfile
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from dashboard.orm.occupancy_sweeps import OCCUPANCY_HISTORY_BACKENDS, numpy
+from dashboard.services.benchmark_services import ADTMessageGenerator, OccupancyHistoryBenchmark, \
+    OverlapQueryPlanBenchmark, OCCUPANCY_BENCHMARK_PERIODS
+from dashboard.services.hl7_services import HL7MessageParser
+
+
+class Command(BaseCommand):
+    help = "Generates synthetic HL7 ADT-messages for more than a year, parses them into a test database and " \
+           "reports the occupancy history of every backend for a day, a month and a year as JSON. " \
+           "With --explain the query plans of the overlap filters of the periods are reported too."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--wards", type=int, default=10, help="The number of generated wards.")
+        parser.add_argument("--rooms-per-ward", type=int, default=10, help="The number of rooms per ward.")
+        parser.add_argument("--beds-per-room", type=int, default=3, help="The number of beds per room.")
+        parser.add_argument("--patients", type=int, default=5000, help="The number of generated patients.")
+        parser.add_argument("--days", type=int, default=400, help="The number of days covered by the messages.")
+        parser.add_argument("--seed", type=int, default=0, help="The seed of the random generator.")
+        parser.add_argument("--samples", type=int, default=10, help="The number of sample times per history.")
+        parser.add_argument("--backends", nargs="+", default=list(OCCUPANCY_HISTORY_BACKENDS),
+                            choices=OCCUPANCY_HISTORY_BACKENDS, help="The measured backends.")
+        parser.add_argument("--repetitions", type=int, default=3,
+                            help="The number of runs of every backend, of which the fastest is reported.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="The batch size of the parsing.")
+        parser.add_argument("--explain", action="store_true",
+                            help="Reports the query plans of the period queries with the old and new overlap filter.")
+        parser.add_argument("--output", default=None, help="A file for the JSON results instead of stdout.")
+
+    def handle(self, *args, **options):
+        start = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+        directory = tempfile.mkdtemp()
+        try:
+            generator = ADTMessageGenerator(wards=options["wards"], rooms_per_ward=options["rooms_per_ward"],
+                                            beds_per_room=options["beds_per_room"], patients=options["patients"],
+                                            days=options["days"], seed=options["seed"],
+                                            start=start.replace(tzinfo=None))
+            generator.write_hl7_files(directory, messages_per_file=1000)
+
+            # the messages are parsed into a new test database, so that the real data is never changed
+            old_database_name = connection.settings_dict["NAME"]
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                HL7MessageParser.parse_hl7_messages_from_directory(directory, batch_size=options["batch_size"])
+                end = start + datetime.timedelta(days=options["days"])
+                results = OccupancyHistoryBenchmark(end, samples=options["samples"], backends=options["backends"],
+                                                    repetitions=options["repetitions"]).run()
+                if options["explain"]:
+                    results["query_plans"] = {
+                        period_name: OverlapQueryPlanBenchmark(end - period, end, options["repetitions"]).run()
+                        for period_name, period in OCCUPANCY_BENCHMARK_PERIODS.items()}
+            finally:
+                connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        finally:
+            shutil.rmtree(directory)
+
+        results["options"] = {name: options[name] for name in (
+            "wards", "rooms_per_ward", "beds_per_room", "patients", "days", "seed", "samples", "backends",
+            "repetitions", "batch_size", "explain")}
+        results["python"] = platform.python_version()
+        results["django"] = django.get_version()
+        results["numpy"] = numpy.__version__ if numpy is not None else None
+        results["database"] = connection.vendor
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output + "\n")
+        else:
+            self.stdout.write(output)
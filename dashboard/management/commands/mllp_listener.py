@@ -0,0 +1,34 @@
+import asyncio
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from dashboard.services.mllp_services import MLLPServer
+
+
+class Command(BaseCommand):
+    help = "Listens for real-time HL7-messages with the minimal lower layer protocol (MLLP) and parses them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default=settings.MLLP_HOST, help="The address to listen on.")
+        parser.add_argument("--port", type=int, default=settings.MLLP_PORT, help="The port to listen on.")
+        parser.add_argument("--queue-size", type=int, default=settings.MLLP_QUEUE_SIZE,
+                            help="The max number of received messages waiting for the parsing.")
+
+    def handle(self, *args, **options):
+        server = MLLPServer(host=options["host"], port=options["port"], queue_size=options["queue_size"])
+
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+        # print the end-to-end latencies of the parsed messages
+        if server.latencies:
+            latencies = sorted(server.latencies)
+            self.stdout.write(
+                f"Parsed {server.number_of_messages} messages, latency median "
+                f"{statistics.median(latencies) * 1000:.1f} ms, "
+                f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f} ms, "
+                f"max {latencies[-1] * 1000:.1f} ms")
@@ -0,0 +1,53 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.services.replay_services import HL7Replayer
+
+
+class Command(BaseCommand):
+    help = "Replays recorded HL7-files at real time x speed-up into the HL7 directory or to the MLLP listener " \
+           "and reports the freshness lag between the message creation and the visibility of the stays."
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Directories or single HL7-files and archives of the recording.")
+        parser.add_argument("--speedup", type=float, default=1.0,
+                            help="The factor, by which the recording is replayed faster than real time.")
+        parser.add_argument("--target-directory", default=None,
+                            help="The directory for the replayed HL7-files instead of the HL7 directory.")
+        parser.add_argument("--mllp", default=None, metavar="HOST:PORT",
+                            help="Send the replayed messages to the MLLP listener instead of writing HL7-files.")
+        parser.add_argument("--poll-interval", type=float, default=None,
+                            help="The interval (in seconds) for polling the visibility of the messages.")
+        parser.add_argument("--timeout", type=float, default=None,
+                            help="The max time (in seconds) after the last message, until all have to be visible.")
+        parser.add_argument("--output", default=None, help="A file for the JSON results.")
+
+    def handle(self, *args, **options):
+        if not settings.HL7_DEDUPLICATION:
+            raise CommandError("The visibility of the replayed messages is measured with their stored control ids, "
+                               "so HL7_DEDUPLICATION has to be enabled.")
+        if options["speedup"] <= 0:
+            raise CommandError("The speed-up has to be positive.")
+
+        mllp_address = None
+        if options["mllp"]:
+            host, _, port = options["mllp"].rpartition(":")
+            if not host or not port.isdigit():
+                raise CommandError("The MLLP listener has to be given as HOST:PORT.")
+            mllp_address = (host, int(port))
+
+        replayer = HL7Replayer(options["paths"], speedup=options["speedup"],
+                               target_directory=options["target_directory"], mllp_address=mllp_address,
+                               poll_interval=options["poll_interval"], timeout=options["timeout"],
+                               report=self.stdout.write)
+        results = replayer.run()
+
+        self.stdout.write(f"Freshness lag of {results['visible']} visible messages "
+                          f"({results['not_visible']} not visible, {results['unprobed']} without control id):")
+        self.stdout.write(str(replayer.histogram))
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(json.dumps(results, indent=2, sort_keys=True) + "\n")
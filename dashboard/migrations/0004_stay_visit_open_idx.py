@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0003_alter_discharge_stay'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stay',
+            index=models.Index(fields=['visit', 'end_date', 'id'], name='stay_visit_open_idx'),
+        ),
+    ]
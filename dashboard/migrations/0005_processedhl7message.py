@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_stay_visit_open_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedHL7Message',
+            fields=[
+                ('control_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('processed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
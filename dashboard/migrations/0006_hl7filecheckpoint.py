@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0005_processedhl7message'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HL7FileCheckpoint',
+            fields=[
+                ('path', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('file_id', models.CharField(max_length=64)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
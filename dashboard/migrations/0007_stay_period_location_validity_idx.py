@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0006_hl7filecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bed',
+            index=models.Index(fields=['date_of_activation', 'date_of_expiry'], name='bed_validity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['date_of_activation', 'date_of_expiry'], name='room_validity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stay',
+            index=models.Index(fields=['ward', 'start_date', 'end_date'], name='stay_ward_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stay',
+            index=models.Index(fields=['room', 'start_date', 'end_date'], name='stay_room_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stay',
+            index=models.Index(fields=['bed', 'start_date', 'end_date'], name='stay_bed_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ward',
+            index=models.Index(fields=['date_of_activation', 'date_of_expiry'], name='ward_validity_idx'),
+        ),
+    ]
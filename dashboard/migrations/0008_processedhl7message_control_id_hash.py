@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:05
+
+import hashlib
+
+from django.db import migrations
+
+
+def hash_control_ids(apps, schema_editor):
+    """Replaces the stored control ids by their sha256 hashes."""
+
+    ProcessedHL7Message = apps.get_model("dashboard", "ProcessedHL7Message")
+    processed_messages = list(ProcessedHL7Message.objects.all())
+    ProcessedHL7Message.objects.all().delete()
+    ProcessedHL7Message.objects.bulk_create(
+        [ProcessedHL7Message(control_id_hash=hashlib.sha256(processed_message.control_id_hash.encode()).hexdigest(),
+                             processed_at=processed_message.processed_at)
+         for processed_message in processed_messages],
+        ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0007_stay_period_location_validity_idx'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='processedhl7message',
+            old_name='control_id',
+            new_name='control_id_hash',
+        ),
+        migrations.RunPython(hash_control_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0008_processedhl7message_control_id_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HL7CacheGeneration',
+            fields=[
+                ('writer', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('process', models.CharField(db_index=True, max_length=32)),
+                ('generation', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
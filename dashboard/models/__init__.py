@@ -1,2 +1,3 @@
 from .user_models import UserDataRepresentation, DataRepresentation, User
-from .hospital_models import Patient, Visit, Ward, Room, Stay, Discharge
\ No newline at end of file
+from .hospital_models import Patient, Visit, Ward, Room, Stay, Discharge
+from .hl7_models import ProcessedHL7Message, HL7FileCheckpoint, HL7CacheGeneration
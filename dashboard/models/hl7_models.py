@@ -0,0 +1,35 @@
+from django.db import models
+from django.utils import timezone
+
+
+class ProcessedHL7Message(models.Model):
+    """
+    The message control id (MSH-10) of every parsed HL7-message within the retention period.
+    It is stored as its sha256 hash, so that control ids of any length fit into the primary key.
+    """
+
+    control_id_hash = models.CharField(primary_key=True, max_length=64)
+    processed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+
+class HL7FileCheckpoint(models.Model):
+    """The read position of a HL7-file, that is tailed while it is written."""
+
+    path = models.CharField(primary_key=True, max_length=255)
+    # the device and inode of the file, so that a replaced file is read from the start
+    file_id = models.CharField(max_length=64)
+    offset = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+
+class HL7CacheGeneration(models.Model):
+    """
+    The number of commits of a writing thread, that change the locations or stays cached by the HL7 parsing.
+    Every process compares the generations of the other processes, so that it clears its caches after their commits.
+    """
+
+    # the id of the process and the name of the thread, so that the threads of a process never lock the same row
+    writer = models.CharField(primary_key=True, max_length=255)
+    process = models.CharField(max_length=32, db_index=True)
+    generation = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
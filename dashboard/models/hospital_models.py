@@ -30,6 +30,10 @@ class Location(models.Model):
 
     class Meta:
         abstract = True
+        indexes = [
+            # the locations are filtered by their activation for every time and period
+            models.Index(fields=["date_of_activation", "date_of_expiry"], name="%(class)s_validity_idx"),
+        ]
 
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self._get_pk_val() == other._get_pk_val()
@@ -64,6 +68,16 @@ class Stay(models.Model):
     ward = models.ForeignKey(Ward, models.CASCADE)
     room = models.ForeignKey(Room, models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # the last open stay (end_date == None) of a visit is looked up for nearly every HL7-message
+            models.Index(fields=["visit", "end_date", "id"], name="stay_visit_open_idx"),
+            # the stays of the locations are filtered by the overlap with a time or period for every occupancy
+            models.Index(fields=["ward", "start_date", "end_date"], name="stay_ward_period_idx"),
+            models.Index(fields=["room", "start_date", "end_date"], name="stay_room_period_idx"),
+            models.Index(fields=["bed", "start_date", "end_date"], name="stay_bed_period_idx"),
+        ]
+
 
 class Discharge(models.Model):
     movement_id = models.IntegerField()
@@ -6,6 +6,68 @@ from django.db.models import functions, expressions
 from django.utils import timezone
 
 from dashboard.models import hospital_models
+from dashboard.orm.occupancy_sweeps import ORM_BACKEND, SWEEP_BACKEND, OCCUPANCY_HISTORY_BACKENDS, clip_interval, \
+    find_occupancy_extremes, get_interval_counter
+
+
+def get_overlap_filter(start_field: str, end_field: str, start: datetime.datetime, end: datetime.datetime,
+                       open_end: bool = False):
+    """
+    Returns the filter for the rows, whose period of time from the start_field to the end_field overlaps
+    a given period of time including its borders. The end_field of a row without end is None, if open_end is True.
+    The two comparisons are equivalent to all cases of overlapping periods, but they can use the indexes
+    on the fields instead of a disjunction of five cases.
+    """
+
+    overlap_filter = models.Q(**{f"{start_field}__lte": end})
+    if open_end:
+        return overlap_filter & (models.Q(**{f"{end_field}__isnull": True}) |
+                                 models.Q(**{f"{end_field}__gte": start}))
+    return overlap_filter & models.Q(**{f"{end_field}__gte": start})
+
+
+def get_count_subquery(query_set: models.QuerySet):
+    """
+    Returns a subquery counting the rows of a given QuerySet, that is filtered by an OuterRef to the location.
+    The rows are counted without a join in the outer query, so that they are not multiplied by its other joins.
+    """
+
+    return models.Subquery(
+        query_set.annotate(count=expressions.Func(models.F("id"), function="Count")).values("count"),
+        output_field=models.IntegerField()
+    )
+
+
+def get_active_stay_count(stay_location_field: str, time: datetime.datetime):
+    """Returns a subquery counting the stays of the location at a given time by the given field of the Stay-model."""
+
+    return get_count_subquery(hospital_models.Stay.objects.filter(
+        models.Q(**{stay_location_field: models.OuterRef("id")}) &
+        models.Q(start_date__lt=time) & (models.Q(end_date=None) | models.Q(end_date__gt=time))
+    ))
+
+
+def get_active_bed_count(bed_location_field: str, time: datetime.datetime):
+    """Returns a subquery counting the beds of the location at a given time by the given field of the Bed-model."""
+
+    return get_count_subquery(hospital_models.Bed.objects.filter(
+        models.Q(**{bed_location_field: models.OuterRef("id")}) &
+        models.Q(date_of_activation__lt=time, date_of_expiry__gt=time)
+    ))
+
+
+def get_age(time: datetime.datetime):
+    """
+    Returns the expression of the age of the patient of a stay at a given time.
+    The age is calculated from the difference between the years and whether the birthday has already taken place.
+    """
+
+    return time.year - models.F('visit__patient__date_of_birth__year') - functions.Cast(
+        models.Q(visit__patient__date_of_birth__month__gt=time.month) | models.Q(
+            visit__patient__date_of_birth__month=time.month) & models.Q(
+            visit__patient__date_of_birth__day__gt=time.day),
+        output_field=models.IntegerField()
+    )
 
 
 class SexAnnotationQuerySet(models.QuerySet):
@@ -34,6 +96,29 @@ class SexAnnotationQuerySet(models.QuerySet):
             number_of_women=number_of_women
         )
 
+    def grouped_sex_annotation(self, time: datetime.datetime, stay_location_field: str):
+        """
+        Returns the given QuerySet with the annotated number of persons per sex for a given time like sex_annotation,
+        but every number is counted by its own subquery over the stays connected by the given field of the Stay-model,
+        so that the stays are not multiplied by the other joins of the locations.
+        """
+
+        # the stays are only counted, while the location is active, like in sex_annotation
+        location_time_filter = models.Q(date_of_activation__lt=time) & (
+                models.Q(date_of_expiry__isnull=True) | models.Q(date_of_expiry__gt=time))
+
+        return self.annotate(**{
+            name: models.Case(
+                models.When(location_time_filter, then=get_count_subquery(hospital_models.Stay.objects.filter(
+                    visit__patient__sex=sex, **{stay_location_field: models.OuterRef("id")}))),
+                default=models.Value(0),
+                output_field=models.IntegerField()
+            )
+            for name, sex in (("number_of_diverse", hospital_models.Patient.SexChoices.DIVERSE),
+                              ("number_of_men", hospital_models.Patient.SexChoices.MALE),
+                              ("number_of_women", hospital_models.Patient.SexChoices.FEMALE))
+        })
+
     def sex_over_period_annotation(self, start: datetime.datetime, end: datetime.datetime):
         """Returns the given QuerySet with the annotated number of persons per sex for a given period of time."""
 
@@ -57,11 +142,7 @@ class SexAnnotationQuerySet(models.QuerySet):
         )
 
         # create the reusable period of time filter for all different sexes
-        stay_period_filter = (models.Q(stay__end_date=None, stay__start_date__lt=end) |
-                              models.Q(stay__start_date__range=(start, end)) |
-                              models.Q(stay__end_date__range=(start, end)) |
-                              models.Q(stay__start_date__lt=start, stay__end_date__gt=start) |
-                              models.Q(stay__start_date__lt=end, stay__end_date__gt=end))
+        stay_period_filter = get_overlap_filter("stay__start_date", "stay__end_date", start, end, open_end=True)
 
         return self.alias(
             # define an alias for the sum of the periods of time (in microseconds) of all stays
@@ -128,14 +209,7 @@ class AgeAnnotationQuerySet(models.QuerySet):
             models.Q(start_date__lt=time) & (models.Q(end_date__isnull=True) | models.Q(end_date__gt=time))
         ).annotate(
             # annotate the age of every stay
-            # The age is calculated from the difference between the years
-            # and whether the birthday has already taken place or not
-            age=time.year - models.F('visit__patient__date_of_birth__year') - functions.Cast(
-                models.Q(visit__patient__date_of_birth__month__gt=time.month) | models.Q(
-                    visit__patient__date_of_birth__month=time.month) & models.Q(
-                    visit__patient__date_of_birth__day__gt=time.day),
-                output_field=models.IntegerField()
-            )
+            age=get_age(time)
         ).annotate(
             # annotate the average of all the previous calculated ages of the location
             average_age=models.Func(models.F("age"), function="Avg")
@@ -143,6 +217,24 @@ class AgeAnnotationQuerySet(models.QuerySet):
 
         return self.annotate(average_age=models.Subquery(average_age)).distinct()
 
+    def grouped_age_annotation(self, time: datetime.datetime, stay_location_field: str):
+        """
+        Returns the given QuerySet with the average age for a given time, that is averaged by a subquery
+        over the stays connected by the given field of the Stay-model, so that it is one value for every location.
+        """
+
+        # create the average age subquery for every location and the given time
+        average_age = hospital_models.Stay.objects.filter(
+            models.Q(**{stay_location_field: models.OuterRef("id")}) &
+            models.Q(start_date__lt=time) & (models.Q(end_date__isnull=True) | models.Q(end_date__gt=time))
+        ).annotate(
+            age=get_age(time)
+        ).annotate(
+            average_age=models.Func(models.F("age"), function="Avg")
+        ).values("average_age")
+
+        return self.annotate(average_age=models.Subquery(average_age))
+
     def age_over_period_annotation(self, start: datetime.datetime, end: datetime.datetime):
         """Returns the given QuerySet with the annotated average age for a given period of time."""
 
@@ -152,11 +244,7 @@ class AgeAnnotationQuerySet(models.QuerySet):
             id__in=models.OuterRef("stay__id")
         ).filter(
             # filter for the given period of time
-            models.Q(end_date=None, start_date__lt=end) |
-            models.Q(start_date__range=(start, end)) |
-            models.Q(end_date__range=(start, end)) |
-            models.Q(start_date__lt=start, end_date__gt=start) |
-            models.Q(start_date__lt=end, end_date__gt=end)
+            get_overlap_filter("start_date", "end_date", start, end, open_end=True)
         ).alias(
             # define the borders of the period of time based on the end_date and start_date as alias
             adjusted_start_date=models.Case(
@@ -244,12 +332,7 @@ class TimeQuerySet(models.QuerySet, ABC):
     def filter_for_period(self, start: datetime, end: datetime):
         """Returns the given QuerySet filtered by a period of time."""
 
-        return self.filter(
-            models.Q(date_of_activation__range=(start, end)) |
-            models.Q(date_of_expiry__range=(start, end)) |
-            models.Q(date_of_activation__lt=start, date_of_expiry__gt=start) |
-            models.Q(date_of_activation__lt=end, date_of_expiry__gt=end)
-        )
+        return self.filter(get_overlap_filter("date_of_activation", "date_of_expiry", start, end))
 
 
 class LocationInformationQuerySet(TimeQuerySet, ABC):
@@ -292,11 +375,96 @@ class LocationOccupancyQuerySet(TimeQuerySet, ABC):
         """
         return self.filter_for_time(time).get_occupancy(time)
 
+    def occupancy_history(self, times, backend: str = SWEEP_BACKEND):
+        """
+        Returns the occupancy like the occupancy method for every given time in the order of the times.
+        Except for the orm backend with a query per time, the stays and beds are fetched once for all times,
+        so that the number of queries does not depend on them, and counted by the given backend.
+        """
+
+        if backend not in OCCUPANCY_HISTORY_BACKENDS:
+            raise ValueError(f"The occupancy history backend {backend} is not one of {OCCUPANCY_HISTORY_BACKENDS}")
+
+        times = list(times)
+        if not times:
+            return []
+        if backend == ORM_BACKEND:
+            return [self.occupancy(time) for time in times]
+        return self.get_occupancy_history(times, min(times), max(times), get_interval_counter(backend))
+
+    @abstractmethod
+    def occupancy_extremes(self, start: timezone.datetime, end: timezone.datetime):
+        """
+        Returns the peak and trough number of occupied beds between start and end and the times they are reached.
+        They are found by a sweep over the starts and ends of the stays, because they can not be annotated.
+        """
+        pass
+
     @abstractmethod
     def get_occupancy(self, time: timezone.datetime):
         """Returns the given QuerySet with the annotated occupancy for a given time."""
         pass
 
+    @abstractmethod
+    def get_occupancy_history(self, times, start: timezone.datetime, end: timezone.datetime, count_intervals_at):
+        """
+        Returns the occupancy for every given time between start and end in the order of the times.
+        The stays and beds at the times are counted with the given function of the occupancy_sweeps module.
+        """
+        pass
+
+    def get_location_occupancy_history(self, times, start: timezone.datetime, end: timezone.datetime,
+                                       count_intervals_at, stay_location_field: str, bed_location_field: str):
+        """
+        Returns the locations with their occupancy as list of dictionaries for every given time.
+        The stays and beds are connected to the locations by the given fields of the Stay- and Bed-model.
+        """
+
+        # only the locations, stays and beds, that are active at any time between start and end, are needed
+        locations = list(self.filter(date_of_activation__lt=end, date_of_expiry__gt=start).values())
+        location_ids = [location["id"] for location in locations]
+
+        stay_intervals = {location_id: [] for location_id in location_ids}
+        for location_id, start_date, end_date in hospital_models.Stay.objects.filter(
+                models.Q(start_date__lt=end) & (models.Q(end_date=None) | models.Q(end_date__gt=start)),
+                **{f"{stay_location_field}__in": location_ids}
+        ).values_list(stay_location_field, "start_date", "end_date"):
+            stay_intervals[location_id].append((start_date, end_date))
+
+        bed_intervals = {location_id: [] for location_id in location_ids}
+        for location_id, date_of_activation, date_of_expiry in hospital_models.Bed.objects.filter(
+                date_of_activation__lt=end, date_of_expiry__gt=start, **{f"{bed_location_field}__in": location_ids}
+        ).values_list(bed_location_field, "date_of_activation", "date_of_expiry"):
+            bed_intervals[location_id].append((date_of_activation, date_of_expiry))
+
+        # count the occupancy of every location at all times and keep the locations, that are active at the time
+        history = [[] for _ in times]
+        for location in locations:
+            numbers = count_intervals_at(stay_intervals[location["id"]], times)
+            max_numbers = count_intervals_at(bed_intervals[location["id"]], times)
+            for index, time in enumerate(times):
+                if location["date_of_activation"] < time < location["date_of_expiry"]:
+                    history[index].append(dict(location, number=numbers[index], max_number=max_numbers[index]))
+
+        return history
+
+    def get_location_occupancy_extremes(self, start: timezone.datetime, end: timezone.datetime,
+                                        stay_location_field: str):
+        """
+        Returns the occupancy extremes of every location by its id.
+        The stays are connected to the locations by the given field of the Stay-model.
+        """
+
+        stay_intervals = {location_id: [] for location_id in self.values_list("id", flat=True)}
+        for location_id, start_date, end_date in hospital_models.Stay.objects.filter(
+                models.Q(start_date__lt=end) & (models.Q(end_date=None) | models.Q(end_date__gt=start)),
+                **{f"{stay_location_field}__in": list(stay_intervals)}
+        ).values_list(stay_location_field, "start_date", "end_date"):
+            stay_intervals[location_id].append((start_date, end_date))
+
+        return {location_id: find_occupancy_extremes(intervals, start, end)
+                for location_id, intervals in stay_intervals.items()}
+
 
 class WardQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet, LocationFilterQuerySet,
                    SexAnnotationQuerySet):
@@ -309,11 +477,9 @@ class WardQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet, Locat
         return self.filter(room__id=room_id)
 
     def get_information(self, time: timezone.datetime):
-        return self.sex_annotation(time).annotate(
-            # annotate the max number of beds by counting them
-            max_number=models.Count("room__bed", distinct=True,
-                                    filter=models.Q(room__bed__date_of_activation__lt=time,
-                                                    room__bed__date_of_expiry__gt=time)),
+        return self.grouped_sex_annotation(time, "ward").annotate(
+            # annotate the max number of beds by counting them in a subquery
+            max_number=get_active_bed_count("room__ward", time),
             # annotate the number of occupied beds by sum up the number of people of all sexes
             number=models.F("number_of_men") + models.F("number_of_women") + models.F("number_of_diverse")
         )
@@ -322,12 +488,7 @@ class WardQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet, Locat
         # create the subquery for the max number of beds
         bed_count = hospital_models.Bed.objects.filter(
             models.Q(room__ward__id=expressions.OuterRef("id")) &
-            (
-                    models.Q(date_of_activation__range=(start, end)) |
-                    models.Q(date_of_expiry__range=(start, end)) |
-                    models.Q(date_of_activation__lt=start, date_of_expiry__gt=start) |
-                    models.Q(date_of_activation__lt=end, date_of_expiry__gt=end)
-            )
+            get_overlap_filter("date_of_activation", "date_of_expiry", start, end)
         ).annotate(count=expressions.Func(models.F("id"), function="Count")).values("count")
 
         return self.sex_over_period_annotation(start, end).annotate(
@@ -338,16 +499,18 @@ class WardQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet, Locat
 
     def get_occupancy(self, time: timezone.datetime):
         return self.annotate(
-            # annotate the number of occupied beds by counting the connected stays
-            number=models.Count('stay', distinct=True,
-                                filter=models.Q(stay__start_date__lt=time) & (
-                                        models.Q(stay__end_date=None) | models.Q(stay__end_date__gt=time))),
-            # annotate the max number of beds by counting them
-            max_number=models.Count("room__bed", distinct=True,
-                                    filter=models.Q(room__bed__date_of_activation__lt=time,
-                                                    room__bed__date_of_expiry__gt=time))
+            # annotate the number of occupied beds by counting the connected stays in a subquery
+            number=get_active_stay_count("ward", time),
+            # annotate the max number of beds by counting them in a subquery
+            max_number=get_active_bed_count("room__ward", time)
         )
 
+    def get_occupancy_history(self, times, start: timezone.datetime, end: timezone.datetime, count_intervals_at):
+        return self.get_location_occupancy_history(times, start, end, count_intervals_at, "ward_id", "room__ward_id")
+
+    def occupancy_extremes(self, start: timezone.datetime, end: timezone.datetime):
+        return self.get_location_occupancy_extremes(start, end, "ward_id")
+
 
 class RoomQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet, LocationFilterQuerySet,
                    SexAnnotationQuerySet, AgeAnnotationQuerySet):
@@ -360,11 +523,9 @@ class RoomQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet, Locat
         return self.filter_for_id(room_id)
 
     def get_information(self, time: timezone.datetime):
-        return self.sex_annotation(time).age_annotation(time).annotate(
-            # annotate the max number of beds by counting them
-            max_number=models.Count("bed", distinct=True,
-                                    filter=models.Q(bed__date_of_activation__lt=time,
-                                                    bed__date_of_expiry__gt=time)),
+        return self.grouped_sex_annotation(time, "room").grouped_age_annotation(time, "room").annotate(
+            # annotate the max number of beds by counting them in a subquery
+            max_number=get_active_bed_count("room", time),
             # annotate the number of occupied beds by sum up the number of people of all sexes
             number=models.F("number_of_men") + models.F("number_of_women") + models.F("number_of_diverse")
         )
@@ -373,12 +534,7 @@ class RoomQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet, Locat
         # create the subquery for the max number of beds
         bed_count = hospital_models.Bed.objects.filter(
             models.Q(room__id=expressions.OuterRef("id")) &
-            (
-                    models.Q(date_of_activation__range=(start, end)) |
-                    models.Q(date_of_expiry__range=(start, end)) |
-                    models.Q(date_of_activation__lt=start, date_of_expiry__gt=start) |
-                    models.Q(date_of_activation__lt=end, date_of_expiry__gt=end)
-            )
+            get_overlap_filter("date_of_activation", "date_of_expiry", start, end)
         ).annotate(count=expressions.Func(models.F("id"), function="Count")).values("count")
 
         return self.age_over_period_annotation(start, end).sex_over_period_annotation(start, end).annotate(
@@ -389,16 +545,18 @@ class RoomQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet, Locat
 
     def get_occupancy(self, time: timezone.datetime):
         return self.annotate(
-            # annotate the number of occupied beds by counting the connected stays
-            number=models.Count('stay', distinct=True,
-                                filter=models.Q(stay__start_date__lt=time) & (
-                                        models.Q(stay__end_date=None) | models.Q(stay__end_date__gt=time))),
-            # annotate the max number of beds by counting them
-            max_number=models.Count("bed", distinct=True,
-                                    filter=models.Q(bed__date_of_activation__lt=time,
-                                                    bed__date_of_expiry__gt=time))
+            # annotate the number of occupied beds by counting the connected stays in a subquery
+            number=get_active_stay_count("room", time),
+            # annotate the max number of beds by counting them in a subquery
+            max_number=get_active_bed_count("room", time)
         )
 
+    def get_occupancy_history(self, times, start: timezone.datetime, end: timezone.datetime, count_intervals_at):
+        return self.get_location_occupancy_history(times, start, end, count_intervals_at, "room_id", "room_id")
+
+    def occupancy_extremes(self, start: timezone.datetime, end: timezone.datetime):
+        return self.get_location_occupancy_extremes(start, end, "room_id")
+
 
 class BedQuerySet(LocationInformationQuerySet, LocationFilterQuerySet, SexAnnotationQuerySet,
                   AgeAnnotationQuerySet):
@@ -439,11 +597,7 @@ class HospitalBedQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet
 
     def get_information_for_period(self, start: datetime, end: datetime):
         # create the subquery for the max number of beds
-        stay_period_filter = (models.Q(stay__end_date=None, stay__start_date__lt=end) |
-                              models.Q(stay__start_date__range=(start, end)) |
-                              models.Q(stay__end_date__range=(start, end)) |
-                              models.Q(stay__start_date__lt=start, stay__end_date__gt=start) |
-                              models.Q(stay__start_date__lt=end, stay__end_date__gt=end))
+        stay_period_filter = get_overlap_filter("stay__start_date", "stay__end_date", start, end, open_end=True)
 
         query_set = self.sex_over_period_annotation(start, end)
 
@@ -468,3 +622,31 @@ class HospitalBedQuerySet(LocationInformationQuerySet, LocationOccupancyQuerySet
             # annotate the max number of beds by counting them
             max_number=models.Count("id", distinct=True)
         )
+
+    def get_occupancy_history(self, times, start: timezone.datetime, end: timezone.datetime, count_intervals_at):
+        bed_intervals, stay_intervals = self.get_bed_and_stay_intervals(start, end)
+        numbers = count_intervals_at(stay_intervals, times)
+        max_numbers = count_intervals_at(list(bed_intervals.values()), times)
+        return [{"number": number, "max_number": max_number} for number, max_number in zip(numbers, max_numbers)]
+
+    def occupancy_extremes(self, start: timezone.datetime, end: timezone.datetime):
+        return find_occupancy_extremes(self.get_bed_and_stay_intervals(start, end)[1], start, end)
+
+    def get_bed_and_stay_intervals(self, start: timezone.datetime, end: timezone.datetime):
+        """Returns the activations of the beds by their id and the stays in them, that overlap start and end."""
+
+        beds = self.filter(date_of_activation__lt=end, date_of_expiry__gt=start)
+        bed_intervals = {bed_id: (date_of_activation, date_of_expiry) for bed_id, date_of_activation, date_of_expiry
+                         in beds.values_list("id", "date_of_activation", "date_of_expiry")}
+
+        # a stay is only counted, while its bed is active, so it is clipped to the activation of its bed
+        stay_intervals = []
+        for bed_id, start_date, end_date in hospital_models.Stay.objects.filter(
+                models.Q(start_date__lt=end) & (models.Q(end_date=None) | models.Q(end_date__gt=start)),
+                bed__in=beds.values("id")
+        ).values_list("bed_id", "start_date", "end_date"):
+            # a bed created between the two queries is not counted
+            if bed_id in bed_intervals:
+                stay_intervals.append(clip_interval(start_date, end_date, *bed_intervals[bed_id]))
+
+        return bed_intervals, stay_intervals
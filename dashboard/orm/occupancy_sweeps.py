@@ -0,0 +1,129 @@
+import datetime
+
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for the numpy backend of the occupancy history
+    numpy = None
+
+# the backends of the occupancy history: a query per time, a sweep in python and a vectorized sweep with numpy
+ORM_BACKEND = "orm"
+SWEEP_BACKEND = "sweep"
+NUMPY_BACKEND = "numpy"
+OCCUPANCY_HISTORY_BACKENDS = (ORM_BACKEND, SWEEP_BACKEND, NUMPY_BACKEND)
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+MICROSECOND = datetime.timedelta(microseconds=1)
+# the end of an interval without end, that is after every time
+OPEN_END = 2 ** 63 - 1
+
+
+def clip_interval(start, end, clip_start, clip_end):
+    """
+    Returns the part of a (start, end) interval inside a (clip_start, clip_end) interval.
+    An end of None is open and the part may be empty, if its start is not before its end.
+    """
+
+    if end is None or (clip_end is not None and clip_end < end):
+        end = clip_end
+    return max(start, clip_start), end
+
+
+def count_intervals_at(intervals, times):
+    """
+    Returns the number of the given (start, end) intervals containing every given time in the order of the times.
+    An interval contains a time, if it starts before the time and ends after it or has no end.
+    The starts, the ends and the times are sorted once and the counts are computed in one sweep over them.
+    """
+
+    # empty intervals never contain a time, but they would be subtracted by their end
+    starts = sorted(start for start, end in intervals if end is None or start < end)
+    ends = sorted(end for start, end in intervals if end is not None and start < end)
+
+    counts = [0] * len(times)
+    number_of_starts = number_of_ends = 0
+    for index in sorted(range(len(times)), key=times.__getitem__):
+        time = times[index]
+        while number_of_starts < len(starts) and starts[number_of_starts] < time:
+            number_of_starts += 1
+        while number_of_ends < len(ends) and ends[number_of_ends] <= time:
+            number_of_ends += 1
+        # every interval ending until the time has also started before it
+        counts[index] = number_of_starts - number_of_ends
+
+    return counts
+
+
+def find_occupancy_extremes(intervals, start, end):
+    """
+    Returns the peak and the trough number of the given (start, end) intervals containing the times between
+    the given start and end with the first time, from which on the number is reached, as dictionary.
+    The number only changes at the starts and ends of the intervals, so the exact extremes are found in one sweep
+    over the sorted changes. It is taken between the changes, so that the instant of a transfer, at which one
+    interval ends and the next one starts, is not a trough.
+    """
+
+    # the number at the start of the period and the sum of the changes at every later time
+    number = 0
+    changes = dict()
+    for interval_start, interval_end in intervals:
+        interval_start, interval_end = clip_interval(interval_start, interval_end, start, end)
+        if interval_start >= interval_end:
+            continue
+        if interval_start > start:
+            changes[interval_start] = changes.get(interval_start, 0) + 1
+        else:
+            number += 1
+        if interval_end < end:
+            changes[interval_end] = changes.get(interval_end, 0) - 1
+
+    extremes = {"peak_number": number, "peak_time": start, "trough_number": number, "trough_time": start}
+    for time in sorted(changes):
+        number += changes[time]
+        if number > extremes["peak_number"]:
+            extremes["peak_number"], extremes["peak_time"] = number, time
+        elif number < extremes["trough_number"]:
+            extremes["trough_number"], extremes["trough_time"] = number, time
+
+    return extremes
+
+
+def to_microseconds(time: datetime.datetime):
+    """Returns the exact number of microseconds between the epoch and a given aware datetime."""
+    return (time - EPOCH) // MICROSECOND
+
+
+def count_intervals_at_with_numpy(intervals, times):
+    """
+    Returns the number of the given (start, end) intervals of datetimes containing every given time like
+    count_intervals_at. The starts and ends are sorted once as int64 arrays of microseconds and the counts of all
+    times are the differences of two vectorized binary searches, so that thousands of times are cheap.
+    """
+
+    starts = numpy.fromiter((to_microseconds(start) for start, _ in intervals), numpy.int64, len(intervals))
+    ends = numpy.fromiter((OPEN_END if end is None else to_microseconds(end) for _, end in intervals),
+                          numpy.int64, len(intervals))
+    sample_times = numpy.fromiter((to_microseconds(time) for time in times), numpy.int64, len(times))
+
+    # empty intervals never contain a time, but they would be subtracted by their end
+    non_empty = starts < ends
+    starts = numpy.sort(starts[non_empty])
+    ends = numpy.sort(ends[non_empty])
+
+    # the intervals started before a time minus the intervals ended until it
+    counts = numpy.searchsorted(starts, sample_times, side="left") - numpy.searchsorted(ends, sample_times,
+                                                                                        side="right")
+    return counts.tolist()
+
+
+def get_interval_counter(backend: str):
+    """
+    Returns the function counting the intervals at the times for a given backend of the occupancy history.
+    The numpy backend falls back to the sweep in python, if numpy is not installed.
+    """
+
+    if backend == NUMPY_BACKEND and numpy is not None:
+        return count_intervals_at_with_numpy
+    if backend in (SWEEP_BACKEND, NUMPY_BACKEND):
+        return count_intervals_at
+    raise ValueError(f"The occupancy history backend {backend} does not count intervals")
@@ -0,0 +1,242 @@
+import datetime
+import gzip
+import io
+import logging
+import os
+import time
+import zipfile
+
+from django.conf import settings
+from django.db import connection
+
+from dashboard.models import Patient, Visit, Ward, Room, ProcessedHL7Message
+from dashboard.models.hospital_models import Bed, Stay, Discharge
+from dashboard.services.hl7_services import HL7MessageParser, HL7_FILE_ENCODING, get_message_creation
+from dashboard.services.hl7_sort_services import HL7MessageSorter
+from dashboard.services.trace_services import HL7Trace
+
+logger = logging.getLogger(__name__)
+
+HL7_ARCHIVE_EXTENSIONS = (".hl7", ".gz", ".zip")
+# models written by the parsing, whose secondary indexes can be deferred
+HL7_BACKFILL_MODELS = (Patient, Visit, Ward, Room, Bed, Stay, Discharge, ProcessedHL7Message)
+
+
+class HL7ArchiveReader:
+    """
+    A class for reading the HL7-message strings from archive directories.
+    Besides HL7-files, gzip-compressed HL7-files and zip-archives of HL7-files are read as streams,
+    so that the archives are never extracted to disk.
+    """
+
+    def __init__(self, paths):
+        self._paths = paths
+
+    def get_file_paths(self):
+        """Returns the paths of all HL7-files and archives in the given directories and files sorted by path."""
+
+        file_paths = []
+        for path in self._paths:
+            if os.path.isdir(path):
+                for directory, _, filenames in os.walk(path):
+                    file_paths += [os.path.join(directory, filename) for filename in filenames
+                                   if filename.lower().endswith(HL7_ARCHIVE_EXTENSIONS)]
+            else:
+                file_paths.append(path)
+
+        return sorted(file_paths)
+
+    @classmethod
+    def generate_hl7_message_strings(cls, file_path: str):
+        """Yields the HL7-message strings of a HL7-file, a gzip-compressed HL7-file or a zip-archive."""
+
+        if file_path.lower().endswith(".zip"):
+            with zipfile.ZipFile(file_path) as zip_file:
+                for member in zip_file.infolist():
+                    name = member.filename.lower()
+                    if not member.is_dir() and name.endswith((".hl7", ".gz")):
+                        with zip_file.open(member) as member_file:
+                            yield from cls.__generate_hl7_message_strings_from_binary_file(member_file, name)
+        else:
+            with open(file_path, "rb") as binary_file:
+                yield from cls.__generate_hl7_message_strings_from_binary_file(binary_file, file_path.lower())
+
+    @staticmethod
+    def __generate_hl7_message_strings_from_binary_file(binary_file, name: str):
+        """Yields the HL7-message strings of an opened binary file, that is decompressed if its name ends with gz."""
+
+        if name.endswith(".gz"):
+            binary_file = gzip.GzipFile(fileobj=binary_file)
+
+        # the universal newlines mode also splits the lines at the wrong '\n' delimiters
+        text_file = io.TextIOWrapper(binary_file, encoding=HL7_FILE_ENCODING)
+        try:
+            yield from HL7MessageParser._generate_hl7_message_strings_from_lines(text_file)
+        finally:
+            # the underlying file is closed by its owner
+            text_file.detach()
+
+
+class HL7BackfillProgress:
+    """A class for reporting the progress of a backfill phase with its throughput and estimated remaining time."""
+
+    def __init__(self, phase: str, total: int, unit: str, report, interval: float):
+        self._phase = phase
+        self._total = total
+        self._unit = unit
+        self._report = report
+        self._interval = interval
+
+        self._start = time.monotonic()
+        self._last_report = self._start
+
+    def update(self, done: int, force: bool = False):
+        """Reports the given number of done units, if the interval since the last report is over."""
+
+        now = time.monotonic()
+        if not force and now - self._last_report < self._interval:
+            return
+        self._last_report = now
+
+        elapsed = now - self._start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        percent = done / self._total * 100 if self._total else 100.0
+        if rate > 0:
+            eta = str(datetime.timedelta(seconds=round(max(self._total - done, 0) / rate)))
+        else:
+            eta = "unknown"
+
+        self._report(f"{self._phase}: {done}/{self._total} {self._unit} ({percent:.1f} %), "
+                     f"{rate:.1f} {self._unit}/s, ETA {eta}")
+
+
+class HL7DeferredIndexes:
+    """
+    A context manager, that drops the secondary indexes of the parsed models and recreates them at the end,
+    so that the indexes are built once instead of being maintained for every inserted row.
+    The indexes of the foreign keys are kept, because MySQL needs them for the constraints.
+    """
+
+    def __init__(self):
+        self._dropped_indexes = []
+        self._dropped_field_indexes = []
+
+    def __enter__(self):
+        with connection.schema_editor() as schema_editor:
+            for model in HL7_BACKFILL_MODELS:
+                for index in model._meta.indexes:
+                    schema_editor.remove_index(model, index)
+                    self._dropped_indexes.append((model, index))
+
+                for field in model._meta.local_fields:
+                    if field.db_index and not field.unique and not field.is_relation:
+                        field_without_index = field.clone()
+                        field_without_index.set_attributes_from_name(field.name)
+                        field_without_index.model = model
+                        field_without_index.db_index = False
+                        schema_editor.alter_field(model, field, field_without_index)
+                        self._dropped_field_indexes.append((model, field, field_without_index))
+
+        logger.info("Deferred %s secondary indexes", len(self._dropped_indexes) + len(self._dropped_field_indexes))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the indexes are recreated even if the backfill fails, so that the database is always complete
+        with connection.schema_editor() as schema_editor:
+            for model, index in self._dropped_indexes:
+                schema_editor.add_index(model, index)
+            for model, field, field_without_index in self._dropped_field_indexes:
+                schema_editor.alter_field(model, field_without_index, field)
+
+        logger.info("Recreated %s secondary indexes", len(self._dropped_indexes) + len(self._dropped_field_indexes))
+        self._dropped_indexes = []
+        self._dropped_field_indexes = []
+
+
+class HL7Backfill:
+    """
+    A class for loading archived HL7-files into the database at maximum throughput.
+    The archives are read as streams, sorted by their message creation (MSH-7) within the memory budget
+    and parsed in big batches. The progress of both phases is reported with its throughput and ETA.
+    The messages are parsed in their order, because the recency of the archived messages does not matter.
+    """
+
+    def __init__(self, paths, batch_size: int = None, memory_budget: int = None, progress_interval: float = None,
+                 report=None, apply_workers: int = None):
+        self._reader = HL7ArchiveReader(paths)
+        self._batch_size = batch_size if batch_size is not None else settings.HL7_BACKFILL_BATCH_SIZE
+        self._apply_workers = apply_workers
+        self._memory_budget = memory_budget
+        self._progress_interval = progress_interval if progress_interval is not None \
+            else settings.HL7_BACKFILL_PROGRESS_INTERVAL
+        self._report = report if report is not None else logger.info
+
+    def run(self, defer_indexes: bool = False):
+        """
+        Loads all HL7-messages from the archives into the database and returns the HL7ParsingStatistics.
+        If defer_indexes is True, the secondary indexes are dropped during the parsing.
+        """
+
+        trace = HL7Trace("backfill")
+        attributes = {"defer_indexes": defer_indexes}
+        try:
+            with trace.span("run", measure_memory=True), HL7MessageSorter(self._memory_budget) as sorter:
+                with trace.span("read", measure_memory=True):
+                    number_of_messages = self.__read_archives(sorter)
+
+                hl7_messages = self.__load_hl7_messages(trace.iterate("sort", sorter.sorted_messages()),
+                                                        number_of_messages, trace)
+                if defer_indexes:
+                    with HL7DeferredIndexes():
+                        statistics = HL7MessageParser.parse_hl7_messages(hl7_messages, max(self._batch_size, 1),
+                                                                         self._apply_workers, priority_lanes=False,
+                                                                         trace=trace)
+                else:
+                    statistics = HL7MessageParser.parse_hl7_messages(hl7_messages, max(self._batch_size, 1),
+                                                                     self._apply_workers, priority_lanes=False,
+                                                                     trace=trace)
+
+            attributes.update(statistics.to_dict())
+        finally:
+            trace.close(**attributes)
+
+        self._report(f"Backfilled {statistics}")
+        return statistics
+
+    def __read_archives(self, sorter: HL7MessageSorter):
+        """Adds the HL7-message strings of all archives to the sorter and returns their number."""
+
+        file_paths = self._reader.get_file_paths()
+        progress = HL7BackfillProgress("Reading", sum(os.path.getsize(file_path) for file_path in file_paths),
+                                       "bytes", self._report, self._progress_interval)
+
+        number_of_messages = 0
+        read_bytes = 0
+        for file_path in file_paths:
+            for hl7_message_string in self._reader.generate_hl7_message_strings(file_path):
+                sorter.add(get_message_creation(hl7_message_string), hl7_message_string)
+                number_of_messages += 1
+
+            read_bytes += os.path.getsize(file_path)
+            progress.update(read_bytes)
+
+        progress.update(read_bytes, force=True)
+        self._report(f"Read {number_of_messages} messages from {len(file_paths)} files "
+                     f"({sorter.number_of_runs} sorted runs spilled to disk)")
+
+        return number_of_messages
+
+    def __load_hl7_messages(self, hl7_message_strings, number_of_messages: int, trace: HL7Trace):
+        """Yields the usable Hl7Message instances of the sorted HL7-message strings and reports the progress."""
+
+        progress = HL7BackfillProgress("Parsing", number_of_messages, "messages", self._report,
+                                       self._progress_interval)
+
+        for number, hl7_message_string in enumerate(hl7_message_strings, 1):
+            with trace.span("decode"):
+                hl7_message = HL7MessageParser._load_hl7_message_from_string(hl7_message_string)
+            if hl7_message:
+                yield hl7_message
+            progress.update(number)
+
+        progress.update(number_of_messages, force=True)
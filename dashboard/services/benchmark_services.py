@@ -0,0 +1,376 @@
+import datetime
+import os
+import random
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+try:
+    import resource
+except ImportError:
+    # the resource module is only available on Unix
+    resource = None
+
+from django.db import connection, models
+from django.db.backends.signals import connection_created
+
+from dashboard.models.hospital_models import Ward, Room, Bed, Stay
+from dashboard.orm.hopital_query_sets import get_overlap_filter
+from dashboard.orm.occupancy_sweeps import OCCUPANCY_HISTORY_BACKENDS
+
+from dashboard.services.cache_services import location_cache, open_stay_cache
+from dashboard.services.hl7_dedup_services import HL7MessageDeduplicator
+from dashboard.services.hl7_services import HL7MessageParser, HL7_DATE_FORMAT, HL7_DATE_TIME_FORMAT
+
+# probabilities of the events during a generated visit
+ADT_TRANSFER_RATE = 0.4
+ADT_MAX_TRANSFERS = 4
+ADT_UPDATE_RATE = 0.3
+ADT_CANCEL_ADMISSION_RATE = 0.02
+ADT_CANCEL_TRANSFER_RATE = 0.03
+ADT_CANCEL_DISCHARGE_RATE = 0.02
+ADT_READMISSION_RATE = 0.2
+# mean length of a generated visit in days
+ADT_MEAN_LENGTH_OF_STAY = 5
+
+# lengths of the periods of the occupancy history benchmark
+OCCUPANCY_BENCHMARK_PERIODS = {"day": datetime.timedelta(days=1), "month": datetime.timedelta(days=30),
+                               "year": datetime.timedelta(days=365)}
+
+
+class ADTMessageGenerator:
+    """
+    A class for generating synthetic HL7 ADT-messages (A01, A02, A03, A08, A11, A12 and A13)
+    for a hospital with the given number of wards, rooms and beds in the same format as the SAP system.
+    Every patient gets one or more visits with transfers, updates, cancellations and a discharge.
+    """
+
+    def __init__(self, wards: int = 10, rooms_per_ward: int = 10, beds_per_room: int = 3, patients: int = 1000,
+                 days: int = 30, seed: int = 0, start: datetime.datetime = None):
+        self._beds = [(f"W{ward:02}", f"W{ward:02}R{room:02}", f"W{ward:02}R{room:02}B{bed}")
+                      for ward in range(wards) for room in range(rooms_per_ward) for bed in range(beds_per_room)]
+        self._patients = patients
+        self._days = days
+        self._random = random.Random(seed)
+        self._start = start if start is not None else datetime.datetime(2023, 1, 1)
+
+        self._next_visit_id = 1000000000
+        self._next_message_id = 1
+
+    def generate_messages(self):
+        """Returns a list with the message creation and the HL7-message string of all messages sorted by creation."""
+
+        messages = []
+        end = self._start + datetime.timedelta(days=self._days)
+
+        for patient_number in range(self._patients):
+            patient_id = 10000000 + patient_number
+            date_of_birth = self._start - datetime.timedelta(days=self._random.randint(0, 100 * 365))
+            sex = self._random.choice("MFD")
+
+            admission_date = self._start + datetime.timedelta(seconds=self._random.uniform(0, self._days * 86400))
+            while admission_date < end:
+                discharge_date = self.__generate_visit(messages, patient_id, date_of_birth, sex, admission_date, end)
+                if discharge_date is None or self._random.random() >= ADT_READMISSION_RATE:
+                    break
+                admission_date = discharge_date + datetime.timedelta(days=self._random.uniform(1, 30))
+
+        messages.sort(key=lambda message: message[0])
+        return messages
+
+    def write_hl7_files(self, path: str, messages_per_file: int = 1):
+        """Writes the generated messages into HL7-files in a given directory and returns the trigger events."""
+
+        messages = self.generate_messages()
+        trigger_events = Counter()
+
+        for file_number, index in enumerate(range(0, len(messages), messages_per_file)):
+            with open(os.path.join(path, f"{file_number:08}.hl7"), "w", encoding="ISO-8859-1") as hl7_file:
+                for _, message in messages[index:index + messages_per_file]:
+                    hl7_file.write(message + "\n")
+                    trigger_events[message.split("|", 9)[8].split("^")[1]] += 1
+
+        return trigger_events
+
+    def __generate_visit(self, messages, patient_id, date_of_birth, sex, admission_date, end):
+        """Generates the messages of one visit and returns the discharge date or None if it is not discharged."""
+
+        visit = {"patient_id": patient_id, "date_of_birth": date_of_birth, "sex": sex,
+                 "visit_id": self._next_visit_id, "admission_date": admission_date, "discharge_date": None}
+        self._next_visit_id += 1
+
+        movement_id = 1
+        bed = self._random.choice(self._beds)
+        self.__add_message(messages, "A01", admission_date, visit, bed, movement_id, admission_date)
+
+        if self._random.random() < ADT_CANCEL_ADMISSION_RATE:
+            self.__add_message(messages, "A11", admission_date + datetime.timedelta(minutes=10), visit, bed,
+                               movement_id, admission_date)
+            return None
+
+        discharge_date = admission_date + datetime.timedelta(
+            days=self._random.expovariate(1 / ADT_MEAN_LENGTH_OF_STAY))
+        date = admission_date
+
+        for _ in range(ADT_MAX_TRANSFERS):
+            if self._random.random() >= ADT_TRANSFER_RATE:
+                break
+            date += (discharge_date - date) * self._random.uniform(0.1, 0.6)
+            if date >= end:
+                return None
+
+            movement_id += 1
+            previous_bed, bed = bed, self._random.choice(self._beds)
+            self.__add_message(messages, "A02", date, visit, bed, movement_id, date)
+
+            if self._random.random() < ADT_CANCEL_TRANSFER_RATE:
+                self.__add_message(messages, "A12", date + datetime.timedelta(minutes=10), visit, previous_bed,
+                                   movement_id, date)
+                bed = previous_bed
+
+        if self._random.random() < ADT_UPDATE_RATE:
+            update_date = date + (discharge_date - date) / 2
+            if update_date < end:
+                self.__add_message(messages, "A08", update_date, visit, bed, movement_id, date)
+
+        if discharge_date >= end:
+            return None
+
+        movement_id += 1
+        visit["discharge_date"] = discharge_date
+        self.__add_message(messages, "A03", discharge_date, visit, bed, movement_id, discharge_date)
+
+        if self._random.random() < ADT_CANCEL_DISCHARGE_RATE:
+            self.__add_message(messages, "A13", discharge_date + datetime.timedelta(minutes=10), visit, bed,
+                               movement_id, discharge_date)
+            visit["discharge_date"] = None
+            return None
+
+        return discharge_date
+
+    def __add_message(self, messages, trigger_event, creation, visit, bed, movement_id, start_date):
+        """Adds a HL7-message with the given attributes in the format of the SAP system to the messages."""
+
+        creation_string = creation.strftime(HL7_DATE_TIME_FORMAT)
+        ward_id, room_id, bed_id = bed
+        discharge_date = visit["discharge_date"]
+
+        pv1_fields = [""] * 46
+        pv1_fields[0] = "PV1"
+        pv1_fields[2] = "I"
+        pv1_fields[3] = f"{ward_id}^{room_id}^{bed_id}^{ward_id}"
+        pv1_fields[19] = str(visit["visit_id"])
+        pv1_fields[44] = visit["admission_date"].strftime(HL7_DATE_TIME_FORMAT)
+        pv1_fields[45] = discharge_date.strftime(HL7_DATE_TIME_FORMAT) if discharge_date else ""
+
+        segments = [
+            f"MSH|^~\\&|SAP IS-H^MCI|003^0001^PSB|Dashboard^Dashboard|ZIEL_FOE^ZIEL_BEREICH|{creation_string}||"
+            f"ADT^{trigger_event}^ADT_{trigger_event}|{self._next_message_id:010}|P|2.6",
+            f"EVN|{trigger_event}|{creation_string}",
+            f"PID||{visit['patient_id']:010}|{visit['patient_id']:010}||^^^^^^||"
+            f"{visit['date_of_birth'].strftime(HL7_DATE_FORMAT)}|{visit['sex']}",
+            "|".join(pv1_fields),
+            f"ZBE|{movement_id:05}|{start_date.strftime(HL7_DATE_TIME_FORMAT)}|99991231240000|"
+            f"{'CANCEL' if trigger_event in ('A11', 'A12', 'A13') else 'INSERT'}",
+        ]
+        self._next_message_id += 1
+
+        messages.append((creation_string, "\r".join(segments)))
+
+
+class HL7IngestionBenchmark:
+    """
+    A class for measuring the parsing of a directory with HL7-files into the current database.
+    The messages per second, the queries per message and the peak memory of the run are measured.
+    The queries of the connections of the apply workers are counted too.
+    """
+
+    def __init__(self, path: str, batch_size: int = None, workers: int = None, apply_workers: int = None):
+        self._path = path
+        self._batch_size = batch_size
+        self._workers = workers
+        self._apply_workers = apply_workers
+        self._number_of_queries = 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        """Parses the HL7-files and returns the results of the measurement as dictionary."""
+
+        # start with empty caches, so that every run measures the same work
+        location_cache.clear()
+        open_stay_cache.clear()
+        HL7MessageDeduplicator.reset()
+        self._number_of_queries = 0
+
+        tracemalloc.start()
+        connection_created.connect(self.__count_queries_of_connection)
+        try:
+            with connection.execute_wrapper(self.__count_query):
+                statistics = HL7MessageParser.parse_hl7_messages_from_directory(self._path,
+                                                                                batch_size=self._batch_size,
+                                                                                workers=self._workers,
+                                                                                apply_workers=self._apply_workers)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            connection_created.disconnect(self.__count_queries_of_connection)
+            tracemalloc.stop()
+
+        number_of_messages = statistics.number_of_messages
+        return {
+            "messages": number_of_messages,
+            "duplicates": statistics.number_of_duplicates,
+            "compacted_messages": statistics.number_of_compacted_messages,
+            "duration": statistics.duration,
+            "messages_per_second": statistics.messages_per_second,
+            "queries": self._number_of_queries,
+            "queries_per_message": self._number_of_queries / number_of_messages if number_of_messages else 0.0,
+            "peak_memory_bytes": peak_memory,
+            # the max resident set size is given in kilobytes on Linux
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else None,
+            "timestamp": time.time(),
+        }
+
+    def __count_queries_of_connection(self, sender, connection, **kwargs):
+        """Counts the executed queries of a database connection opened by an apply worker during the run."""
+
+        # the connection of the current thread is already counted
+        if self.__count_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.__count_query)
+
+    def __count_query(self, execute, sql, params, many, context):
+        """Counts the executed queries of a database connection."""
+
+        with self._lock:
+            self._number_of_queries += 1
+        return execute(sql, params, many, context)
+
+
+class OccupancyHistoryBenchmark:
+    """
+    A class for measuring the occupancy history of the hospital, of a ward and of a room with the different backends
+    for periods of different lengths, that end at a given time. The duration and the queries of every backend
+    are measured and its occupancy is compared to the occupancy of the first backend (the orm backend by default).
+    """
+
+    def __init__(self, end: datetime.datetime, samples: int = 10, backends=OCCUPANCY_HISTORY_BACKENDS,
+                 periods=None, repetitions: int = 3):
+        self._end = end
+        self._samples = samples
+        self._backends = backends
+        self._periods = periods if periods is not None else OCCUPANCY_BENCHMARK_PERIODS
+        self._repetitions = repetitions
+        self._number_of_queries = 0
+
+    def run(self):
+        """Measures every backend for every period and location and returns the results as dictionary."""
+
+        # the first ward and room are measured, so that every run measures the same locations
+        query_sets = {"hospital": Bed.hospital_objects.all()}
+        ward_id = Ward.objects.order_by("id").values_list("id", flat=True).first()
+        if ward_id is not None:
+            query_sets["ward"] = Ward.objects.filter_for_id(ward_id)
+        room_id = Room.objects.order_by("id").values_list("id", flat=True).first()
+        if room_id is not None:
+            query_sets["room"] = Room.objects.filter_for_id(room_id)
+
+        results = {}
+        for period_name, period in self._periods.items():
+            start = self._end - period
+            times = [start + (period / (self._samples - 1)) * n for n in range(self._samples)]
+            results[period_name] = {location: self.__measure_backends(query_set, times)
+                                    for location, query_set in query_sets.items()}
+
+        return {"samples": self._samples, "repetitions": self._repetitions, "end": self._end.isoformat(),
+                "periods": results, "timestamp": time.time()}
+
+    def __measure_backends(self, query_set, times):
+        """Returns the fastest duration, the queries and the consistency of every backend for the given times."""
+
+        expected_history = None
+        results = {}
+        for backend in self._backends:
+            durations = []
+            for _ in range(self._repetitions):
+                self._number_of_queries = 0
+                with connection.execute_wrapper(self.__count_query):
+                    start = time.perf_counter()
+                    # the QuerySets of the orm backend are evaluated, so that their queries are measured
+                    history = [list(occupancy.values()) if isinstance(occupancy, models.QuerySet) else occupancy
+                               for occupancy in query_set.occupancy_history(times, backend)]
+                    durations.append(time.perf_counter() - start)
+
+            # the occupancy of every backend is compared to the occupancy of the first backend
+            if expected_history is None:
+                expected_history = history
+            results[backend] = {"duration": min(durations), "queries": self._number_of_queries,
+                                "consistent": history == expected_history}
+
+        return results
+
+    def __count_query(self, execute, sql, params, many, context):
+        """Counts the executed queries of the database connection."""
+
+        self._number_of_queries += 1
+        return execute(sql, params, many, context)
+
+
+def get_five_branch_overlap_filter(start_field: str, end_field: str, start: datetime.datetime,
+                                   end: datetime.datetime, open_end: bool = False):
+    """
+    Returns the overlap filter with a disjunction of five cases, that was used before get_overlap_filter,
+    so that the query plans of both filters can be compared.
+    """
+
+    overlap_filter = (models.Q(**{f"{start_field}__range": (start, end)}) |
+                      models.Q(**{f"{end_field}__range": (start, end)}) |
+                      models.Q(**{f"{start_field}__lt": start, f"{end_field}__gt": start}) |
+                      models.Q(**{f"{start_field}__lt": end, f"{end_field}__gt": end}))
+    if open_end:
+        overlap_filter |= models.Q(**{end_field: None, f"{start_field}__lt": end})
+    return overlap_filter
+
+
+class OverlapQueryPlanBenchmark:
+    """
+    A class for comparing the query plans (EXPLAIN) and the durations of the period queries
+    with the overlap filter of five cases (before) and with the overlap filter of two comparisons (after).
+    """
+
+    def __init__(self, start: datetime.datetime, end: datetime.datetime, repetitions: int = 3):
+        self._start = start
+        self._end = end
+        self._repetitions = repetitions
+
+    def run(self):
+        """Explains and measures the queries with both overlap filters and returns the results as dictionary."""
+
+        ward_id = Ward.objects.order_by("id").values_list("id", flat=True).first()
+
+        # the stays of a ward, the beds of a ward and the wards, that overlap the period
+        queries = {
+            "stays_of_ward": (Stay.objects.filter(ward_id=ward_id), "start_date", "end_date", True),
+            "beds_of_ward": (Bed.objects.filter(room__ward_id=ward_id), "date_of_activation", "date_of_expiry", False),
+            "wards": (Ward.objects.all(), "date_of_activation", "date_of_expiry", False),
+        }
+
+        results = {}
+        for name, (query_set, start_field, end_field, open_end) in queries.items():
+            results[name] = {
+                "before": self.__measure(query_set.filter(get_five_branch_overlap_filter(
+                    start_field, end_field, self._start, self._end, open_end))),
+                "after": self.__measure(query_set.filter(get_overlap_filter(
+                    start_field, end_field, self._start, self._end, open_end))),
+            }
+        return results
+
+    def __measure(self, query_set):
+        """Returns the query plan, the fastest duration and the number of rows of a QuerySet."""
+
+        durations = []
+        for _ in range(self._repetitions):
+            start = time.perf_counter()
+            number_of_rows = query_set.count()
+            durations.append(time.perf_counter() - start)
+
+        return {"plan": query_set.explain(), "duration": min(durations), "rows": number_of_rows}
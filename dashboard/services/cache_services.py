@@ -0,0 +1,179 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from dashboard.models import HL7CacheGeneration
+
+
+class LRUCache:
+    """A thread-safe cache with a bounded size, that evicts the least recently used entries."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # the epoch is increased by every clear and every thread keeps the epoch seen at the start of its transaction,
+        # so that the deferred puts of the values loaded before a clear are dropped
+        self._epoch = 0
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_load(self, key, load):
+        """
+        Returns the cached value for a given key or loads it with the given callable and caches it.
+        The loaded value is only cached after the current transaction is committed,
+        so that objects created in a rolled back transaction are never cached.
+        """
+
+        epoch = self.__get_thread_epoch()
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        # load the value outside the lock, so that the database query does not block other threads
+        value = load()
+        transaction.on_commit(lambda: self.__put_if_not_cleared(key, value, epoch))
+
+        return value
+
+    def put(self, key, value):
+        """Caches a given value for a given key and evicts the least recently used entries if necessary."""
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def update(self, key, value):
+        """
+        Removes the cached value for a given key immediately and caches the given value
+        after the current transaction is committed, so that a rollback leaves no outdated value.
+        The deferred puts are executed in their order, so the last update of the transaction is cached.
+        """
+
+        epoch = self.__get_thread_epoch()
+        self.invalidate(key)
+        transaction.on_commit(lambda: self.__put_if_not_cleared(key, value, epoch))
+
+    def __put_if_not_cleared(self, key, value, epoch: int):
+        """Caches a given value for a given key, if the cache was not cleared since the given epoch."""
+
+        with self._lock:
+            if epoch != self._epoch:
+                return
+        self.put(key, value)
+
+    def __get_thread_epoch(self):
+        """Returns the epoch seen by the current thread at the start of its transaction or the current epoch."""
+        return getattr(self._local, "epoch", self._epoch)
+
+    def begin(self):
+        """Keeps the current epoch for the loads and updates of the transaction started by the current thread."""
+        self._local.epoch = self._epoch
+
+    def end(self):
+        """Forgets the epoch kept for the transaction of the current thread."""
+        self._local.__dict__.pop("epoch", None)
+
+    def invalidate(self, key):
+        """
+        Removes the cached value for a given key if it exists.
+        It is removed again after the current transaction is committed, so that the values loaded or updated before
+        in the transaction, that are cached by their deferred puts, do not outlast the invalidation.
+        """
+
+        self.__remove(key)
+        transaction.on_commit(lambda: self.__remove(key))
+
+    def __remove(self, key):
+        """Removes the cached value for a given key if it exists."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all entries from the cache."""
+
+        with self._lock:
+            self._entries.clear()
+            self._epoch += 1
+
+
+# cache for the wards, rooms and beds used by the HL7 parsing
+# it is cleared after every synchronisation of the locations with the sap system
+location_cache = LRUCache(settings.HL7_LOCATION_CACHE_SIZE)
+
+# cache for the ids of the open stays (end_date == None) of every visit ordered by id used by the HL7 parsing
+# it is kept current by the parsing, so that the open stays are not queried for every message
+open_stay_cache = LRUCache(settings.HL7_OPEN_STAY_CACHE_SIZE)
+
+# id of this process for the generations of its writing threads
+CACHE_PROCESS_ID = uuid.uuid4().hex
+
+# the generations of the other processes seen by the last check
+_seen_generations = None
+_seen_generations_lock = threading.Lock()
+
+
+def check_cache_generations():
+    """
+    Clears the caches, if another process has committed changes of the locations or stays since the last check.
+    It is called before the caches are used outside a CacheGenerationCheck of a transaction.
+    """
+
+    global _seen_generations
+
+    generations = HL7CacheGeneration.objects.exclude(process=CACHE_PROCESS_ID) \
+        .aggregate(count=Count("writer"), sum=Sum("generation"))
+    generations = (generations["count"], generations["sum"])
+
+    with _seen_generations_lock:
+        if generations != _seen_generations:
+            if _seen_generations is not None:
+                location_cache.clear()
+                open_stay_cache.clear()
+            _seen_generations = generations
+
+
+def increase_cache_generation():
+    """
+    Increases the generation of the current thread, so that the other processes clear their caches.
+    It is called in the transactions changing the locations or stays, so that the new generation is visible
+    together with the changes. Every thread has its own row, so that the transactions of a process do not block.
+    """
+
+    writer = f"{CACHE_PROCESS_ID}:{threading.current_thread().name}"
+    if not HL7CacheGeneration.objects.filter(writer=writer).update(generation=F("generation") + 1):
+        HL7CacheGeneration.objects.create(writer=writer, process=CACHE_PROCESS_ID, generation=1)
+
+
+class CacheGenerationCheck:
+    """
+    Context for a transaction of the HL7 parsing, that checks the generations of the other processes at its start.
+    The values loaded in the transaction are not cached, if the caches are cleared by another thread before the commit,
+    because they could be read before the change, that caused the clear.
+    """
+
+    def __enter__(self):
+        # the epochs are kept before the check, so that a clear by another thread during the check is not missed
+        location_cache.begin()
+        open_stay_cache.begin()
+        check_cache_generations()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        location_cache.end()
+        open_stay_cache.end()
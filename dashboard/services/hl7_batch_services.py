@@ -0,0 +1,266 @@
+import datetime
+
+from django.db import connection, transaction
+from django.db.utils import IntegrityError
+
+from dashboard.models import Patient, Visit, Ward, Room, Stay, Discharge
+from dashboard.models.hospital_models import Bed
+from dashboard.services.cache_services import open_stay_cache
+from dashboard.services.trace_services import HL7Trace
+
+
+class HL7MessageBatch:
+    """
+    A class for a batch of HL7-messages, that are parsed together in one transaction.
+    All the referenced patients, visits, locations and open stays are prefetched with a few queries,
+    the changes are collected in memory and written with bulk operations.
+    The resulting database state is the same as parsing the messages one after another.
+    The prefetching, the messages and the bulk writes are measured with the spans of the given HL7Trace.
+    """
+
+    def __init__(self, hl7_messages, trace: HL7Trace = None):
+        self._hl7_messages = hl7_messages
+        self._trace = trace if trace is not None else HL7Trace("batch", enabled=False)
+
+        self._patients = dict()
+        self._visits = dict()
+        self._wards = dict()
+        self._rooms = dict()
+        self._beds = dict()
+        # the open stays of every visit ordered by their creation, so the last one is the newest
+        self._open_stays = dict()
+
+        self._new_patients = []
+        self._new_visits = []
+        self._new_wards = []
+        self._new_rooms = []
+        self._new_beds = []
+        self._new_stays = []
+        self._new_discharges = []
+
+        self._changed_patients = dict()
+        self._changed_visits = dict()
+        self._changed_stays = dict()
+
+    def parse(self):
+        """Parses all messages of the batch in one transaction."""
+
+        visit_ids = {hl7_message.get_references()[1] for hl7_message in self._hl7_messages}
+
+        with transaction.atomic():
+            # the open stays are changed without the cache, so the messages parsed on their own have to query them
+            # and the open stays cached by them are outdated by the later messages of the batch
+            for visit_id in visit_ids:
+                open_stay_cache.invalidate(visit_id)
+
+            with self._trace.span("refresh"):
+                self.refresh()
+
+            for hl7_message in self._hl7_messages:
+                with self._trace.span("parse_message", type(hl7_message).__name__):
+                    hl7_message.parse_message_in_batch(self)
+
+            with self._trace.span("flush"):
+                self.flush()
+
+            for visit_id in visit_ids:
+                open_stay_cache.invalidate(visit_id)
+
+    def refresh(self):
+        """Prefetches all the objects referenced by the messages of the batch from the database."""
+
+        patient_ids = set()
+        visit_ids = set()
+        ward_ids = set()
+        room_ids = set()
+        bed_ids = set()
+
+        for hl7_message in self._hl7_messages:
+            patient_id, visit_id, (ward_id, room_id, bed_id) = hl7_message.get_references()
+            if patient_id is not None:
+                patient_ids.add(patient_id)
+            if visit_id is not None:
+                visit_ids.add(visit_id)
+            ward_ids.add(ward_id)
+            room_ids.add(room_id)
+            bed_ids.add(bed_id)
+
+        self._patients = Patient.objects.in_bulk(patient_ids)
+        self._visits = Visit.objects.in_bulk(visit_ids)
+        self._wards = Ward.objects.in_bulk(ward_ids)
+        self._rooms = Room.objects.in_bulk(room_ids)
+        self._beds = Bed.objects.in_bulk(bed_ids)
+
+        self._open_stays = dict()
+        for stay in Stay.objects.filter(visit_id__in=visit_ids, end_date=None).order_by("id"):
+            self._open_stays.setdefault(stay.visit_id, []).append(stay)
+
+    def flush(self):
+        """Writes all the pending changes of the batch to the database."""
+
+        # create the new objects in the order of their dependencies
+        Patient.objects.bulk_create(self._new_patients)
+        Visit.objects.bulk_create(self._new_visits)
+        Ward.objects.bulk_create(self._new_wards)
+        Room.objects.bulk_create(self._new_rooms)
+        Bed.objects.bulk_create(self._new_beds)
+        Stay.objects.bulk_create(self._new_stays)
+        Discharge.objects.bulk_create(self._new_discharges)
+
+        # update the changed attributes of the already existing objects
+        Patient.objects.bulk_update(self._changed_patients.values(), ["sex", "date_of_birth"])
+        Visit.objects.bulk_update(self._changed_visits.values(), ["discharge_date"])
+        Stay.objects.bulk_update(self._changed_stays.values(), ["end_date"])
+
+        self._new_patients = []
+        self._new_visits = []
+        self._new_wards = []
+        self._new_rooms = []
+        self._new_beds = []
+        self._new_stays = []
+        self._new_discharges = []
+
+        self._changed_patients = dict()
+        self._changed_visits = dict()
+        self._changed_stays = dict()
+
+    def get_or_create_patient(self, patient_id: int, date_of_birth: datetime.date, sex: str):
+        """Gets or creates a new patient in the batch and return the result."""
+
+        patient = self._patients.get(patient_id)
+        if patient is None:
+            patient = Patient(patient_id=patient_id, date_of_birth=date_of_birth, sex=sex)
+            self._patients[patient_id] = patient
+            self._new_patients.append(patient)
+
+        return patient
+
+    def get_or_create_visit(self, patient: Patient, visit_id: int, admission_date: datetime.datetime):
+        """Gets or creates a new visit for a given patient in the batch and return the result."""
+
+        visit = self._visits.get(visit_id)
+        if visit is None:
+            visit = Visit(visit_id=visit_id, admission_date=admission_date, patient=patient)
+            self._visits[visit_id] = visit
+            self._new_visits.append(visit)
+
+        return visit
+
+    def create_stay(self, visit: Visit, movement_id: int, start_date: datetime.datetime,
+                    ward_id: str, room_id: str, bed_id: str):
+        """Creates a new stay for a given visit at the given location in the batch and return the result."""
+
+        ward, room, bed = self.get_or_create_locations(ward_id, room_id, bed_id, start_date)
+
+        stay = Stay(movement_id=movement_id, start_date=start_date, visit=visit, bed=bed, room=room, ward=ward)
+        self._new_stays.append(stay)
+        self._open_stays.setdefault(visit.visit_id, []).append(stay)
+
+        return stay
+
+    def get_or_create_locations(self, ward_id: str, room_id: str, bed_id: str, start_date: datetime.datetime):
+        """Gets or creates the ward, the room and the bed of a location in the batch and return the results."""
+
+        ward = self.__get_or_create_ward(ward_id, start_date)
+        room = self.__get_or_create_room(room_id, ward, start_date)
+        bed = self.__get_or_create_bed(bed_id, room, start_date)
+
+        return ward, room, bed
+
+    def last_open_stay(self, visit_id: int, saved: bool = False):
+        """
+        Returns the last stay of a given visit with end_date == None or None if there is none.
+        If saved is set, the stay is written to the database before, so that it has a primary key.
+        """
+
+        open_stays = self._open_stays.get(visit_id)
+        if not open_stays:
+            return None
+
+        stay = open_stays[-1]
+        if saved and stay.pk is None:
+            self.flush()
+            # refresh the stays if the database does not return the primary keys of the created rows
+            if not connection.features.can_return_rows_from_bulk_insert:
+                self.refresh()
+            stay = self._open_stays[visit_id][-1]
+
+        return stay
+
+    def close_stay(self, stay: Stay, end_date: datetime.datetime):
+        """Sets the end_date of a given open stay in the batch."""
+
+        stay.end_date = end_date
+        self._open_stays[stay.visit_id].remove(stay)
+
+        if stay.pk is not None:
+            self._changed_stays[stay.pk] = stay
+
+    def create_discharge(self, movement_id: int, stay: Stay):
+        """Creates a new discharge for a given stay in the batch and return the result."""
+
+        discharge = Discharge(movement_id=movement_id, stay=stay)
+        self._new_discharges.append(discharge)
+
+        return discharge
+
+    def update_visit_discharge_date(self, visit_id: int, discharge_date: datetime.datetime):
+        """Updates the discharge_date of the visit with the given visit_id if it exists."""
+
+        visit = self._visits.get(visit_id)
+        if visit is not None:
+            visit.discharge_date = discharge_date
+            if not visit._state.adding:
+                self._changed_visits[visit_id] = visit
+
+    def update_patient(self, patient_id: int, sex: str, date_of_birth: datetime.date):
+        """Updates the sex and the date_of_birth of the patient with the given patient_id if it exists."""
+
+        patient = self._patients.get(patient_id)
+        if patient is not None:
+            patient.sex = sex
+            patient.date_of_birth = date_of_birth
+            if not patient._state.adding:
+                self._changed_patients[patient_id] = patient
+
+    def __get_or_create_ward(self, ward_id: str, start_date: datetime.datetime):
+        """Gets or creates a new ward in the batch and return the result."""
+
+        ward = self._wards.get(ward_id)
+        if ward is None:
+            ward = Ward(id=ward_id, name=ward_id, date_of_activation=start_date,
+                        date_of_expiry=start_date + datetime.timedelta(weeks=1))
+            self._wards[ward_id] = ward
+            self._new_wards.append(ward)
+
+        return ward
+
+    def __get_or_create_room(self, room_id: str, ward: Ward, start_date: datetime.datetime):
+        """Gets or creates a new room for a given ward in the batch and return the result."""
+
+        room = self._rooms.get(room_id)
+        if room is None:
+            room = Room(id=room_id, name=room_id, ward=ward, date_of_activation=start_date,
+                        date_of_expiry=start_date + datetime.timedelta(weeks=1))
+            self._rooms[room_id] = room
+            self._new_rooms.append(room)
+        elif room.ward_id != ward.id:
+            # the room id is already used by a room of another ward
+            raise IntegrityError(f"The room {room_id} does not belong to the ward {ward.id}.")
+
+        return room
+
+    def __get_or_create_bed(self, bed_id: str, room: Room, start_date: datetime.datetime):
+        """Gets or creates a new bed for a given room in the batch and return the result."""
+
+        bed = self._beds.get(bed_id)
+        if bed is None:
+            bed = Bed(id=bed_id, name=bed_id, room=room, date_of_activation=start_date,
+                      date_of_expiry=start_date + datetime.timedelta(weeks=1))
+            self._beds[bed_id] = bed
+            self._new_beds.append(bed)
+        elif bed.room_id != room.id:
+            # the bed id is already used by a bed of another room
+            raise IntegrityError(f"The bed {bed_id} does not belong to the room {room.id}.")
+
+        return bed
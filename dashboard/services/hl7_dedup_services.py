@@ -0,0 +1,154 @@
+import datetime
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from dashboard.models import ProcessedHL7Message
+
+# min time (in seconds) between two deletions of the control ids older than the retention period
+HL7_DEDUP_PURGE_INTERVAL = 3600
+# time (in seconds) before the last load of the Bloom filter, from which the stored control ids are loaded again,
+# so that the control ids stored by other processes in transactions committed after their processed_at are not missed
+HL7_DEDUP_REFRESH_OVERLAP = 60
+
+
+def get_control_id_hash(control_id: str) -> str:
+    """Returns the sha256 hash of a given message control id, that is stored for a parsed HL7-message."""
+    return hashlib.sha256(control_id.encode()).hexdigest()
+
+
+class BloomFilter:
+    """
+    A compact probabilistic set, that answers if a key was possibly added or definitely not added.
+    The bits are set by double hashing of a blake2b digest.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        # the number of added keys, that were not contained before
+        self.number_of_keys = 0
+        self._number_of_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._number_of_hashes = max(1, round(self._number_of_bits / capacity * math.log(2)))
+        self._bits = bytearray((self._number_of_bits + 7) // 8)
+
+    def add(self, key: str):
+        """Adds a given key to the filter."""
+
+        added = False
+        for position in self.__positions(key):
+            if not self._bits[position >> 3] & (1 << (position & 7)):
+                self._bits[position >> 3] |= 1 << (position & 7)
+                added = True
+        if added:
+            self.number_of_keys += 1
+
+    def __contains__(self, key: str):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(key))
+
+    def __positions(self, key: str):
+        """Yields the bit positions of a given key."""
+
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], "little")
+        second_hash = int.from_bytes(digest[8:], "little") | 1
+
+        for number in range(self._number_of_hashes):
+            yield (first_hash + number * second_hash) % self._number_of_bits
+
+
+class HL7MessageDeduplicator:
+    """
+    A class for dropping resent HL7-messages by their message control id (MSH-10) before they are parsed.
+    The hashes of the control ids of the parsed messages are stored in the database for the retention period.
+    All instances share a Bloom filter of the stored hashes,
+    so that the database is only queried for control ids, that were possibly parsed already.
+    The hashes stored by other processes are added to the Bloom filter at the start of every run
+    and it is rebuilt after a purge or as soon as it contains more hashes than its capacity.
+    """
+
+    _bloom_filter = None
+    _loaded_until = None
+    _last_purge = 0.0
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.number_of_duplicates = 0
+
+        # the hashes of the control ids accepted in this run, so that duplicates in the same batch are dropped too
+        self._accepted_control_id_hashes = set()
+
+    def drop_duplicates(self, hl7_messages):
+        """Yields the given Hl7Message instances, that were not parsed already, and counts the dropped ones."""
+
+        bloom_filter = self.__get_bloom_filter()
+
+        for hl7_message in hl7_messages:
+            control_id = hl7_message.record.control_id
+            # messages without control id can not be recognised as duplicates
+            if control_id:
+                control_id_hash = get_control_id_hash(control_id)
+                if control_id_hash in self._accepted_control_id_hashes or (
+                        control_id_hash in bloom_filter and ProcessedHL7Message.objects.filter(
+                            control_id_hash=control_id_hash).exists()):
+                    self.number_of_duplicates += 1
+                    continue
+
+                self._accepted_control_id_hashes.add(control_id_hash)
+                bloom_filter.add(control_id_hash)
+
+            yield hl7_message
+
+    @staticmethod
+    def mark_processed(hl7_messages):
+        """Stores the hashes of the control ids of the given parsed Hl7Message instances with one query."""
+
+        ProcessedHL7Message.objects.bulk_create(
+            [ProcessedHL7Message(control_id_hash=get_control_id_hash(control_id)) for hl7_message in hl7_messages
+             for control_id in hl7_message.get_control_ids() if control_id],
+            ignore_conflicts=True)
+
+    @classmethod
+    def reset(cls):
+        """Removes the shared Bloom filter, so that it is loaded from the database again."""
+
+        with cls._lock:
+            cls._bloom_filter = None
+
+    @classmethod
+    def __get_bloom_filter(cls):
+        """
+        Returns the shared Bloom filter with the hashes stored since its last load
+        and deletes the control ids older than the retention period.
+        """
+
+        with cls._lock:
+            if time.monotonic() - cls._last_purge > HL7_DEDUP_PURGE_INTERVAL or cls._bloom_filter is None:
+                retention_start = timezone.now() - datetime.timedelta(days=settings.HL7_DEDUP_RETENTION_DAYS)
+                number_of_purged, _ = ProcessedHL7Message.objects.filter(processed_at__lt=retention_start).delete()
+                cls._last_purge = time.monotonic()
+
+                # the purged hashes would stay in the Bloom filter as false positives
+                if number_of_purged:
+                    cls._bloom_filter = None
+
+            if cls._bloom_filter is not None and cls._bloom_filter.number_of_keys > cls._bloom_filter.capacity:
+                cls._bloom_filter = None
+
+            load_start = timezone.now()
+            processed_messages = ProcessedHL7Message.objects.all()
+            if cls._bloom_filter is None:
+                # the capacity grows with the stored hashes, so that the rebuilt filter keeps its error rate
+                capacity = max(settings.HL7_DEDUP_BLOOM_CAPACITY, 2 * processed_messages.count())
+                cls._bloom_filter = BloomFilter(capacity, settings.HL7_DEDUP_BLOOM_ERROR_RATE)
+            else:
+                processed_messages = processed_messages.filter(processed_at__gte=cls._loaded_until)
+
+            for control_id_hash in processed_messages.values_list("control_id_hash", flat=True).iterator():
+                cls._bloom_filter.add(control_id_hash)
+            cls._loaded_until = load_start - datetime.timedelta(seconds=HL7_DEDUP_REFRESH_OVERLAP)
+
+            return cls._bloom_filter
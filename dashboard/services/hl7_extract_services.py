@@ -0,0 +1,95 @@
+import hl7
+
+HL7_SEGMENT_SEPARATOR = "\r"
+# default encoding characters in the order of MSH-2: component, repetition, escape and subcomponent separator
+HL7_DEFAULT_ENCODING_CHARACTERS = "^~\\&"
+
+
+class HL7FastSegment:
+    """
+    A lightweight segment of a HL7-message string, that only splits its fields.
+    The repetitions, components and subcomponents are only split for the extracted field.
+    """
+
+    __slots__ = ("_fields", "_repetition_separator", "_component_separator", "_subcomponent_separator", "_is_msh")
+
+    def __init__(self, segment: str, field_separator: str, encoding_characters: str):
+        self._fields = segment.split(field_separator)
+        self._is_msh = self._fields[0] == "MSH"
+        if self._is_msh:
+            # the field separator itself is MSH-1, so the numbering of the fields is the same as in the hl7 library
+            self._fields.insert(1, field_separator)
+
+        self._component_separator = encoding_characters[0]
+        self._repetition_separator = encoding_characters[1]
+        self._subcomponent_separator = encoding_characters[3]
+
+    def extract_field(self, field_num: int = 1, repeat_num: int = 1, component_num: int = 1,
+                      subcomponent_num: int = 1) -> str:
+        """Returns a field like hl7.Segment.extract_field, but an empty string for every non-present value."""
+
+        if field_num >= len(self._fields):
+            return ""
+        field = self._fields[field_num]
+        # the separators in MSH-1 and MSH-2 are not split
+        if self._is_msh and field_num <= 2:
+            return field
+
+        for separator, num in ((self._repetition_separator, repeat_num),
+                               (self._component_separator, component_num),
+                               (self._subcomponent_separator, subcomponent_num)):
+            values = field.split(separator)
+            if num > len(values):
+                return ""
+            field = values[num - 1]
+
+        return field
+
+
+class HL7FastMessage:
+    """
+    A lightweight HL7-message, that only splits the segment strings and keeps the first segment of every type.
+    It provides the segment method of hl7.Message for the segments used by the HL7Message classes.
+    """
+
+    __slots__ = ("_segments", "_message")
+
+    def __init__(self, segments: dict, message: str):
+        self._segments = segments
+        self._message = message
+
+    def segment(self, segment_id: str) -> HL7FastSegment:
+        """Returns the first segment with the given segment_id or raises a KeyError like hl7.Message.segment."""
+        return self._segments[segment_id]
+
+    def __str__(self):
+        return self._message
+
+
+def parse_hl7_message_fast(message: str):
+    """
+    Parses a HL7-message string into a HL7FastMessage by scanning the segment strings once.
+    Messages with escape sequences are parsed with hl7.parse, because only the hl7 library unescapes the values.
+    """
+
+    message = message.strip()
+    if message[:3] != "MSH":
+        raise hl7.ParseException(f"First segment is {message[:3]}, must be MSH")
+
+    # the MSH segment defines the field separator and the encoding characters directly after the segment name
+    field_separator = message[3]
+    encoding_characters_end = message.find(field_separator, 4)
+    encoding_characters = message[4:encoding_characters_end]
+    encoding_characters += HL7_DEFAULT_ENCODING_CHARACTERS[len(encoding_characters):]
+
+    escape_character = encoding_characters[2]
+    if escape_character in message[encoding_characters_end:]:
+        return hl7.parse(message)
+
+    segments = {}
+    for segment in message.split(HL7_SEGMENT_SEPARATOR):
+        segment_id = segment[:3]
+        if segment_id and segment_id not in segments:
+            segments[segment_id] = HL7FastSegment(segment, field_separator, encoding_characters)
+
+    return HL7FastMessage(segments, message)
@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+
+from dashboard.services import hl7_services
+
+
+def _parse_hl7_message_strings(hl7_message_strings):
+    """
+    Parses the given HL7-message strings in a worker process.
+    Returns a list with the message creation and the pickled Hl7Message instance of every usable message.
+    """
+
+    parsed_messages = []
+    for hl7_message_string in hl7_message_strings:
+        hl7_message = hl7_services.HL7MessageParser._load_hl7_message_from_string(hl7_message_string)
+        if hl7_message:
+            parsed_messages.append((hl7_services.get_message_creation(hl7_message_string),
+                                    pickle.dumps(hl7_message, protocol=pickle.HIGHEST_PROTOCOL)))
+    return parsed_messages
+
+
+def _parse_hl7_file(path: str):
+    """Parses the HL7-file on a given path in a worker process like _parse_hl7_message_strings."""
+
+    return _parse_hl7_message_strings(hl7_services.HL7MessageParser._generate_hl7_message_strings_from_file(path))
+
+
+class HL7ParseStage:
+    """
+    A class for the parsing of HL7-files, that distributes the files across a pool of worker processes.
+    Files bigger than the HL7_PARSE_POOL_MIN_BYTES are split into chunks of HL7_PARSE_CHUNK_SIZE messages.
+    Small batches of files are parsed in the current process, because the pool would only add overhead.
+    """
+
+    def __init__(self, workers: int = None):
+        if workers is None:
+            workers = settings.HL7_PARSE_WORKERS
+        self._workers = workers
+
+    def parse_files(self, file_paths):
+        """
+        Yields the path of every given HL7-file with its messages as tuples of the message creation
+        and the message. The message is a string if it is parsed in the current process or the bytes
+        of a pickled Hl7Message instance if it is parsed by a worker process.
+        """
+
+        total_size = sum(os.path.getsize(file_path) for file_path in file_paths)
+
+        if self._workers > 1 and total_size >= settings.HL7_PARSE_POOL_MIN_BYTES:
+            yield from self.__parse_files_in_pool(file_paths)
+        else:
+            for file_path in file_paths:
+                yield file_path, self.__generate_hl7_message_strings(file_path)
+
+    @staticmethod
+    def load(message):
+        """Returns the Hl7Message instance of a message returned by parse_files or None if it is not usable."""
+
+        if isinstance(message, bytes):
+            return pickle.loads(message)
+        return hl7_services.HL7MessageParser._load_hl7_message_from_string(message)
+
+    @staticmethod
+    def __generate_hl7_message_strings(path: str):
+        """Yields the HL7-message strings of a HL7-file with their message creation."""
+
+        for hl7_message_string in hl7_services.HL7MessageParser._generate_hl7_message_strings_from_file(path):
+            yield hl7_services.get_message_creation(hl7_message_string), hl7_message_string
+
+    def __parse_files_in_pool(self, file_paths):
+        """Parses the given files in a pool of worker processes and yields the results in the order of the files."""
+
+        # the workers are spawned instead of forked, because the scheduler runs in a multithreaded web process
+        with ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=django.setup) as executor:
+            # limit the submitted tasks, so that only a few results are waiting in memory
+            max_pending_tasks = self._workers * 2
+            pending_tasks = deque()
+
+            for task in self.__create_tasks(executor, file_paths):
+                pending_tasks.append(task)
+                while len(pending_tasks) > max_pending_tasks:
+                    yield from self.__complete_task(pending_tasks, file_paths)
+
+            while pending_tasks:
+                yield from self.__complete_task(pending_tasks, file_paths)
+
+    @staticmethod
+    def __complete_task(pending_tasks, file_paths):
+        """Waits for the oldest pending task and yields its results, if its file is completely parsed."""
+
+        file_path, is_last_chunk, future, parsed_messages = pending_tasks.popleft()
+        parsed_messages.extend(future.result())
+        if is_last_chunk:
+            yield file_path, parsed_messages
+
+    @staticmethod
+    def __create_tasks(executor, file_paths):
+        """
+        Submits the files or the chunks of big files to the executor and yields the tasks.
+        All chunks of the same file share one list for their results.
+        """
+
+        for file_path in file_paths:
+            parsed_messages = []
+
+            if os.path.getsize(file_path) < settings.HL7_PARSE_POOL_MIN_BYTES:
+                yield file_path, True, executor.submit(_parse_hl7_file, file_path), parsed_messages
+                continue
+
+            chunk = []
+            for hl7_message_string in hl7_services.HL7MessageParser._generate_hl7_message_strings_from_file(
+                    file_path):
+                chunk.append(hl7_message_string)
+                if len(chunk) >= settings.HL7_PARSE_CHUNK_SIZE:
+                    yield file_path, False, executor.submit(_parse_hl7_message_strings, chunk), parsed_messages
+                    chunk = []
+            yield file_path, True, executor.submit(_parse_hl7_message_strings, chunk), parsed_messages
@@ -1,21 +1,42 @@
-import bisect
+import logging
 import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import deque, Counter
 
 from abc import ABC, abstractmethod
 
 import hl7
 import datetime
 
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection, transaction
 from django.utils import timezone
 
 from dashboard.models import Patient, Visit, Ward, Room
 from dashboard.models.hospital_models import Bed, Stay, Discharge
+from dashboard.services.hl7_batch_services import HL7MessageBatch
+from dashboard.services.hl7_dedup_services import HL7MessageDeduplicator
+from dashboard.services.cache_services import location_cache, open_stay_cache, check_cache_generations, \
+    increase_cache_generation, CacheGenerationCheck
+from dashboard.services.hl7_extract_services import parse_hl7_message_fast
+from dashboard.services.hl7_parse_services import HL7ParseStage
+from dashboard.services.hl7_sort_services import HL7MessageSorter
+from dashboard.services.metrics_services import hl7_messages_ingested, hl7_messages_quarantined, \
+    hl7_ingest_batch_duration
+from dashboard.services.trace_services import HL7Trace
+
+logger = logging.getLogger(__name__)
 
 HL7_DATE_FORMAT = "%Y%m%d"
 HL7_DATE_TIME_FORMAT = "%Y%m%d%H%M%S"
 
 MSH_MESSAGE_CREATION_FIELD = 7
 MSH_MESSAGE_TYPE_FIELD = 9
+MSH_MESSAGE_CONTROL_ID_FIELD = 10
 MESSAGE_TYPE_TYPE_COMPONENT = 1
 MESSAGE_TYPE_TRIGGER_EVENT_COMPONENT = 2
 
@@ -34,233 +55,439 @@ PATIENT_LOCATION_BED_COMPONENT = 3
 ZBE_MOVEMENT_ID_FIELD = 1
 ZBE_START_DATE_FIELD = 2
 
+HL7_FILE_ENCODING = "ISO-8859-1"
+HL7_BATCH_SEGMENTS = ("FHS", "BHS", "FTS", "BTS")
+
+
+def get_msh_field(message: str, field_num: int) -> str:
+    """Returns a field of the MSH segment of a given HL7-message string without parsing the whole message."""
+
+    msh_segment = message.split("\r", 1)[0]
+    # the MSH segment defines the field separator directly after the segment name
+    msh_fields = msh_segment.split(msh_segment[3:4] or "|")
+
+    # the field separator itself is the first MSH field, so the other fields are shifted by one
+    if len(msh_fields) < field_num:
+        return ""
+    return msh_fields[field_num - 1]
+
+
+def get_message_creation(message: str) -> str:
+    """Returns the message creation (MSH-7) of a given HL7-message string without parsing the whole message."""
+    return get_msh_field(message, MSH_MESSAGE_CREATION_FIELD)
+
+
+def quarantine_hl7_messages(message_strings, error: Exception):
+    """
+    Writes the given HL7-message strings, that could not be parsed, into a HL7-file in the quarantine directory
+    and the traceback of the error into an error file with the same name.
+    """
+
+    os.makedirs(settings.HL7_QUARANTINE_DIRECTORY, exist_ok=True)
+    # the name starts with the time, so that the quarantined files are listed in the order they failed
+    name = f"{timezone.now().strftime(HL7_DATE_TIME_FORMAT)}_{uuid.uuid4().hex}"
+    path = os.path.join(settings.HL7_QUARANTINE_DIRECTORY, name)
+
+    # the segments are written line by line, so that the file can be moved back into the hl7 directory
+    with open(path + ".hl7", "w", encoding=HL7_FILE_ENCODING, errors="replace") as hl7_file:
+        for message_string in message_strings:
+            hl7_file.write(message_string.strip().replace("\r", "\n") + "\n")
+    with open(path + ".error", "w", encoding="utf-8") as error_file:
+        error_file.write("".join(traceback.format_exception(type(error), error, error.__traceback__)))
+
+    logger.error("Quarantined %s HL7-messages in %s.hl7: %r", len(message_strings), path, error)
+    hl7_messages_quarantined.inc(len(message_strings))
+
+
+def count_ingested_hl7_messages(hl7_messages):
+    """Counts the given committed Hl7Message instances by the trigger events of their HL7-messages in the metrics."""
+
+    trigger_events = Counter(trigger_event for hl7_message in hl7_messages
+                             for trigger_event in hl7_message.get_trigger_events())
+    for trigger_event, number in trigger_events.items():
+        hl7_messages_ingested.inc(number, trigger_event=trigger_event)
+
+
+def _parse_int(value: str):
+    """Returns the integer of a given HL7 field or None if it is not usable."""
+
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _parse_date_time(value: str, date_time_format: str):
+    """Returns the datetime of a given HL7 field in the given format or None if it is not usable."""
+
+    try:
+        return timezone.datetime.strptime(value, date_time_format)
+    except ValueError:
+        return None
+
+
+class HL7MessageRecord:
+    """
+    A class for the decoded fields of a HL7-message, that are used for the parsing.
+    Every field is decoded once, fields that are not usable are None and missing location ids are empty.
+    """
+
+    __slots__ = ("message_creation", "control_id", "trigger_event", "patient_id", "date_of_birth", "sex", "visit_id",
+                 "admission_date", "discharge_date", "movement_id", "start_date", "ward_id", "room_id", "bed_id")
+
+    def __init__(self, message):
+        # the message is a hl7.Message or a HL7FastMessage with the same segment interface
+        msh_segment = message.segment("MSH")
+        pid_segment = message.segment("PID")
+        pv1_segment = message.segment("PV1")
+        zbe_segment = message.segment("ZBE")
+
+        self.message_creation = msh_segment.extract_field(field_num=MSH_MESSAGE_CREATION_FIELD)
+        self.control_id = msh_segment.extract_field(field_num=MSH_MESSAGE_CONTROL_ID_FIELD)
+        self.trigger_event = msh_segment.extract_field(field_num=MSH_MESSAGE_TYPE_FIELD,
+                                                       component_num=MESSAGE_TYPE_TRIGGER_EVENT_COMPONENT)
+
+        self.patient_id = _parse_int(pid_segment.extract_field(field_num=PID_PATIENT_ID_FIELD))
+        date_of_birth = _parse_date_time(pid_segment.extract_field(field_num=PID_DOB_FIELD), HL7_DATE_FORMAT)
+        self.date_of_birth = date_of_birth.date() if date_of_birth else None
+        self.sex = pid_segment.extract_field(field_num=PID_SEX_FILED)
+
+        self.visit_id = _parse_int(pv1_segment.extract_field(field_num=PV1_VISIT_ID_FIELD))
+        self.admission_date = _parse_date_time(pv1_segment.extract_field(field_num=PV1_ADMISSION_DATE_FIELD),
+                                               HL7_DATE_TIME_FORMAT)
+        self.discharge_date = _parse_date_time(pv1_segment.extract_field(field_num=PV1_DISCHARGE_DATE_FIELD),
+                                               HL7_DATE_TIME_FORMAT)
+
+        self.movement_id = _parse_int(zbe_segment.extract_field(field_num=ZBE_MOVEMENT_ID_FIELD))
+        self.start_date = _parse_date_time(zbe_segment.extract_field(field_num=ZBE_START_DATE_FIELD),
+                                           HL7_DATE_TIME_FORMAT)
+
+        self.ward_id = pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
+                                                 component_num=PATIENT_LOCATION_WARD_COMPONENT)
+        self.room_id = pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
+                                                 component_num=PATIENT_LOCATION_ROOM_COMPONENT)
+        self.bed_id = pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
+                                                component_num=PATIENT_LOCATION_BED_COMPONENT)
+
 
 class HL7Message(ABC):
     """A Class for HL7-messages."""
 
-    def __init__(self, message: hl7.Message):
-        # extract all important segments and add them as instance attributes
-        self._msh_segment = message.segment("MSH")
-        self._pv1_segment = message.segment("PV1")
-        self._pid_segment = message.segment("PID")
-        self._zbe_segment = message.segment("ZBE")
+    __slots__ = ("record", "raw_message")
 
-        # extract the message creation attribute and add it as instance attribute
-        self.message_creation = self._msh_segment[MSH_MESSAGE_CREATION_FIELD]
-
-    def _get_or_create_patient(self):
-        """Gets or creates a new patient from the message segments and return the result."""
+    # if the message can create the locations of its record, they are created before it is parsed in parallel
+    creates_locations = False
 
-        patient_id_string = self._pid_segment.extract_field(field_num=PID_PATIENT_ID_FIELD)
-        patient_id = int(patient_id_string)
+    def __init__(self, message):
+        # decode all important fields once, so that the segments are not kept in memory
+        self.record = HL7MessageRecord(message)
+        # the message string is kept to quarantine the message, if it can not be parsed
+        self.raw_message = str(message)
 
-        date_of_birth_string = self._pid_segment.extract_field(field_num=PID_DOB_FIELD)
-        date_of_birth = timezone.datetime.strptime(date_of_birth_string, HL7_DATE_FORMAT).date()
+    @property
+    def message_creation(self):
+        """Returns the message creation (MSH-7) of the message."""
+        return self.record.message_creation
 
-        sex = self._pid_segment.extract_field(field_num=PID_SEX_FILED)
+    def _get_or_create_patient(self):
+        """Gets or creates a new patient from the message record and return the result."""
 
-        return Patient.objects.get_or_create(patient_id=patient_id,
-                                             defaults={"date_of_birth": date_of_birth,
-                                                       "sex": sex})[0]
+        return Patient.objects.get_or_create(patient_id=self.record.patient_id,
+                                             defaults={"date_of_birth": self.record.date_of_birth,
+                                                       "sex": self.record.sex})[0]
 
     def _get_or_create_visit(self, patient: Patient):
-        """Gets or creates a new visit from the message segments for a given patient and return the result."""
+        """Gets or creates a new visit from the message record for a given patient and return the result."""
 
-        visit_id_string = self._pv1_segment.extract_field(field_num=PV1_VISIT_ID_FIELD)
-        visit_id = int(visit_id_string)
+        return Visit.objects.get_or_create(visit_id=self.record.visit_id,
+                                           defaults={"admission_date": self.record.admission_date,
+                                                     "patient": patient})[0]
 
-        admission_date_string = self._pv1_segment.extract_field(field_num=PV1_ADMISSION_DATE_FIELD)
-        admission_date = timezone.datetime.strptime(admission_date_string, HL7_DATE_TIME_FORMAT)
+    def _create_stay(self, visit: Visit, open_stay_ids: tuple = None):
+        """
+        Gets or creates a new stay from the message record for a given visit and return the result.
+        The already known ids of the open stays of the visit can be given, so that they are not loaded again.
+        """
 
-        return Visit.objects.get_or_create(visit_id=visit_id,
-                                           defaults={"admission_date": admission_date,
-                                                     "patient": patient})[0]
+        if open_stay_ids is None:
+            open_stay_ids = self._get_open_stay_ids(visit.visit_id)
 
-    def _create_stay(self, visit: Visit):
-        """Gets or creates a new stay from the message segments for a given visit and return the result."""
+        ward, room, bed = self._get_or_create_locations()
 
-        start_date_string = self._zbe_segment.extract_field(field_num=ZBE_START_DATE_FIELD)
-        start_date = timezone.datetime.strptime(start_date_string, HL7_DATE_TIME_FORMAT)
-        movement_id_string = self._zbe_segment.extract_field(field_num=ZBE_MOVEMENT_ID_FIELD)
-        movement_id = int(movement_id_string)
+        stay = Stay.objects.create(movement_id=self.record.movement_id, start_date=self.record.start_date,
+                                   visit=visit, bed=bed, room=room, ward=ward)
+        open_stay_cache.update(visit.visit_id, open_stay_ids + (stay.id,))
+
+        return stay
+
+    def _get_or_create_locations(self):
+        """Gets or creates the ward, the room and the bed from the message record and return the results."""
 
         ward = self.__get_or_create_ward()
         room = self.__get_or_create_room(ward)
         bed = self.__get_or_create_bed(room)
 
-        return Stay.objects.create(movement_id=movement_id, start_date=start_date, visit=visit,
-                                   bed=bed, room=room, ward=ward)
+        return ward, room, bed
+
+    @staticmethod
+    def _get_open_stay_ids(visit_id: int):
+        """Returns the ids of the open stays (end_date == None) of a given visit ordered by id."""
+
+        return open_stay_cache.get_or_load(
+            visit_id,
+            lambda: tuple(Stay.objects.filter(visit_id=visit_id, end_date=None).order_by("id")
+                          .values_list("id", flat=True)))
+
+    def _close_last_open_stay(self, visit_id: int, open_stay_ids: tuple):
+        """
+        Sets the end_date of the last of the given open stays of a given visit
+        and returns the ids of the remaining open stays.
+        """
+
+        Stay.objects.filter(id=open_stay_ids[-1]).update(end_date=self.record.start_date)
+        open_stay_cache.update(visit_id, open_stay_ids[:-1])
+
+        return open_stay_ids[:-1]
 
     def __get_or_create_ward(self):
-        """Gets or creates a new ward from the message segments and return the result."""
+        """Gets or creates a new ward from the message record and return the result."""
 
-        start_date_string = self._zbe_segment.extract_field(field_num=ZBE_START_DATE_FIELD)
-        start_date = timezone.datetime.strptime(start_date_string, HL7_DATE_TIME_FORMAT)
-        ward_id = self._pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
-                                                  component_num=PATIENT_LOCATION_WARD_COMPONENT)
+        start_date = self.record.start_date
+        ward_id = self.record.ward_id
 
-        return Ward.objects.get_or_create(id=ward_id,
-                                          defaults={"name": ward_id,
-                                                    "date_of_activation": start_date,
-                                                    "date_of_expiry": start_date + datetime.timedelta(
-                                                        weeks=1)})[0]
+        return location_cache.get_or_load(
+            ("ward", ward_id),
+            lambda: Ward.objects.get_or_create(id=ward_id,
+                                               defaults={"name": ward_id,
+                                                         "date_of_activation": start_date,
+                                                         "date_of_expiry": start_date + datetime.timedelta(
+                                                             weeks=1)})[0])
 
     def __get_or_create_room(self, ward: Ward):
-        """Gets or creates a new room from the message segments for a given ward and return the result."""
+        """Gets or creates a new room from the message record for a given ward and return the result."""
 
-        start_date_string = self._zbe_segment.extract_field(field_num=ZBE_START_DATE_FIELD)
-        start_date = timezone.datetime.strptime(start_date_string, HL7_DATE_TIME_FORMAT)
-        room_id = self._pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
-                                                  component_num=PATIENT_LOCATION_ROOM_COMPONENT)
+        start_date = self.record.start_date
+        room_id = self.record.room_id
 
-        return Room.objects.get_or_create(id=room_id, ward=ward,
-                                          defaults={"name": room_id,
-                                                    "date_of_activation": start_date,
-                                                    "date_of_expiry": start_date + datetime.timedelta(
-                                                        weeks=1)})[0]
+        # the ward is part of the key, because the room is only got if it belongs to the ward
+        return location_cache.get_or_load(
+            ("room", ward.id, room_id),
+            lambda: Room.objects.get_or_create(id=room_id, ward=ward,
+                                               defaults={"name": room_id,
+                                                         "date_of_activation": start_date,
+                                                         "date_of_expiry": start_date + datetime.timedelta(
+                                                             weeks=1)})[0])
 
     def __get_or_create_bed(self, room: Room):
-        """Gets or creates a new bed from the message segments for a given room and return the result."""
+        """Gets or creates a new bed from the message record for a given room and return the result."""
+
+        start_date = self.record.start_date
+        bed_id = self.record.bed_id
 
-        start_date_string = self._zbe_segment.extract_field(field_num=ZBE_START_DATE_FIELD)
-        start_date = timezone.datetime.strptime(start_date_string, HL7_DATE_TIME_FORMAT)
-        bed_id = self._pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
-                                                 component_num=PATIENT_LOCATION_BED_COMPONENT)
+        # the room is part of the key, because the bed is only got if it belongs to the room
+        return location_cache.get_or_load(
+            ("bed", room.id, bed_id),
+            lambda: Bed.objects.get_or_create(id=bed_id, room=room,
+                                              defaults={"name": bed_id,
+                                                        "date_of_activation": start_date,
+                                                        "date_of_expiry": start_date + datetime.timedelta(
+                                                            weeks=1)})[0])
 
-        return Bed.objects.get_or_create(id=bed_id, room=room,
-                                         defaults={"name": bed_id,
-                                                   "date_of_activation": start_date,
-                                                   "date_of_expiry": start_date + datetime.timedelta(
-                                                       weeks=1)})[0]
+    def _get_or_create_patient_in_batch(self, batch):
+        """Gets or creates a new patient from the message record in a given HL7MessageBatch."""
+
+        return batch.get_or_create_patient(self.record.patient_id, self.record.date_of_birth, self.record.sex)
+
+    def _get_or_create_visit_in_batch(self, batch, patient: Patient):
+        """Gets or creates a new visit from the message record for a given patient in a given HL7MessageBatch."""
+
+        return batch.get_or_create_visit(patient, self.record.visit_id, self.record.admission_date)
+
+    def _create_stay_in_batch(self, batch, visit: Visit):
+        """Creates a new stay from the message record for a given visit in a given HL7MessageBatch."""
+
+        return batch.create_stay(visit, self.record.movement_id, self.record.start_date,
+                                 self.record.ward_id, self.record.room_id, self.record.bed_id)
+
+    def get_references(self):
+        """
+        Returns the patient_id, the visit_id and the location ids referenced by the message record.
+        Not usable ids are returned as None, because not every message type needs all of them.
+        """
+
+        return self.record.patient_id, self.record.visit_id, (self.record.ward_id, self.record.room_id,
+                                                              self.record.bed_id)
+
+    def get_raw_messages(self):
+        """Returns the HL7-message strings of the message."""
+        return self.raw_message,
+
+    def get_control_ids(self):
+        """Returns the message control ids (MSH-10) of the HL7-messages represented by this instance."""
+        return self.record.control_id,
+
+    def get_trigger_events(self):
+        """Returns the trigger events of the HL7-messages represented by this instance."""
+        return self.record.trigger_event,
 
     @abstractmethod
     def parse_message(self):
-        """Parses the message from the segments in the instance attributes and saves the result in the database."""
+        """Parses the message from the record in the instance attributes and saves the result in the database."""
         pass
 
+    def parse_message_in_batch(self, batch):
+        """
+        Parses the message as part of a given HL7MessageBatch.
+        By default all pending changes of the batch are written and the message is parsed on its own.
+        """
+
+        batch.flush()
+        self.parse_message()
+        batch.refresh()
+
 
 class AdmissionHL7Message(HL7Message):
     """A class for admission HL7-messages."""
 
+    __slots__ = ()
+    creates_locations = True
+
     def parse_message(self):
         # only parse the visit, if there is a given bed id
-        bed_id = self._pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
-                                                 component_num=PATIENT_LOCATION_BED_COMPONENT)
-        if bed_id:
+        if self.record.bed_id:
             patient = self._get_or_create_patient()
             visit = self._get_or_create_visit(patient)
 
             self._create_stay(visit)
 
+    def parse_message_in_batch(self, batch):
+        # only parse the visit, if there is a given bed id
+        if self.record.bed_id:
+            patient = self._get_or_create_patient_in_batch(batch)
+            visit = self._get_or_create_visit_in_batch(batch, patient)
+
+            self._create_stay_in_batch(batch, visit)
+
 
 class TransferHL7Message(HL7Message):
     """A class for transfer HL7-messages."""
 
-    def parse_message(self):
-        start_date_string = self._zbe_segment.extract_field(field_num=ZBE_START_DATE_FIELD)
-        start_date = timezone.datetime.strptime(start_date_string, HL7_DATE_TIME_FORMAT)
+    __slots__ = ()
+    creates_locations = True
 
+    def parse_message(self):
         patient = self._get_or_create_patient()
         visit = self._get_or_create_visit(patient)
 
-        # get the last stay with visit and end_date == None
-        stay = Stay.objects.filter(visit=visit, end_date=None).last()
-        # set end_date if stay is not none
-        # the stay could be None if the parsing starts after the admission
+        # set the end_date of the last stay with visit and end_date == None
+        # there could be no such stay if the parsing starts after the admission
+        open_stay_ids = self._get_open_stay_ids(visit.visit_id)
+        if open_stay_ids:
+            open_stay_ids = self._close_last_open_stay(visit.visit_id, open_stay_ids)
+
+        # only create the new stay, if there is a given bed id
+        if self.record.bed_id:
+            self._create_stay(visit, open_stay_ids)
+
+    def parse_message_in_batch(self, batch):
+        patient = self._get_or_create_patient_in_batch(batch)
+        visit = self._get_or_create_visit_in_batch(batch, patient)
+
+        # close the last open stay of the visit
+        stay = batch.last_open_stay(visit.visit_id)
         if stay:
-            stay.end_date = start_date
-            stay.save()
+            batch.close_stay(stay, self.record.start_date)
 
         # only create the new stay, if there is a given bed id
-        bed_id = self._pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
-                                                 component_num=PATIENT_LOCATION_BED_COMPONENT)
-        if bed_id:
-            self._create_stay(visit)
+        if self.record.bed_id:
+            self._create_stay_in_batch(batch, visit)
 
 
 class DischargeHL7Message(HL7Message):
     """A class for discharge HL7-messages."""
 
-    def parse_message(self):
-        movement_id_string = self._zbe_segment.extract_field(field_num=ZBE_MOVEMENT_ID_FIELD)
-        movement_id = int(movement_id_string)
-        visit_id_string = self._pv1_segment.extract_field(field_num=PV1_VISIT_ID_FIELD)
-        visit_id = int(visit_id_string)
+    __slots__ = ()
 
-        discharge_date_string = self._pv1_segment.extract_field(field_num=PV1_DISCHARGE_DATE_FIELD)
+    def parse_message(self):
+        visit_id = self.record.visit_id
 
-        discharge_date = timezone.datetime.strptime(discharge_date_string, HL7_DATE_TIME_FORMAT)
+        # update the visits discharge_date
+        Visit.objects.filter(visit_id=visit_id).update(discharge_date=self.record.discharge_date)
 
-        start_date_string = self._zbe_segment.extract_field(field_num=ZBE_START_DATE_FIELD)
-        start_date = timezone.datetime.strptime(start_date_string, HL7_DATE_TIME_FORMAT)
+        # create the new discharge for the last stay with visit and end_date == None and set its end_date
+        open_stay_ids = self._get_open_stay_ids(visit_id)
+        if open_stay_ids:
+            Discharge.objects.create(movement_id=self.record.movement_id, stay_id=open_stay_ids[-1])
+            self._close_last_open_stay(visit_id, open_stay_ids)
 
-        # update the visits discharge_date
-        Visit.objects.filter(visit_id=visit_id).update(discharge_date=discharge_date)
+    def parse_message_in_batch(self, batch):
+        visit_id = self.record.visit_id
 
-        # get the last stay with visit and end_date == None
-        stay = Stay.objects.filter(visit_id=visit_id, end_date=None).last()
+        batch.update_visit_discharge_date(visit_id, self.record.discharge_date)
 
-        # create the new discharge, set the end_date of the stay and safe the stay if the stay is not none
+        # the discharge references the stay, so the stay has to be saved already
+        stay = batch.last_open_stay(visit_id, saved=True)
         if stay:
-            Discharge.objects.create(movement_id=movement_id, stay=stay)
-
-            stay.end_date = start_date
-            stay.save()
+            batch.create_discharge(self.record.movement_id, stay)
+            batch.close_stay(stay, self.record.start_date)
 
 
 class UpdateHL7Message(HL7Message):
     """A class for update HL7-messages."""
 
-    def parse_message(self):
-        visit_id_string = self._pv1_segment.extract_field(field_num=PV1_VISIT_ID_FIELD)
-        visit_id = int(visit_id_string)
+    __slots__ = ()
+    creates_locations = True
 
+    def parse_message(self):
         # handle message also like a transfer and create a new stay if there are no open stays
         # there could be no open stays if the parsing starts after the admission
-        if not Stay.objects.filter(visit_id=visit_id, end_date=None).exists():
+        open_stay_ids = self._get_open_stay_ids(self.record.visit_id)
+        if not open_stay_ids:
             patient = self._get_or_create_patient()
             visit = self._get_or_create_visit(patient)
             # only create the new stay, if there is a given bed id
-            bed_id = self._pv1_segment.extract_field(field_num=PV1_PATIENT_LOCATION_FIELD,
-                                                     component_num=PATIENT_LOCATION_BED_COMPONENT)
-            if bed_id:
-                self._create_stay(visit)
+            if self.record.bed_id:
+                self._create_stay(visit, open_stay_ids)
 
         # update the important patient attributes
-        patient_id_string = self._pid_segment.extract_field(field_num=PID_PATIENT_ID_FIELD)
-        patient_id = int(patient_id_string)
-
-        date_of_birth_string = self._pid_segment.extract_field(field_num=PID_DOB_FIELD)
-        date_of_birth = timezone.datetime.strptime(date_of_birth_string, HL7_DATE_FORMAT).date()
+        Patient.objects.filter(patient_id=self.record.patient_id).update(sex=self.record.sex,
+                                                                         date_of_birth=self.record.date_of_birth)
 
-        sex = self._pid_segment.extract_field(field_num=PID_SEX_FILED)
+    def parse_message_in_batch(self, batch):
+        # handle message also like a transfer and create a new stay if there are no open stays
+        if not batch.last_open_stay(self.record.visit_id):
+            patient = self._get_or_create_patient_in_batch(batch)
+            visit = self._get_or_create_visit_in_batch(batch, patient)
+            # only create the new stay, if there is a given bed id
+            if self.record.bed_id:
+                self._create_stay_in_batch(batch, visit)
 
-        Patient.objects.filter(patient_id=patient_id).update(sex=sex, date_of_birth=date_of_birth)
+        # update the important patient attributes
+        batch.update_patient(self.record.patient_id, self.record.sex, self.record.date_of_birth)
 
 
 class CancelAdmissionHL7Message(HL7Message):
     """A class for the admission canceling HL7-messages."""
 
-    def parse_message(self):
-        movement_id_string = self._zbe_segment.extract_field(field_num=ZBE_MOVEMENT_ID_FIELD)
-        movement_id = int(movement_id_string)
-        visit_id_string = self._pv1_segment.extract_field(field_num=PV1_VISIT_ID_FIELD)
-        visit_id = int(visit_id_string)
+    __slots__ = ()
 
+    def parse_message(self):
         # get and delete the canceled stay if it exists
         # couldn't exist if the parsing starts after the admission
-        stay = Stay.objects.filter(visit_id=visit_id, movement_id=movement_id).last()
+        stay = Stay.objects.filter(visit_id=self.record.visit_id, movement_id=self.record.movement_id).last()
         if stay:
             stay.delete()
+            open_stay_cache.invalidate(self.record.visit_id)
 
 
 class CancelTransferHL7Message(HL7Message):
     """A class for the transfer canceling HL7-messages."""
+
+    __slots__ = ()
+
     def parse_message(self):
-        movement_id_string = self._zbe_segment.extract_field(field_num=ZBE_MOVEMENT_ID_FIELD)
-        movement_id = int(movement_id_string)
-        visit_id_string = self._pv1_segment.extract_field(field_num=PV1_VISIT_ID_FIELD)
-        visit_id = int(visit_id_string)
+        movement_id = self.record.movement_id
+        visit_id = self.record.visit_id
 
         # get and delete the canceled stay if exists
         # couldn't exist if the parsing starts after the admission
@@ -274,21 +501,20 @@ class CancelTransferHL7Message(HL7Message):
             if old_stay:
                 Stay.objects.filter(id=old_stay.id).update(end_date=None)
 
+            open_stay_cache.invalidate(visit_id)
+
 
 class CancelDischargeHL7Message(HL7Message):
     """A class for the discharge canceling HL7-messages."""
 
-    def parse_message(self):
-        movement_id_string = self._zbe_segment.extract_field(field_num=ZBE_MOVEMENT_ID_FIELD)
-        movement_id = int(movement_id_string)
-        visit_id_string = self._pv1_segment.extract_field(field_num=PV1_VISIT_ID_FIELD)
-        visit_id = int(visit_id_string)
+    __slots__ = ()
 
+    def parse_message(self):
         # get and delete discharge and update the end_date of the connected stay
         # and the discharge_date of the connected visit to None if exists
         # couldn't exist if the parsing starts after the admission
-        discharge = Discharge.objects.select_related("stay__visit").filter(movement_id=movement_id,
-                                                                           stay__visit_id=visit_id).last()
+        discharge = Discharge.objects.select_related("stay__visit").filter(
+            movement_id=self.record.movement_id, stay__visit_id=self.record.visit_id).last()
         if discharge:
             discharge.stay.end_date = None
             discharge.stay.save()
@@ -296,58 +522,760 @@ class CancelDischargeHL7Message(HL7Message):
             discharge.stay.visit.save()
             discharge.delete()
 
+            open_stay_cache.invalidate(self.record.visit_id)
+
+
+class CompactedHL7Message(HL7Message, ABC):
+    """
+    A class for the net effect of a HL7-message and the following message of the same visit, that cancels it.
+    The record is the one of the canceled message.
+    """
+
+    __slots__ = ("_cancel_control_id", "_cancel_trigger_event", "_cancel_raw_message")
+
+    def __init__(self, canceled_message: HL7Message, cancel_message: HL7Message):
+        # the messages are already decoded, so the record is reused instead of decoding a message again
+        self.record = canceled_message.record
+        self.raw_message = canceled_message.raw_message
+        self._cancel_control_id = cancel_message.record.control_id
+        self._cancel_trigger_event = cancel_message.record.trigger_event
+        self._cancel_raw_message = cancel_message.raw_message
+
+    def get_raw_messages(self):
+        return self.raw_message, self._cancel_raw_message
+
+    def get_control_ids(self):
+        return self.record.control_id, self._cancel_control_id
+
+    def get_trigger_events(self):
+        return self.record.trigger_event, self._cancel_trigger_event
+
+
+class CompactedAdmissionHL7Message(CompactedHL7Message):
+    """
+    A class for an admission HL7-message with a bed and the following admission canceling message.
+    Only the patient, the visit and the locations are created, because the stay is deleted by the cancellation.
+    """
+
+    __slots__ = ()
+    creates_locations = True
+
+    def parse_message(self):
+        patient = self._get_or_create_patient()
+        self._get_or_create_visit(patient)
+        self._get_or_create_locations()
+
+    def parse_message_in_batch(self, batch):
+        patient = self._get_or_create_patient_in_batch(batch)
+        self._get_or_create_visit_in_batch(batch, patient)
+        batch.get_or_create_locations(self.record.ward_id, self.record.room_id, self.record.bed_id,
+                                      self.record.start_date)
+
+
+class CompactedTransferHL7Message(CompactedHL7Message):
+    """
+    A class for a transfer HL7-message with a bed and the following transfer canceling message.
+    The new stay is not created and deleted, only the end_date of the last open stay is set
+    and the stay, that is reopened by the cancellation, is reopened.
+    If it is the same stay, nothing has to be changed.
+    """
+
+    __slots__ = ()
+    creates_locations = True
+
+    def parse_message(self):
+        visit_id = self.record.visit_id
+
+        patient = self._get_or_create_patient()
+        self._get_or_create_visit(patient)
+        self._get_or_create_locations()
+
+        # the stay closed by the transfer
+        open_stay_ids = self._get_open_stay_ids(visit_id)
+        closed_stay_id = open_stay_ids[-1] if open_stay_ids else None
+
+        # the stay reopened by the cancellation
+        reopened_stay_id = Stay.objects.filter(visit_id=visit_id, movement_id__lt=self.record.movement_id) \
+            .values_list("id", flat=True).last()
+
+        if closed_stay_id != reopened_stay_id:
+            if closed_stay_id:
+                Stay.objects.filter(id=closed_stay_id).update(end_date=self.record.start_date)
+            if reopened_stay_id:
+                Stay.objects.filter(id=reopened_stay_id).update(end_date=None)
+
+            open_stay_cache.invalidate(visit_id)
+
+
+class HL7MessageCompactor:
+    """
+    A class for compacting sorted HL7-messages before they are parsed.
+    An admission or transfer with a bed, that is directly followed by its cancellation
+    (same visit and movement id without other messages of the visit in between), is replaced by its net effect.
+    Only the last messages within the window are kept in memory for the compaction.
+    """
+
+    def __init__(self, window: int = None):
+        if window is None:
+            window = settings.HL7_COMPACTION_WINDOW
+
+        self._window = window
+        self.number_of_compacted_messages = 0
+
+    def compact(self, hl7_messages):
+        """Yields the given Hl7Message instances in the same order with the compacted pairs."""
+
+        # every entry is a list, so that its message can be replaced by the compacted message
+        entries = deque()
+        last_entries = dict()
+
+        for hl7_message in hl7_messages:
+            visit_id = hl7_message.record.visit_id
+            last_entry = last_entries.get(visit_id)
+
+            compacted_message = self.__compact(last_entry[0], hl7_message) if last_entry else None
+            if compacted_message:
+                last_entry[0] = compacted_message
+                self.number_of_compacted_messages += 2
+                continue
+
+            entry = [hl7_message]
+            entries.append(entry)
+            last_entries[visit_id] = entry
+
+            if len(entries) > self._window:
+                oldest_entry = entries.popleft()
+                oldest_visit_id = oldest_entry[0].record.visit_id
+                if last_entries.get(oldest_visit_id) is oldest_entry:
+                    del last_entries[oldest_visit_id]
+                yield oldest_entry[0]
+
+        for entry in entries:
+            yield entry[0]
+
+    @staticmethod
+    def __compact(hl7_message: HL7Message, next_hl7_message: HL7Message):
+        """Returns the compacted message of two messages of the same visit or None if they can not be compacted."""
+
+        record = hl7_message.record
+        next_record = next_hl7_message.record
+
+        # without bed no stay is created, so the cancellation would delete or reopen other stays
+        if record.visit_id is None or not record.bed_id or record.movement_id != next_record.movement_id:
+            return None
+
+        if type(hl7_message) is AdmissionHL7Message and type(next_hl7_message) is CancelAdmissionHL7Message:
+            return CompactedAdmissionHL7Message(hl7_message, next_hl7_message)
+        if type(hl7_message) is TransferHL7Message and type(next_hl7_message) is CancelTransferHL7Message:
+            return CompactedTransferHL7Message(hl7_message, next_hl7_message)
+
+        return None
+
+
+class HL7PriorityScheduler:
+    """
+    A class for draining a backlog of sorted HL7-messages by the recency of their visits.
+    The messages are grouped by visit and the visits with the most recent activity are yielded first,
+    so that the current state of the wards is correct long before the old messages are parsed.
+    The visits of the same patient are kept in one group, so that the messages of every visit
+    and of every patient keep their order.
+    Only a window of messages is kept in memory and scheduled at once, the windows keep their order.
+    Groups with a message within the near-time age are in the near-time lane, all others in the backlog lane.
+    """
+
+    NEAR_TIME_LANE = "near-time"
+    BACKLOG_LANE = "backlog"
+
+    def __init__(self, near_time_age: float = None, window: int = None):
+        if near_time_age is None:
+            near_time_age = settings.HL7_PRIORITY_NEAR_TIME_AGE
+        if window is None:
+            window = settings.HL7_PRIORITY_WINDOW
+
+        self._near_time_age = near_time_age
+        self._window = max(window, 1)
+        # the number of visits and messages and the age (in seconds) of the oldest message of every lane
+        # a visit with messages in several windows is counted in every window
+        self.lanes = {lane: {"visits": 0, "messages": 0, "age": None}
+                      for lane in (self.NEAR_TIME_LANE, self.BACKLOG_LANE)}
+
+    def schedule(self, hl7_messages):
+        """Yields the given sorted Hl7Message instances grouped by visit per window, the most recent visits first."""
+
+        window = []
+        for hl7_message in hl7_messages:
+            window.append(hl7_message)
+            if len(window) >= self._window:
+                yield from self.__schedule_window(window)
+        if window:
+            yield from self.__schedule_window(window)
+
+        for lane, report in self.lanes.items():
+            logger.info("HL7 %s lane: %s messages of %s visits, the oldest is %s s old", lane, report["messages"],
+                        report["visits"], report["age"])
+
+    def __schedule_window(self, window: list):
+        """Yields the Hl7Message instances of a given window grouped by visit and empties the window."""
+
+        # a union-find of the visit and patient ids, so that every group contains all linked visits
+        parents = dict()
+        for hl7_message in window:
+            keys = self.__get_keys(hl7_message)
+            for key in keys:
+                parents.setdefault(key, key)
+            for key in keys[1:]:
+                parents[self.__find(parents, key)] = self.__find(parents, keys[0])
+
+        groups = dict()
+        for hl7_message in window:
+            keys = self.__get_keys(hl7_message)
+            group_key = self.__find(parents, keys[0]) if keys else None
+            groups.setdefault(group_key, []).append(hl7_message)
+        window.clear()
+
+        # the messages are sorted, so the last message of every group is its most recent activity
+        # the most recent group is the last one, so that the groups are taken from the end
+        groups = sorted(groups.values(), key=lambda messages: messages[-1].message_creation)
+
+        now = timezone.datetime.now()
+        for messages in groups:
+            self.__count_lane(messages, now)
+
+        while groups:
+            # the yielded messages are released as early as possible
+            yield from groups.pop()
+
+    @staticmethod
+    def __get_keys(hl7_message: HL7Message):
+        """Returns the keys of the visit and the patient of a given Hl7Message instance, that are usable."""
+
+        record = hl7_message.record
+        return [key for key in (("visit", record.visit_id), ("patient", record.patient_id)) if key[1] is not None]
+
+    @staticmethod
+    def __find(parents: dict, key):
+        """Returns the root key of the group of a given key and shortens the path to it."""
+
+        while parents[key] != key:
+            parents[key] = parents[parents[key]]
+            key = parents[key]
+        return key
+
+    def __count_lane(self, messages, now):
+        """Adds the messages of a group to the report of its lane."""
+
+        last_creation = _parse_date_time(messages[-1].message_creation[:14], HL7_DATE_TIME_FORMAT)
+        first_creation = _parse_date_time(messages[0].message_creation[:14], HL7_DATE_TIME_FORMAT)
+
+        if last_creation and (now - last_creation).total_seconds() <= self._near_time_age:
+            report = self.lanes[self.NEAR_TIME_LANE]
+        else:
+            report = self.lanes[self.BACKLOG_LANE]
+
+        report["visits"] += len({hl7_message.record.visit_id for hl7_message in messages})
+        report["messages"] += len(messages)
+        if first_creation:
+            age = (now - first_creation).total_seconds()
+            report["age"] = age if report["age"] is None else max(report["age"], age)
+
+
+class HL7ParsingStatistics:
+    """A class for the statistics of a parsing run."""
+
+    def __init__(self):
+        self.number_of_messages = 0
+        self.number_of_duplicates = 0
+        self.number_of_compacted_messages = 0
+        self.number_of_quarantined_messages = 0
+        # the report of the HL7PriorityScheduler lanes, if the messages are scheduled by priority
+        self.lanes = None
+        self.duration = 0.0
+        self._start = time.perf_counter()
+
+        # the quarantined messages are counted by all apply workers
+        self._lock = threading.Lock()
+
+    def count_messages(self, hl7_messages):
+        """Yields the given HL7Message instances and counts them."""
+
+        for hl7_message in hl7_messages:
+            self.number_of_messages += 1
+            yield hl7_message
+
+    def count_quarantined_messages(self, number: int):
+        """Adds a given number of quarantined messages."""
+
+        with self._lock:
+            self.number_of_quarantined_messages += number
+
+    def stop(self):
+        """Stops the time measurement of the parsing run."""
+        self.duration = time.perf_counter() - self._start
+
+    @property
+    def messages_per_second(self):
+        """Returns the number of parsed messages per second."""
+
+        if self.duration > 0:
+            return self.number_of_messages / self.duration
+        return 0.0
+
+    def to_dict(self):
+        """Returns the numbers of the parsing run as dictionary."""
+
+        return {
+            "messages": self.number_of_messages,
+            "duplicates": self.number_of_duplicates,
+            "compacted_messages": self.number_of_compacted_messages,
+            "quarantined_messages": self.number_of_quarantined_messages,
+            "duration": self.duration,
+        }
+
+    def __str__(self):
+        return f"{self.number_of_messages} messages in {self.duration:.3f} s " \
+               f"({self.messages_per_second:.1f} messages/s, {self.number_of_duplicates} duplicates dropped, " \
+               f"{self.number_of_compacted_messages} canceled messages compacted, " \
+               f"{self.number_of_quarantined_messages} messages quarantined)"
+
 
 class HL7MessageParser:
     """A class for the parsing of HL7-files."""
 
     @classmethod
-    def parse_hl7_messages_from_directory(cls, path: str):
-        """Parses all HL7-files in a given directory and save the results in the database."""
+    def parse_hl7_messages_from_directory(cls, path: str, memory_budget: int = None, batch_size: int = None,
+                                          workers: int = None, apply_workers: int = None):
+        """
+        Parses all HL7-files in a given directory and save the results in the database.
+        The files are deleted after all of their messages are committed or quarantined,
+        so that an aborted run is repeated by the next run without the already parsed messages.
+        Returns the HL7ParsingStatistics of the run.
+        """
+
+        trace = HL7Trace("directory")
+        attributes = {"path": path}
+        try:
+            with trace.span("run", measure_memory=True):
+                # parse all messages in the order of their creation
+                file_paths = cls._get_hl7_file_paths(path)
+                hl7_messages = cls.stream_hl7_messages_from_files(file_paths, memory_budget, workers, trace)
+                statistics = cls.parse_hl7_messages(hl7_messages, batch_size, apply_workers, trace=trace)
+
+                with trace.span("remove_files"):
+                    for file_path in file_paths:
+                        os.remove(file_path)
+
+            attributes.update(statistics.to_dict(), files=len(file_paths))
+        finally:
+            trace.close(**attributes)
+
+        logger.info("Parsed the HL7-files from %s: %s", path, statistics)
+
+        return statistics
 
-        # get all hl7 messages from the hl7_files
-        hl7_messages = []
-        for filename in os.listdir(path):
-            if filename.endswith(".hl7"):
-                file_path = os.path.join(path, filename)
-
-                new_hl7_messages = cls._create_hl7_messages_from_file(file_path)
-                # insert to the right position in the list (sorted)
-                for new_hl7_message in new_hl7_messages:
-                    bisect.insort(hl7_messages, new_hl7_message,
-                                  key=lambda msg: msg.message_creation)
-
-                os.remove(file_path)
-        # parse all messages in the sorted list
+    @classmethod
+    def parse_hl7_messages(cls, hl7_messages, batch_size: int = None, apply_workers: int = None,
+                           priority_lanes: bool = None, trace: HL7Trace = None):
+        """
+        Parses the given sorted Hl7Message instances and save the results in the database.
+        If the batch_size is greater than 0, the messages are parsed in batches with one transaction per batch,
+        otherwise they are parsed on their own and committed in chunks of HL7_COMMIT_CHUNK_SIZE messages.
+        If there are more than one apply_workers, the patients are partitioned across worker threads.
+        With priority_lanes the visits with the most recent activity in a window of messages are parsed first.
+        Messages, that can not be parsed, are quarantined without stopping the other messages.
+        Already parsed messages are dropped by their control id and canceled messages are compacted before.
+        The stages are measured with the spans of the given HL7Trace.
+        Returns the HL7ParsingStatistics of the run.
+        """
+
+        if batch_size is None:
+            batch_size = settings.HL7_BATCH_SIZE
+        if apply_workers is None:
+            apply_workers = settings.HL7_APPLY_WORKERS
+        if priority_lanes is None:
+            priority_lanes = settings.HL7_PRIORITY_LANES
+        if trace is None:
+            trace = HL7Trace("messages", enabled=False)
+
+        # the workers have their own connections, that can not see the rows of a running transaction
+        if apply_workers > 1 and connection.in_atomic_block:
+            logger.warning("The HL7-messages are parsed in a transaction, so they are not parsed in parallel")
+            apply_workers = 1
+
+        statistics = HL7ParsingStatistics()
+        hl7_messages = statistics.count_messages(hl7_messages)
+
+        deduplicator = None
+        if settings.HL7_DEDUPLICATION:
+            deduplicator = HL7MessageDeduplicator()
+            hl7_messages = trace.iterate("deduplicate", deduplicator.drop_duplicates(hl7_messages))
+
+        if priority_lanes:
+            scheduler = HL7PriorityScheduler()
+            statistics.lanes = scheduler.lanes
+            hl7_messages = trace.iterate("schedule", scheduler.schedule(hl7_messages))
+
+        compactor = None
+        if settings.HL7_COMPACTION_WINDOW > 0:
+            compactor = HL7MessageCompactor()
+            hl7_messages = trace.iterate("compact", compactor.compact(hl7_messages))
+
+        with trace.span("apply", measure_memory=True):
+            if apply_workers > 1:
+                cls.__parse_hl7_messages_in_parallel(hl7_messages, apply_workers, batch_size, deduplicator,
+                                                     statistics, trace)
+            else:
+                cls.__parse_hl7_messages_in_chunks(hl7_messages, batch_size, deduplicator, statistics, trace)
+
+        statistics.number_of_duplicates = deduplicator.number_of_duplicates if deduplicator else 0
+        statistics.number_of_compacted_messages = compactor.number_of_compacted_messages if compactor else 0
+        statistics.stop()
+
+        return statistics
+
+    @classmethod
+    def __parse_hl7_messages_in_chunks(cls, hl7_messages, batch_size: int, deduplicator: HL7MessageDeduplicator,
+                                       statistics: HL7ParsingStatistics, trace: HL7Trace):
+        """
+        Parses the given Hl7Message instances in batches or in chunks of messages parsed on their own.
+        A threading.Event between them ends the current chunk and is set after it is committed.
+        """
+
+        if batch_size > 0:
+            chunk_size = batch_size
+            parse_chunk = cls.__parse_hl7_message_batch
+        else:
+            chunk_size = max(settings.HL7_COMMIT_CHUNK_SIZE, 1)
+            parse_chunk = cls.__parse_hl7_message_chunk
+
+        chunk = []
         for hl7_message in hl7_messages:
-            hl7_message.parse_message()
+            # an event of the dispatching thread is set, as soon as the messages before it are committed
+            if isinstance(hl7_message, threading.Event):
+                if chunk:
+                    parse_chunk(chunk, deduplicator, statistics, trace)
+                    chunk = []
+                hl7_message.set()
+                continue
+
+            chunk.append(hl7_message)
+            if len(chunk) >= chunk_size:
+                parse_chunk(chunk, deduplicator, statistics, trace)
+                chunk = []
+        if chunk:
+            parse_chunk(chunk, deduplicator, statistics, trace)
+
+    @classmethod
+    def __parse_hl7_messages_in_parallel(cls, hl7_messages, apply_workers: int, batch_size: int,
+                                         deduplicator: HL7MessageDeduplicator, statistics: HL7ParsingStatistics,
+                                         trace: HL7Trace):
+        """
+        Parses the given Hl7Message instances in worker threads, that each parse the messages of a partition
+        of the patients in their order. So the messages of a visit keep their order, while independent patients
+        are parsed concurrently and no two workers write the same patient.
+        If the patient id of a visit changes to a patient of another partition, the messages of both partitions
+        are committed before, so that the patient can move to the partition of the visit.
+        The locations are shared by all patients, so they are created in this thread before.
+        """
+
+        message_queues = [queue.Queue(maxsize=settings.HL7_APPLY_QUEUE_SIZE) for _ in range(apply_workers)]
+        errors = []
+        threads = [threading.Thread(target=cls.__run_apply_worker,
+                                    args=(message_queue, batch_size, deduplicator, statistics, trace, errors),
+                                    name=f"HL7ApplyWorker-{number}", daemon=True)
+                   for number, message_queue in enumerate(message_queues)]
+        for thread in threads:
+            thread.start()
+
+        # the partition of every dispatched visit and patient, so that a visit keeps its worker,
+        # even if the patient id of its messages changes
+        partitions = dict()
+        number_of_drains = 0
+
+        # the locations are cached by this thread outside the transactions of the workers
+        check_cache_generations()
+
+        try:
+            for hl7_message in hl7_messages:
+                if errors:
+                    break
+
+                if hl7_message.creates_locations and hl7_message.record.bed_id:
+                    with trace.span("create_locations"):
+                        cls.__create_locations(hl7_message)
+
+                visit_key = ("visit", hl7_message.record.visit_id)
+                patient_key = ("patient", hl7_message.record.patient_id)
+                partition = partitions.get(visit_key)
+                patient_partition = partitions.get(patient_key)
+                if partition is None:
+                    partition = patient_partition
+                if partition is None:
+                    patient_id = hl7_message.record.patient_id
+                    partition = hash(patient_id) % apply_workers if patient_id else 0
+                elif patient_partition is not None and patient_partition != partition:
+                    # the earlier messages of the patient could still be parsed by the worker of its partition
+                    with trace.span("drain"):
+                        cls.__drain_partitions([message_queues[partition], message_queues[patient_partition]],
+                                               errors)
+                    number_of_drains += 1
+                partitions[visit_key] = partitions[patient_key] = partition
+
+                with trace.span("dispatch"):
+                    message_queues[partition].put(hl7_message)
+        finally:
+            # the end of the messages is marked with None
+            for message_queue in message_queues:
+                message_queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+
+        if number_of_drains:
+            logger.info("The apply workers were drained %s times for visits with a changed patient id",
+                        number_of_drains)
+
+    @staticmethod
+    def __drain_partitions(message_queues, errors: list):
+        """
+        Waits until the apply workers of the given queues have committed all messages put into them before.
+        Every worker sets the event, that is put into its queue, after it has parsed the messages before it.
+        """
+
+        events = [threading.Event() for _ in message_queues]
+        for message_queue, event in zip(message_queues, events):
+            message_queue.put(event)
+        for event in events:
+            # a failed worker sets the events, while it takes its remaining messages
+            while not event.wait(timeout=1) and not errors:
+                pass
+
+    @classmethod
+    def __run_apply_worker(cls, message_queue: queue.Queue, batch_size: int, deduplicator: HL7MessageDeduplicator,
+                           statistics: HL7ParsingStatistics, trace: HL7Trace, errors: list):
+        """Parses the Hl7Message instances from a given queue until None is received."""
+
+        hl7_messages = iter(message_queue.get, None)
+        try:
+            cls.__parse_hl7_messages_in_chunks(hl7_messages, batch_size, deduplicator, statistics, trace)
+        except Exception as error:
+            logger.exception("The HL7 apply worker failed")
+            errors.append(error)
+            # the remaining messages are taken, so that the dispatching thread is never blocked
+            for hl7_message in hl7_messages:
+                if isinstance(hl7_message, threading.Event):
+                    hl7_message.set()
+        finally:
+            # every worker thread has its own database connection
+            connection.close()
+
+    @staticmethod
+    def __create_locations(hl7_message: HL7Message):
+        """Creates the locations of a given Hl7Message instance, if they do not exist already."""
+
+        try:
+            hl7_message._get_or_create_locations()
+        except (InterfaceError, OperationalError):
+            raise
+        except Exception:
+            # the message fails again in its worker, where it is quarantined
+            pass
+
+    @classmethod
+    def __parse_hl7_message_batch(cls, batch, deduplicator: HL7MessageDeduplicator,
+                                  statistics: HL7ParsingStatistics, trace: HL7Trace):
+        """
+        Parses a given batch of Hl7Message instances and stores their control ids in the same transaction.
+        If the batch fails, its messages are parsed on their own, so that only the failing messages are quarantined.
+        """
+
+        try:
+            with trace.span("commit_batch"), hl7_ingest_batch_duration.time(mode="batch"), transaction.atomic(), \
+                    CacheGenerationCheck():
+                HL7MessageBatch(batch, trace).parse()
+                if deduplicator:
+                    deduplicator.mark_processed(batch)
+                increase_cache_generation()
+        except (InterfaceError, OperationalError):
+            raise
+        except Exception:
+            logger.exception("The batch of %s HL7-messages failed, its messages are parsed on their own", len(batch))
+            cls.__parse_hl7_message_chunk(batch, deduplicator, statistics, trace)
+        else:
+            count_ingested_hl7_messages(batch)
+
+    @classmethod
+    def __parse_hl7_message_chunk(cls, chunk, deduplicator: HL7MessageDeduplicator,
+                                  statistics: HL7ParsingStatistics, trace: HL7Trace):
+        """
+        Parses the given chunk of Hl7Message instances on their own in one transaction with a savepoint per message.
+        A failing message is rolled back to its savepoint and quarantined, the rest of the chunk is committed.
+        The control ids are stored in the savepoint of their message, so that they can only fail their message.
+        """
+
+        parsed_messages = []
+
+        with trace.span("commit_chunk"), hl7_ingest_batch_duration.time(mode="chunk"), transaction.atomic(), \
+                CacheGenerationCheck():
+            for hl7_message in chunk:
+                try:
+                    with trace.span("parse_message", type(hl7_message).__name__), transaction.atomic():
+                        hl7_message.parse_message()
+                        # the control ids of the quarantined messages are not stored, so that they can be parsed again
+                        if deduplicator:
+                            deduplicator.mark_processed([hl7_message])
+                # errors of the connection are not caused by the message, so the run is aborted and repeated later
+                except (InterfaceError, OperationalError):
+                    raise
+                except Exception as error:
+                    raw_messages = hl7_message.get_raw_messages()
+                    quarantine_hl7_messages(raw_messages, error)
+                    statistics.count_quarantined_messages(len(raw_messages))
+                else:
+                    parsed_messages.append(hl7_message)
+
+            # the other processes clear their caches after the changes of the chunk are committed
+            if parsed_messages:
+                increase_cache_generation()
+
+        count_ingested_hl7_messages(parsed_messages)
+
+    @classmethod
+    def parse_hl7_message_string(cls, message: str):
+        """
+        Parses a single HL7-message string and saves the result in the database, if the message is usable.
+        Returns the HL7ParsingStatistics of the message, that count the message as quarantined,
+        if it can not be decoded, or None if the message is not usable.
+        """
+
+        statistics = HL7ParsingStatistics()
+        hl7_message = cls._load_hl7_message_from_string(message, statistics)
+        if hl7_message:
+            return cls.parse_hl7_messages([hl7_message], batch_size=0, priority_lanes=False)
+
+        if statistics.number_of_quarantined_messages:
+            statistics.stop()
+            return statistics
+        return None
+
+    @classmethod
+    def stream_hl7_messages_from_directory(cls, path: str, memory_budget: int = None, workers: int = None):
+        """
+        Yields the Hl7Message instances from all HL7-files in a given directory sorted by their creation.
+        The files are deleted after all messages are yielded.
+        """
+
+        file_paths = cls._get_hl7_file_paths(path)
+        yield from cls.stream_hl7_messages_from_files(file_paths, memory_budget, workers)
+
+        for file_path in file_paths:
+            os.remove(file_path)
+
+    @classmethod
+    def stream_hl7_messages_from_files(cls, file_paths, memory_budget: int = None, workers: int = None,
+                                       trace: HL7Trace = None):
+        """
+        Yields the Hl7Message instances from the given HL7-files sorted by their creation.
+        The messages are sorted within the given memory budget
+        and the files are parsed by the given number of worker processes if it is worth it.
+        The reading, sorting and decoding are measured with the spans of the given HL7Trace.
+        """
+
+        if trace is None:
+            trace = HL7Trace("files", enabled=False)
+
+        with HL7MessageSorter(memory_budget) as sorter:
+            # read the messages file by file and let the sorter spill them to disk if necessary
+            with trace.span("sort", measure_memory=True):
+                for _, messages in trace.iterate("read", HL7ParseStage(workers).parse_files(file_paths)):
+                    for message_creation, message in messages:
+                        sorter.add(message_creation, message)
+
+            # only load the Hl7Message instances while merging, so that just a few of them are in memory
+            for message in trace.iterate("sort", sorter.sorted_messages()):
+                with trace.span("decode"):
+                    hl7_message = HL7ParseStage.load(message)
+                if hl7_message:
+                    yield hl7_message
+
+    @staticmethod
+    def _get_hl7_file_paths(path: str):
+        """Returns the paths of all HL7-files in a given directory."""
+        return [os.path.join(path, filename) for filename in os.listdir(path) if filename.endswith(".hl7")]
 
     @classmethod
     def _create_hl7_messages_from_file(cls, path: str):
         """Parses a HL7-file on a given path into a list of Hl7Message instances."""
 
         hl7_messages = []
-        with open(path, "r", encoding="ISO-8859-1") as hl7_file:
-            # read the string from the file
-            hl7_messages_string = hl7_file.read()
 
-            # replace the wrong delimiters in the message string
-            hl7_messages_string = hl7_messages_string.replace('\n', '\r')
+        # go through the message strings from the file,
+        # create the right Hl7Message instance and add it to the result list
+        for hl7_message_string in cls._generate_hl7_message_strings_from_file(path):
+            hl7_message = cls._create_hl7_message_from_string(hl7_message_string)
+            if hl7_message:
+                hl7_messages.append(hl7_message)
 
-            hl7_message_strings = hl7.split_file(hl7_messages_string)
+        return hl7_messages
 
-            # go through the message strings from the file,
-            # create the right Hl7Message instance and add it to the result list
-            for hl7_message_string in hl7_message_strings:
-                hl7_message = cls._create_hl7_message_from_string(hl7_message_string)
-                if hl7_message:
-                    hl7_messages.append(hl7_message)
+    @classmethod
+    def _generate_hl7_message_strings_from_file(cls, path: str):
+        """Yields the HL7-message strings of a HL7-file on a given path without reading the whole file."""
 
-        return hl7_messages
+        # the universal newlines mode also splits the lines at the wrong '\n' delimiters
+        with open(path, "r", encoding=HL7_FILE_ENCODING) as hl7_file:
+            yield from cls._generate_hl7_message_strings_from_lines(hl7_file)
+
+    @staticmethod
+    def _generate_hl7_message_strings_from_lines(lines):
+        """
+        Yields the HL7-message strings of the given lines of a HL7-file.
+        The segments are split like in hl7.split_file, but line by line.
+        """
+
+        hl7_message_segments = []
+
+        for line in lines:
+            segment = line.strip()
+
+            if segment[:3] == "MSH":
+                if hl7_message_segments:
+                    yield "\r".join(hl7_message_segments) + "\r"
+                hl7_message_segments = [segment]
+            elif segment and segment[:3] not in HL7_BATCH_SEGMENTS and hl7_message_segments:
+                hl7_message_segments.append(segment)
+
+        if hl7_message_segments:
+            yield "\r".join(hl7_message_segments) + "\r"
+
+    @classmethod
+    def _load_hl7_message_from_string(cls, message: str, statistics: HL7ParsingStatistics = None) -> HL7Message:
+        """
+        Creates the Hl7Message instance of a given HL7-message string like _create_hl7_message_from_string,
+        but quarantines the message and returns None, if the message can not be decoded.
+        The quarantined message is counted by the given HL7ParsingStatistics.
+        """
+
+        try:
+            return cls._create_hl7_message_from_string(message)
+        except Exception as error:
+            quarantine_hl7_messages((message,), error)
+            if statistics:
+                statistics.count_quarantined_messages(1)
+            return None
 
     @classmethod
-    def _create_hl7_message_from_string(cls, message: str) -> HL7Message:
-        """Parses a given HL7-message string a Hl7Message instance return this instance."""
-        hl7_message = hl7.parse(message)
+    def _create_hl7_message_from_string(cls, message: str, fast_extractor: bool = None) -> HL7Message:
+        """
+        Parses a given HL7-message string a Hl7Message instance return this instance.
+        With the fast extractor only the segment strings are split instead of parsing the whole message.
+        """
+
+        if fast_extractor is None:
+            fast_extractor = settings.HL7_FAST_EXTRACTOR
+
+        hl7_message = parse_hl7_message_fast(message) if fast_extractor else hl7.parse(message)
         message_type = hl7_message.segment("MSH").extract_field(field_num=MSH_MESSAGE_TYPE_FIELD,
                                                                 component_num=MESSAGE_TYPE_TYPE_COMPONENT)
         trigger_event = hl7_message.segment("MSH").extract_field(field_num=MSH_MESSAGE_TYPE_FIELD,
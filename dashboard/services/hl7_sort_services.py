@@ -0,0 +1,90 @@
+import heapq
+import pickle
+import tempfile
+
+from django.conf import settings
+
+
+class HL7MessageSorter:
+    """
+    A class for sorting HL7-messages by their creation time within a bounded memory budget.
+    The messages are given as strings or as bytes of already parsed messages.
+    If the buffered messages exceed the budget, they are sorted and spilled as a run to a temporary file.
+    The sorted messages are generated by a k-way merge of all runs and the remaining buffer.
+    """
+
+    def __init__(self, memory_budget: int = None):
+        if memory_budget is None:
+            memory_budget = settings.HL7_SORT_MEMORY_BUDGET
+
+        self._memory_budget = memory_budget
+        self._buffer = []
+        self._buffer_size = 0
+        self._runs = []
+
+        # the sequence number keeps the insertion order for messages with the same creation time
+        self._sequence_number = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def number_of_runs(self):
+        """Returns the number of the spilled runs."""
+        return len(self._runs)
+
+    def add(self, message_creation: str, message):
+        """Adds a HL7-message string or bytes with its creation time to the sorter."""
+
+        self._buffer.append((message_creation, self._sequence_number, message))
+        self._buffer_size += len(message)
+        self._sequence_number += 1
+
+        if self._buffer_size > self._memory_budget:
+            self.__spill_buffer()
+
+    def sorted_messages(self):
+        """Yields all added HL7-messages sorted by their creation time."""
+
+        self._buffer.sort()
+        streams = [self.__read_run(run) for run in self._runs]
+        streams.append(iter(self._buffer))
+
+        for _, _, message in heapq.merge(*streams):
+            yield message
+
+    def close(self):
+        """Deletes all spilled runs and the buffer."""
+
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._buffer = []
+        self._buffer_size = 0
+
+    def __spill_buffer(self):
+        """Sorts the buffer and writes it as a new run to a temporary file."""
+
+        self._buffer.sort()
+
+        run = tempfile.TemporaryFile()
+        for entry in self._buffer:
+            pickle.dump(entry, run, protocol=pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+
+        self._runs.append(run)
+        self._buffer = []
+        self._buffer_size = 0
+
+    @staticmethod
+    def __read_run(run):
+        """Yields the entries of a spilled run in the same form as they are stored in the buffer."""
+
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                return
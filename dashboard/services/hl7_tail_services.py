@@ -0,0 +1,135 @@
+import io
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from dashboard.models import HL7FileCheckpoint
+from dashboard.services.hl7_services import HL7MessageParser, HL7_FILE_ENCODING, get_message_creation
+from dashboard.services.hl7_sort_services import HL7MessageSorter
+from dashboard.services.trace_services import HL7Trace
+
+logger = logging.getLogger(__name__)
+
+
+class HL7FileTailer:
+    """
+    A class for the parsing of HL7-files, that are still written, without deleting them.
+    The read position of every file is kept in a HL7FileCheckpoint, so that only the appended messages are read.
+    A message is complete as soon as the next message starts. The last message of a file is only complete,
+    if the writer has rotated to a newer file and the file is not written for HL7_TAIL_IDLE_TIME,
+    because a pause of the writer between two segments can not be told apart from the end of a message.
+    A replaced or truncated file is read from the start again.
+    """
+
+    @classmethod
+    def parse_hl7_messages_from_directory(cls, path: str, memory_budget: int = None, batch_size: int = None,
+                                          apply_workers: int = None):
+        """
+        Parses the complete messages appended to the HL7-files in a given directory since the last run
+        and save the results in the database. Returns the HL7ParsingStatistics of the run.
+        """
+
+        trace = HL7Trace("tail")
+        attributes = {"path": path}
+        try:
+            with trace.span("run", measure_memory=True):
+                file_paths = HL7MessageParser._get_hl7_file_paths(path)
+                # the last modification of the newest file, so that the files before it are completely written
+                newest_modification = max((os.stat(file_path).st_mtime for file_path in file_paths), default=0.0)
+                checkpoints = {checkpoint.path: checkpoint
+                               for checkpoint in HL7FileCheckpoint.objects.filter(path__in=file_paths)}
+                changed_checkpoints = []
+
+                with HL7MessageSorter(memory_budget) as sorter:
+                    with trace.span("read", measure_memory=True):
+                        for file_path in file_paths:
+                            checkpoint = cls.__read_appended_messages(file_path, checkpoints.get(file_path), sorter,
+                                                                     newest_modification)
+                            if checkpoint:
+                                changed_checkpoints.append(checkpoint)
+
+                    hl7_messages = cls.__load_hl7_messages(trace.iterate("sort", sorter.sorted_messages()), trace)
+                    statistics = HL7MessageParser.parse_hl7_messages(hl7_messages, batch_size, apply_workers,
+                                                                     trace=trace)
+
+                # the read positions are saved after the messages are committed,
+                # so that an aborted run reads the messages again and the already parsed ones are dropped as duplicates
+                with trace.span("save_checkpoints"), transaction.atomic():
+                    for checkpoint in changed_checkpoints:
+                        checkpoint.save()
+                    # the checkpoints of the rotated files are not needed anymore
+                    HL7FileCheckpoint.objects.filter(path__startswith=os.path.join(path, "")) \
+                        .exclude(path__in=file_paths).delete()
+
+            attributes.update(statistics.to_dict(), files=len(file_paths))
+        finally:
+            trace.close(**attributes)
+
+        logger.info("Parsed the appended HL7-messages from %s: %s", path, statistics)
+
+        return statistics
+
+    @staticmethod
+    def __load_hl7_messages(hl7_message_strings, trace: HL7Trace):
+        """Yields the usable Hl7Message instances of the given HL7-message strings."""
+
+        for hl7_message_string in hl7_message_strings:
+            with trace.span("decode"):
+                hl7_message = HL7MessageParser._load_hl7_message_from_string(hl7_message_string)
+            if hl7_message:
+                yield hl7_message
+
+    @classmethod
+    def __read_appended_messages(cls, file_path: str, checkpoint: HL7FileCheckpoint, sorter: HL7MessageSorter,
+                                 newest_modification: float):
+        """
+        Adds the complete messages appended to a HL7-file since its checkpoint to the sorter.
+        Returns the checkpoint with the new read position or None if there are no new complete messages.
+        """
+
+        status = os.stat(file_path)
+        file_id = f"{status.st_dev}:{status.st_ino}"
+
+        if checkpoint is None or checkpoint.file_id != file_id or checkpoint.offset > status.st_size:
+            checkpoint = HL7FileCheckpoint(path=file_path, file_id=file_id, offset=0)
+        elif checkpoint.offset == status.st_size:
+            return None
+
+        # only the appended bytes are read, the prefix of the file is never read again
+        with open(file_path, "rb") as hl7_file:
+            hl7_file.seek(checkpoint.offset)
+            data = hl7_file.read(status.st_size - checkpoint.offset)
+
+        # the writer has rotated to a newer file, so the last message is complete after the idle time
+        rotated = status.st_mtime < newest_modification and time.time() - status.st_mtime >= settings.HL7_TAIL_IDLE_TIME
+        end = cls.__find_end_of_complete_messages(data, rotated)
+        if end == 0:
+            return None
+
+        # the encoding has one byte per character, so the read position is also the number of characters
+        # the universal newlines mode also splits the lines at the wrong '\n' delimiters
+        text = io.StringIO(data[:end].decode(HL7_FILE_ENCODING), newline=None)
+        for hl7_message_string in HL7MessageParser._generate_hl7_message_strings_from_lines(text):
+            sorter.add(get_message_creation(hl7_message_string), hl7_message_string)
+
+        checkpoint.offset += end
+        return checkpoint
+
+    @staticmethod
+    def __find_end_of_complete_messages(data: bytes, rotated: bool) -> int:
+        """
+        Returns the position after the last complete message in the given appended bytes of a HL7-file.
+        The position is always the start of a message or the end of a rotated file,
+        so that a message is never split between two runs.
+        """
+
+        # the file is not written anymore, so its last message is complete
+        if rotated:
+            return len(data)
+
+        # otherwise the last message is only complete as soon as the next message starts
+        last_message_start = max(data.rfind(b"\rMSH"), data.rfind(b"\nMSH"))
+        return last_message_start + 1 if last_message_start >= 0 else 0
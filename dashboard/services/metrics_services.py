@@ -0,0 +1,227 @@
+import bisect
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+
+# upper bounds (in seconds) of the default histogram buckets like in the prometheus client libraries
+METRICS_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value) -> str:
+    """Returns a sample value in the text exposition format."""
+
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(labels) -> str:
+    """Returns the given pairs of label names and values in the text exposition format."""
+
+    if not labels:
+        return ""
+    escaped_labels = (f'{name}="' + str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') + '"'
+                      for name, value in labels)
+    return "{" + ",".join(escaped_labels) + "}"
+
+
+class Metric:
+    """A base class for the metrics of the in-process MetricsRegistry with their label values."""
+
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def _get_label_values(self, labels: dict):
+        """Returns the values of the given labels in the order of the label names."""
+
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"The metric {self.name} needs the labels {self.label_names}, not {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def collect(self):
+        """Returns the lines of the samples of the metric in the text exposition format."""
+        raise NotImplementedError
+
+    def render(self):
+        """Returns the metric with its help and type in the text exposition format."""
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        return "\n".join(lines + self.collect())
+
+
+class Counter(Metric):
+    """A metric, that counts events and is only increased."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        """Increases the counter with the given labels by the given amount."""
+
+        label_values = self._get_label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, **labels):
+        """Returns the value of the counter with the given labels."""
+        return self._values.get(self._get_label_values(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(zip(self.label_names, label_values))} {_format_value(value)}"
+                for label_values, value in values]
+
+
+class Gauge(Metric):
+    """A metric, whose value is calculated by a given function, every time the metrics are collected."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, function):
+        super().__init__(name, documentation)
+        self._function = function
+
+    def collect(self):
+        return [f"{self.name} {_format_value(self._function())}"]
+
+
+class Histogram(Metric):
+    """A metric, that counts observed values in cumulative buckets and sums them up."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names=(), buckets=METRICS_DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        """Adds an observed value with the given labels to its bucket."""
+
+        label_values = self._get_label_values(labels)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # the counts of the buckets followed by the sum of the observed values
+                counts = self._values[label_values] = [0] * len(self.buckets) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def time(self, **labels):
+        """Returns a context manager, that observes its duration (in seconds) with the given labels."""
+        return HistogramTimer(self, labels)
+
+    def get_count(self, **labels):
+        """Returns the number of observed values with the given labels."""
+
+        counts = self._values.get(self._get_label_values(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def collect(self):
+        with self._lock:
+            values = sorted((label_values, list(counts)) for label_values, counts in self._values.items())
+
+        lines = []
+        for label_values, counts in values:
+            labels = list(zip(self.label_names, label_values))
+            cumulative_count = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative_count += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(bound))])} "
+                             f"{cumulative_count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative_count}")
+        return lines
+
+
+class HistogramTimer:
+    """A context manager, that observes its duration in a Histogram."""
+
+    __slots__ = ("_histogram", "_labels", "_start")
+
+    def __init__(self, histogram: Histogram, labels: dict):
+        self._histogram = histogram
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class MetricsRegistry:
+    """A registry of the metrics of the process, that are served in the text exposition format of Prometheus."""
+
+    def __init__(self):
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        """Registers a given metric and returns it."""
+
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"The metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Returns all registered metrics in the text exposition format."""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def _get_hl7_backlog():
+    """Returns the number and the size (in bytes) of the HL7-files waiting in the HL7 directory."""
+
+    number_of_files = 0
+    size = 0
+    try:
+        with os.scandir(settings.HL7_DIRECTORY) as entries:
+            for entry in entries:
+                if entry.name.endswith(".hl7") and entry.is_file():
+                    number_of_files += 1
+                    size += entry.stat().st_size
+    except OSError:
+        pass
+    return number_of_files, size
+
+
+registry = MetricsRegistry()
+
+hl7_messages_ingested = registry.register(Counter(
+    "hl7_messages_ingested_total", "Number of committed HL7-messages by their trigger event.", ("trigger_event",)))
+hl7_messages_quarantined = registry.register(Counter(
+    "hl7_messages_quarantined_total", "Number of HL7-messages, that could not be parsed and were quarantined."))
+hl7_ingest_batch_duration = registry.register(Histogram(
+    "hl7_ingest_batch_duration_seconds", "Duration of the transactions, that commit a batch or a chunk of "
+                                         "HL7-messages.", ("mode",)))
+hl7_backlog_files = registry.register(Gauge(
+    "hl7_backlog_files", "Number of HL7-files waiting in the HL7 directory.", lambda: _get_hl7_backlog()[0]))
+hl7_backlog_bytes = registry.register(Gauge(
+    "hl7_backlog_bytes", "Size of the HL7-files waiting in the HL7 directory.", lambda: _get_hl7_backlog()[1]))
+rfc_sync_duration = registry.register(Histogram(
+    "rfc_sync_duration_seconds", "Duration of the synchronisation of the locations with the SAP system.",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)))
+rfc_sync_rows_changed = registry.register(Counter(
+    "rfc_sync_rows_changed_total", "Number of locations written by the synchronisation with the SAP system.",
+    ("location_type", "operation")))
+get_data_request_duration = registry.register(Histogram(
+    "get_data_request_duration_seconds", "Latency of the /get_data/ requests by the DataRepresentation.",
+    ("location_type", "theme_type", "time_type")))
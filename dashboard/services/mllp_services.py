@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from dashboard.services.hl7_services import HL7MessageParser, HL7_DATE_TIME_FORMAT
+
+logger = logging.getLogger(__name__)
+
+MLLP_START_BLOCK = b"\x0b"
+MLLP_END_BLOCK = b"\x1c\x0d"
+MLLP_ENCODING = "ISO-8859-1"
+MLLP_MAX_MESSAGE_SIZE = 1024 * 1024
+
+# number of the last end-to-end latencies kept for the statistics
+MLLP_LATENCY_HISTORY = 10000
+
+ACK_ACCEPT = "AA"
+ACK_ERROR = "AE"
+ACK_REJECT = "AR"
+
+
+def create_acknowledgement(message: str, acknowledgement_code: str = ACK_ACCEPT) -> str:
+    """Returns the HL7 ACK-message string for a given HL7-message string."""
+
+    msh_segment = message.split("\r", 1)[0]
+    field_separator = msh_segment[3:4] or "|"
+    msh_fields = msh_segment.split(field_separator)
+    # fill up missing fields, so that all fields of the header can be used
+    msh_fields += [""] * (12 - len(msh_fields))
+
+    component_separator = msh_fields[1][:1] or "^"
+    trigger_event = msh_fields[8].split(component_separator)[1:2]
+    message_type = component_separator.join(["ACK"] + trigger_event)
+
+    # swap the sending and receiving application and facility
+    ack_msh_fields = ["MSH", msh_fields[1] or "^~\\&", msh_fields[4], msh_fields[5], msh_fields[2], msh_fields[3],
+                      timezone.now().strftime(HL7_DATE_TIME_FORMAT), "", message_type, msh_fields[9],
+                      msh_fields[10] or "P", msh_fields[11]]
+    msa_fields = ["MSA", acknowledgement_code, msh_fields[9]]
+
+    return field_separator.join(ack_msh_fields) + "\r" + field_separator.join(msa_fields) + "\r"
+
+
+def parse_hl7_message_string(message: str):
+    """
+    Parses a received HL7-message string in the thread of the MLLPServer.
+    Raises a ValueError, if the message is quarantined instead of committed.
+    """
+
+    # the thread lives as long as the server, so outdated database connections have to be closed
+    close_old_connections()
+    statistics = HL7MessageParser.parse_hl7_message_string(message)
+    # a message, that can not be decoded, is quarantined without parsing it
+    if statistics and statistics.number_of_quarantined_messages:
+        raise ValueError("The HL7-message could not be parsed and was quarantined")
+
+
+class MLLPServer:
+    """
+    An asyncio server for receiving HL7-messages with the minimal lower layer protocol (MLLP).
+    The received messages are put into a bounded queue and parsed one after another in a separate thread.
+    Every message is only acknowledged (AA) after it is committed, so that the sender resends the messages,
+    that are lost by a crash or restart. A message, that fails, is answered with an application error (AE).
+    A frame bigger than MLLP_MAX_MESSAGE_SIZE or without message header is rejected (AR) and the connection is kept.
+    If the queue is full, the connections are not read anymore, until there is a free place.
+    """
+
+    def __init__(self, host: str = None, port: int = None, queue_size: int = None, handler=None):
+        self._host = host if host is not None else settings.MLLP_HOST
+        self._port = port if port is not None else settings.MLLP_PORT
+        self._queue_size = queue_size if queue_size is not None else settings.MLLP_QUEUE_SIZE
+        self._handler = handler if handler is not None else parse_hl7_message_string
+
+        self.number_of_messages = 0
+        self.latencies = deque(maxlen=MLLP_LATENCY_HISTORY)
+
+        self._server = None
+        self._queue = None
+        self._consumer = None
+        # the database is only used by one thread, so the messages are parsed in the right order
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def port(self):
+        """Returns the port the server is listening on."""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        """Starts listening for connections and parsing the received messages."""
+
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        self._consumer = asyncio.create_task(self.__consume())
+        self._server = await asyncio.start_server(self.__handle_connection, self._host, self._port,
+                                                  limit=MLLP_MAX_MESSAGE_SIZE)
+        logger.info("MLLP server listening on %s:%s", self._host, self.port)
+
+    async def serve_forever(self):
+        """Starts the server and serves until it is cancelled."""
+
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Stops accepting connections and waits until all received messages are parsed."""
+
+        self._server.close()
+        await self._server.wait_closed()
+
+        await self._queue.join()
+        self._consumer.cancel()
+        self._executor.shutdown()
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Reads the framed messages of a connection, puts them into the queue and acknowledges them after parsing."""
+
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    message = await self.__read_message(reader)
+                except asyncio.IncompleteReadError:
+                    # the connection is closed by the client
+                    break
+                received = time.perf_counter()
+
+                if message is not None and message[:3] == "MSH":
+                    # wait for a free place in the queue, so that the senders are slowed down
+                    parsed = loop.create_future()
+                    await self._queue.put((received, message, parsed))
+                    # the acknowledgement code is set after the message is committed or failed
+                    acknowledgement = create_acknowledgement(message, await parsed)
+                else:
+                    acknowledgement = create_acknowledgement("MSH|^~\\&", ACK_REJECT)
+
+                writer.write(MLLP_START_BLOCK + acknowledgement.encode(MLLP_ENCODING) + MLLP_END_BLOCK)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def __read_message(reader: asyncio.StreamReader):
+        """
+        Reads the next frame of a connection and returns its message string without the framing
+        or None if the frame is too big or can not be decoded.
+        Raises an asyncio.IncompleteReadError, if the connection is closed.
+        """
+
+        try:
+            frame = await reader.readuntil(MLLP_END_BLOCK)
+        except asyncio.LimitOverrunError as error:
+            # the rest of the oversized frame is skipped, so that the next frames of the connection can be read
+            consumed = error.consumed
+            while True:
+                await reader.readexactly(consumed)
+                try:
+                    await reader.readuntil(MLLP_END_BLOCK)
+                    break
+                except asyncio.LimitOverrunError as next_error:
+                    consumed = next_error.consumed
+            logger.warning("Rejected an HL7-message bigger than %s bytes", MLLP_MAX_MESSAGE_SIZE)
+            return None
+
+        try:
+            message = frame[:-len(MLLP_END_BLOCK)].lstrip(MLLP_START_BLOCK).decode(MLLP_ENCODING)
+        except UnicodeDecodeError:
+            logger.warning("Rejected an HL7-message, that could not be decoded with %s", MLLP_ENCODING)
+            return None
+
+        # replace the wrong delimiters in the message string
+        return message.strip().replace("\n", "\r")
+
+    async def __consume(self):
+        """
+        Parses the messages from the queue one after another, sets their acknowledgement codes
+        and records their end-to-end latency.
+        """
+
+        loop = asyncio.get_running_loop()
+        while True:
+            received, message, parsed = await self._queue.get()
+            acknowledgement_code = ACK_ERROR
+            try:
+                await loop.run_in_executor(self._executor, self._handler, message)
+            except Exception:
+                logger.exception("The HL7-message could not be parsed:\n%s", message)
+            else:
+                acknowledgement_code = ACK_ACCEPT
+                latency = time.perf_counter() - received
+                self.number_of_messages += 1
+                self.latencies.append(latency)
+                logger.info("Parsed an HL7-message %.1f ms after receiving it", latency * 1000)
+            finally:
+                # the connection of the message could already be closed
+                if not parsed.done():
+                    parsed.set_result(acknowledgement_code)
+                self._queue.task_done()
@@ -0,0 +1,281 @@
+import bisect
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from dashboard.models import ProcessedHL7Message
+from dashboard.services.backfill_services import HL7ArchiveReader
+from dashboard.services.hl7_dedup_services import get_control_id_hash
+from dashboard.services.hl7_services import HL7_DATE_TIME_FORMAT, HL7_FILE_ENCODING, MSH_MESSAGE_CONTROL_ID_FIELD, \
+    get_message_creation, get_msh_field
+from dashboard.services.mllp_services import MLLP_START_BLOCK, MLLP_END_BLOCK, MLLP_ENCODING
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in seconds) of the buckets of the freshness lag histogram
+REPLAY_LAG_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# max number of control ids looked up with one query
+REPLAY_POLL_CHUNK_SIZE = 500
+REPLAY_HISTOGRAM_WIDTH = 50
+
+
+class HL7LagHistogram:
+    """A histogram of freshness lags (in seconds) with fixed buckets and the percentiles of all lags."""
+
+    def __init__(self, buckets=REPLAY_LAG_BUCKETS):
+        self._buckets = tuple(buckets)
+        # the last count is the overflow bucket above the biggest bound
+        self._counts = [0] * (len(self._buckets) + 1)
+        # the lags are only sorted when the percentiles are requested
+        self._lags = []
+        self._sorted = True
+
+    def add(self, lag: float):
+        """Adds a lag to its bucket."""
+
+        self._counts[bisect.bisect_left(self._buckets, lag)] += 1
+        self._lags.append(lag)
+        self._sorted = False
+
+    @property
+    def count(self):
+        return len(self._lags)
+
+    def percentile(self, percent: float):
+        """Returns the given percentile of all lags with the nearest-rank method or None if there are no lags."""
+
+        if not self._lags:
+            return None
+        self.__sort()
+        return self._lags[min(len(self._lags) - 1, max(0, int(len(self._lags) * percent / 100 + 0.5) - 1))]
+
+    def __sort(self):
+        """Sorts the lags once after they were added, so that adding a lag stays constant time."""
+
+        if not self._sorted:
+            self._lags.sort()
+            self._sorted = True
+
+    def get_bucket_labels(self):
+        """Returns the labels of the buckets in their order."""
+        return [f"<= {bound:g} s" for bound in self._buckets] + [f"> {self._buckets[-1]:g} s"]
+
+    def to_dict(self):
+        """Returns the buckets and percentiles of the histogram as dictionary."""
+
+        return {
+            "count": self.count,
+            "buckets": dict(zip(self.get_bucket_labels(), self._counts)),
+            "median": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.percentile(100),
+        }
+
+    def __str__(self):
+        lines = []
+        biggest_count = max(self._counts) or 1
+        for label, count in zip(self.get_bucket_labels(), self._counts):
+            bar = "#" * round(count / biggest_count * REPLAY_HISTOGRAM_WIDTH)
+            lines.append(f"{label:>10} | {count:>8} {bar}")
+
+        if self._lags:
+            lines.append(f"median {self.percentile(50):.3f} s, p95 {self.percentile(95):.3f} s, "
+                         f"p99 {self.percentile(99):.3f} s, max {self.percentile(100):.3f} s")
+        return "\n".join(lines)
+
+
+class HL7Replayer:
+    """
+    A class for replaying recorded HL7-files with the traffic shape of the recording at real time x speedup.
+    Every message is emitted at the time of its message creation (MSH-7) relative to the first message,
+    either as HL7-file into the target directory or to the MLLP listener.
+
+    The freshness lag of a message is the time between its replayed message creation and the commit of its
+    changes. The control id (MSH-10) of a message is stored in the same transaction as its Stay changes,
+    so the changes are visible to the LocationDataResponseView as soon as the control id is found.
+    The replayed messages have to be parsed by the running ingestion with HL7_DEDUPLICATION.
+    """
+
+    def __init__(self, paths, speedup: float = 1.0, target_directory: str = None, mllp_address: tuple = None,
+                 poll_interval: float = None, timeout: float = None, report=None):
+        self._reader = HL7ArchiveReader(paths)
+        self._speedup = speedup
+        self._target_directory = target_directory if target_directory is not None else settings.HL7_DIRECTORY
+        self._mllp_address = mllp_address
+        self._poll_interval = poll_interval if poll_interval is not None else settings.HL7_REPLAY_POLL_INTERVAL
+        self._timeout = timeout if timeout is not None else settings.HL7_REPLAY_TIMEOUT
+        self._report = report if report is not None else logger.info
+
+        self.histogram = HL7LagHistogram()
+        self._lock = threading.Lock()
+        # the control ids of the emitted messages, that are not visible yet, with their replayed message creation
+        self._pending = {}
+        self._emitted_all = threading.Event()
+        self._emitter_error = None
+        self._max_emit_delay = 0.0
+
+    def run(self):
+        """Replays the recording, waits for the visibility of the messages and returns the results as dictionary."""
+
+        messages = self.__read_recording()
+        probed_messages = [(offset, control_id, message) for offset, control_id, message in messages if control_id]
+        already_processed = self.__find_processed_control_ids([control_id for _, control_id, _ in probed_messages])
+        if already_processed:
+            self._report(f"{len(already_processed)} messages were already parsed and are not measured")
+
+        recorded_duration = messages[-1][0] if messages else 0.0
+        self._report(f"Replaying {len(messages)} messages recorded in {recorded_duration:.0f} s "
+                     f"at {self._speedup:g}x speed-up")
+
+        start = time.monotonic()
+        emitter = threading.Thread(target=self.__emit_messages, args=(messages, already_processed, start),
+                                   name="HL7Replayer", daemon=True)
+        emitter.start()
+        try:
+            self.__poll_visibility()
+        finally:
+            emitter.join()
+
+        if self._emitter_error:
+            raise self._emitter_error
+
+        return {
+            "messages": len(messages),
+            "visible": self.histogram.count,
+            "not_visible": len(self._pending),
+            "unprobed": len(messages) - len(probed_messages),
+            "already_processed": len(already_processed),
+            "speedup": self._speedup,
+            "recorded_duration": recorded_duration,
+            "replay_duration": time.monotonic() - start,
+            "max_emit_delay": self._max_emit_delay,
+            "lag": self.histogram.to_dict(),
+        }
+
+    def __read_recording(self):
+        """Returns the offset (in seconds) to the first message, the control id and the string of every message."""
+
+        messages = []
+        for file_path in self._reader.get_file_paths():
+            for hl7_message_string in self._reader.generate_hl7_message_strings(file_path):
+                messages.append((get_message_creation(hl7_message_string),
+                                 get_msh_field(hl7_message_string, MSH_MESSAGE_CONTROL_ID_FIELD), hl7_message_string))
+        messages.sort(key=lambda message: message[0])
+
+        # messages without usable message creation are emitted together with the previous message
+        first_creation = None
+        offset = 0.0
+        replayed_messages = []
+        for message_creation, control_id, hl7_message_string in messages:
+            try:
+                creation = timezone.datetime.strptime(message_creation[:14], HL7_DATE_TIME_FORMAT)
+            except ValueError:
+                creation = None
+            if creation is not None:
+                first_creation = first_creation or creation
+                offset = (creation - first_creation).total_seconds()
+            replayed_messages.append((offset, control_id, hl7_message_string))
+
+        return replayed_messages
+
+    @staticmethod
+    def __find_processed_control_ids(control_ids):
+        """Returns the set of the given control ids, that are stored as parsed already."""
+
+        # the control ids are stored as their hashes
+        hashed_control_ids = {get_control_id_hash(control_id): control_id for control_id in control_ids}
+        control_id_hashes = list(hashed_control_ids)
+
+        processed_control_ids = set()
+        for index in range(0, len(control_id_hashes), REPLAY_POLL_CHUNK_SIZE):
+            processed_control_id_hashes = ProcessedHL7Message.objects.filter(
+                control_id_hash__in=control_id_hashes[index:index + REPLAY_POLL_CHUNK_SIZE]
+            ).values_list("control_id_hash", flat=True)
+            processed_control_ids.update(hashed_control_ids[control_id_hash]
+                                         for control_id_hash in processed_control_id_hashes)
+        return processed_control_ids
+
+    def __emit_messages(self, messages, already_processed: set, start: float):
+        """Emits every message at its replayed message creation in the thread of the replayer."""
+
+        connection = None
+        try:
+            if self._mllp_address:
+                connection = socket.create_connection(self._mllp_address)
+
+            for number, (offset, control_id, hl7_message_string) in enumerate(messages):
+                replayed_creation = start + offset / self._speedup
+                delay = replayed_creation - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self._max_emit_delay = max(self._max_emit_delay, -delay)
+
+                # the message is pending before it is emitted, so that its visibility is never missed
+                if control_id and control_id not in already_processed:
+                    with self._lock:
+                        self._pending[control_id] = replayed_creation
+
+                if connection:
+                    self.__send_mllp_message(connection, hl7_message_string)
+                else:
+                    self.__write_hl7_file(number, hl7_message_string)
+        except Exception as error:
+            self._emitter_error = error
+        finally:
+            if connection:
+                connection.close()
+            self._emitted_all.set()
+
+    def __write_hl7_file(self, number: int, hl7_message_string: str):
+        """Writes a message into a HL7-file in the target directory, that is renamed after it is completely written."""
+
+        file_path = os.path.join(self._target_directory, f"replay_{os.getpid()}_{number:08}.hl7")
+        with open(file_path + ".tmp", "w", encoding=HL7_FILE_ENCODING, newline="") as hl7_file:
+            hl7_file.write(hl7_message_string + "\r")
+        os.replace(file_path + ".tmp", file_path)
+
+    @staticmethod
+    def __send_mllp_message(connection: socket.socket, hl7_message_string: str):
+        """Sends a message to the MLLP listener and waits for its acknowledgement."""
+
+        connection.sendall(MLLP_START_BLOCK + hl7_message_string.encode(MLLP_ENCODING) + MLLP_END_BLOCK)
+
+        acknowledgement = b""
+        while not acknowledgement.endswith(MLLP_END_BLOCK):
+            data = connection.recv(4096)
+            if not data:
+                raise ConnectionError("The MLLP listener closed the connection")
+            acknowledgement += data
+
+    def __poll_visibility(self):
+        """Adds the freshness lag of every visible message to the histogram until all messages are visible."""
+
+        deadline = None
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            visible_control_ids = self.__find_processed_control_ids(pending)
+            now = time.monotonic()
+
+            with self._lock:
+                for control_id in visible_control_ids:
+                    self.histogram.add(max(now - self._pending.pop(control_id), 0.0))
+                number_of_pending = len(self._pending)
+
+            if self._emitted_all.is_set():
+                if not number_of_pending or self._emitter_error:
+                    return
+                # the messages, that are not visible after the timeout, were not parsed
+                deadline = deadline or now + self._timeout
+                if now >= deadline:
+                    self._report(f"{number_of_pending} messages are not visible after {self._timeout:g} s")
+                    return
+
+            time.sleep(self._poll_interval)
@@ -7,6 +7,8 @@ from django.db.utils import IntegrityError
 
 from dashboard.models import Ward, Room
 from dashboard.models.hospital_models import Bed
+from dashboard.services.cache_services import location_cache, open_stay_cache, increase_cache_generation
+from dashboard.services.metrics_services import rfc_sync_duration, rfc_sync_rows_changed
 
 SAP_RFC_DATE_FORMAT = "%Y%m%d"
 
@@ -19,14 +21,23 @@ class RFCLocationParser:
         """Creates a connection to the sap system, calls the data with rfc and parses the returning locations."""
         time = timezone.now()
 
-        conn = Connection(ashost=settings.ASHOST, sysnr=settings.SYSNR, client=settings.CLIENT, user=settings.USER,
-                          passwd=settings.PASSWD)
+        with rfc_sync_duration.time():
+            conn = Connection(ashost=settings.ASHOST, sysnr=settings.SYSNR, client=settings.CLIENT,
+                              user=settings.USER, passwd=settings.PASSWD)
 
-        locations = conn.call('Z_RFC_READ_ORGIDS', I_EINRI="0001", I_DATE=time.strftime(SAP_RFC_DATE_FORMAT))
+            locations = conn.call('Z_RFC_READ_ORGIDS', I_EINRI="0001", I_DATE=time.strftime(SAP_RFC_DATE_FORMAT))
 
-        cls.parse_wards(locations["ET_STATIONEN"])
-        cls.parse_rooms(locations["ET_ZIMMER"])
-        cls.parse_beds(locations["ET_BETTEN"])
+            try:
+                cls.parse_wards(locations["ET_STATIONEN"])
+                cls.parse_rooms(locations["ET_ZIMMER"])
+                cls.parse_beds(locations["ET_BETTEN"])
+            finally:
+                # the cached locations of the hl7 parsing could be changed or deleted now
+                # and the stays of deleted locations are deleted with them
+                location_cache.clear()
+                open_stay_cache.clear()
+                # the other processes parsing hl7 messages clear their caches at the start of their next transaction
+                increase_cache_generation()
 
     @classmethod
     def parse_wards(cls, ward_dicts):
@@ -45,7 +56,7 @@ class RFCLocationParser:
             if not ward_name:
                 ward_name = ward_id
             try:
-                Ward.objects.update_or_create(
+                _, created = Ward.objects.update_or_create(
                     id=ward_id,
                     defaults={
                         "name": ward_name,
@@ -54,9 +65,12 @@ class RFCLocationParser:
                     })
             except IntegrityError:
                 pass
+            else:
+                rfc_sync_rows_changed.inc(location_type="ward", operation="created" if created else "updated")
 
         # delete all wards that are not contained in the given ward_dicts
-        Ward.objects.exclude(id__in=ward_ids).delete()
+        _, deleted = Ward.objects.exclude(id__in=ward_ids).delete()
+        rfc_sync_rows_changed.inc(deleted.get(Ward._meta.label, 0), location_type="ward", operation="deleted")
 
     @classmethod
     def parse_rooms(cls, room_dicts):
@@ -75,7 +89,7 @@ class RFCLocationParser:
             if not room_name:
                 room_name = room_id
             try:
-                Room.objects.update_or_create(
+                _, created = Room.objects.update_or_create(
                     id=room_id,
                     defaults={
                         "name": room_name,
@@ -85,9 +99,12 @@ class RFCLocationParser:
                     })
             except IntegrityError:
                 pass
+            else:
+                rfc_sync_rows_changed.inc(location_type="room", operation="created" if created else "updated")
 
         # delete all rooms that are not contained in the given room_dicts
-        Room.objects.exclude(id__in=room_ids).delete()
+        _, deleted = Room.objects.exclude(id__in=room_ids).delete()
+        rfc_sync_rows_changed.inc(deleted.get(Room._meta.label, 0), location_type="room", operation="deleted")
 
     @classmethod
     def parse_beds(cls, bed_dicts):
@@ -107,7 +124,7 @@ class RFCLocationParser:
                 bed_name = bed_id
 
             try:
-                Bed.objects.update_or_create(
+                _, created = Bed.objects.update_or_create(
                     id=bed_id,
                     defaults={
                         "name": bed_name,
@@ -117,6 +134,9 @@ class RFCLocationParser:
                     })
             except IntegrityError:
                 pass
+            else:
+                rfc_sync_rows_changed.inc(location_type="bed", operation="created" if created else "updated")
 
         # delete all beds that are not contained in the given bed_dicts
-        Bed.objects.exclude(id__in=bed_ids).delete()
+        _, deleted = Bed.objects.exclude(id__in=bed_ids).delete()
+        rfc_sync_rows_changed.inc(deleted.get(Bed._meta.label, 0), location_type="bed", operation="deleted")
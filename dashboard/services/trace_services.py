@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE_DATE_FORMAT = "%Y%m%d%H%M%S"
+
+try:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    # the page size is only available on Unix
+    PAGE_SIZE = None
+
+
+def get_resident_memory():
+    """Returns the resident memory (in bytes) of the process or None if it is not available."""
+
+    if PAGE_SIZE is None:
+        return None
+    try:
+        with open("/proc/self/statm", "rb") as statm_file:
+            return int(statm_file.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class HL7TraceSpan:
+    """The aggregated measurements of all spans with the same name and message type."""
+
+    __slots__ = ("name", "message_type", "count", "wall", "self_wall", "cpu", "self_cpu", "queries",
+                 "self_queries", "memory_delta", "threads")
+
+    def __init__(self, name: str, message_type: str):
+        self.name = name
+        self.message_type = message_type
+        self.count = 0
+        self.wall = 0.0
+        self.self_wall = 0.0
+        self.cpu = 0.0
+        self.self_cpu = 0.0
+        self.queries = 0
+        self.self_queries = 0
+        self.memory_delta = None
+        self.threads = set()
+
+    def to_dict(self):
+        """Returns the measurements as dictionary for the trace file."""
+
+        return {
+            "span": self.name,
+            "type": self.message_type,
+            "count": self.count,
+            "wall": self.wall,
+            "self_wall": self.self_wall,
+            "cpu": self.cpu,
+            "self_cpu": self.self_cpu,
+            "queries": self.queries,
+            "self_queries": self.self_queries,
+            "memory_delta": self.memory_delta,
+            "threads": sorted(self.threads),
+        }
+
+
+class HL7SpanContext:
+    """A context manager for measuring one span of a HL7Trace in the current thread."""
+
+    __slots__ = ("_trace", "_name", "_message_type", "_measure_memory")
+
+    def __init__(self, trace, name: str, message_type: str, measure_memory: bool):
+        self._trace = trace
+        self._name = name
+        self._message_type = message_type
+        self._measure_memory = measure_memory
+
+    def __enter__(self):
+        self._trace._open_span(self._measure_memory)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._trace._close_span(self._name, self._message_type)
+
+
+class HL7Trace:
+    """
+    A class for the tracing spans of a parsing run, that measure the wall time, the CPU time of the thread,
+    the database queries of the thread and the change of the resident memory of every stage.
+    The spans with the same name and message type are aggregated, so that a span per message is cheap enough.
+    The measurements of the nested spans are subtracted in the self values, so that the stages of the lazily
+    pulled pipeline are measured on their own. At the end of the run the aggregated spans are written into
+    a JSON-lines file in HL7_TRACE_DIRECTORY.
+    """
+
+    def __init__(self, name: str, enabled: bool = None, directory: str = None):
+        self.name = name
+        self.enabled = enabled if enabled is not None else settings.HL7_TRACING
+        self._directory = directory if directory is not None else settings.HL7_TRACE_DIRECTORY
+        self._run_id = uuid.uuid4().hex
+        self._started_at = timezone.now()
+        self._start = time.perf_counter()
+
+        self._spans = dict()
+        self._lock = threading.Lock()
+        # the open spans and the number of queries of every thread
+        self._local = threading.local()
+        self._counted_connections = []
+
+    def span(self, name: str, message_type: str = None, measure_memory: bool = False):
+        """
+        Returns a context manager measuring a span with the given name in the current thread.
+        The resident memory is only measured if measure_memory is True, because it is read from the proc filesystem.
+        """
+        return HL7SpanContext(self, name, message_type, measure_memory and self.enabled)
+
+    def iterate(self, name: str, iterable):
+        """Returns an iterator over the given iterable, that measures every pulled item as a span."""
+
+        if not self.enabled:
+            return iterable
+        return self.__iterate(name, iterable)
+
+    def close(self, **attributes):
+        """Writes the aggregated spans with the given attributes of the run into the trace file of the run."""
+
+        for database_connection in self._counted_connections:
+            if self.__count_query in database_connection.execute_wrappers:
+                database_connection.execute_wrappers.remove(self.__count_query)
+        self._counted_connections = []
+
+        if not self.enabled:
+            return None
+
+        run = {"run": self._run_id, "name": self.name, "started_at": self._started_at.isoformat(),
+               "duration": time.perf_counter() - self._start, **attributes}
+        filename = f"{self._started_at.strftime(TRACE_FILE_DATE_FORMAT)}_{self.name}_{self._run_id}.jsonl"
+        file_path = os.path.join(self._directory, filename)
+
+        # the tracing must never abort the parsing
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            with open(file_path, "w") as trace_file:
+                trace_file.write(json.dumps(run) + "\n")
+                with self._lock:
+                    spans = sorted(self._spans.values(), key=lambda span: span.self_wall, reverse=True)
+                for span in spans:
+                    trace_file.write(json.dumps({"run": self._run_id, **span.to_dict()}) + "\n")
+            self.__remove_old_trace_files()
+        except OSError:
+            logger.exception("The trace of the run %s could not be written", self._run_id)
+            return None
+
+        return file_path
+
+    def get_spans(self):
+        """Returns the aggregated spans by their name and message type."""
+
+        with self._lock:
+            return dict(self._spans)
+
+    def _open_span(self, measure_memory: bool):
+        """Starts the measurement of a span in the current thread."""
+
+        if not self.enabled:
+            return
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self.__start_thread()
+
+        # the start values and the inclusive values of the nested spans
+        stack.append([time.perf_counter(), time.thread_time(), self._local.queries,
+                      get_resident_memory() if measure_memory else None, 0.0, 0.0, 0])
+
+    def _close_span(self, name: str, message_type: str):
+        """Stops the measurement of the innermost span in the current thread and adds it to the aggregated spans."""
+
+        if not self.enabled:
+            return
+
+        stack = self._local.stack
+        start_wall, start_cpu, start_queries, start_memory, child_wall, child_cpu, child_queries = stack.pop()
+        wall = time.perf_counter() - start_wall
+        cpu = time.thread_time() - start_cpu
+        queries = self._local.queries - start_queries
+        memory = get_resident_memory() if start_memory is not None else None
+        memory_delta = memory - start_memory if memory is not None else None
+
+        if stack:
+            parent = stack[-1]
+            parent[4] += wall
+            parent[5] += cpu
+            parent[6] += queries
+
+        key = (name, message_type)
+        with self._lock:
+            span = self._spans.get(key)
+            if span is None:
+                span = self._spans[key] = HL7TraceSpan(name, message_type)
+            span.count += 1
+            span.wall += wall
+            span.self_wall += wall - child_wall
+            span.cpu += cpu
+            span.self_cpu += cpu - child_cpu
+            span.queries += queries
+            span.self_queries += queries - child_queries
+            if memory_delta is not None:
+                span.memory_delta = (span.memory_delta or 0) + memory_delta
+            span.threads.add(threading.current_thread().name)
+
+    def __start_thread(self):
+        """Creates the span stack of the current thread and counts the queries of its database connection."""
+
+        self._local.stack = []
+        self._local.queries = 0
+
+        # every thread has its own database connection
+        database_connection = connections[DEFAULT_DB_ALIAS]
+        database_connection.execute_wrappers.append(self.__count_query)
+        with self._lock:
+            self._counted_connections.append(database_connection)
+
+        return self._local.stack
+
+    def __count_query(self, execute, sql, params, many, context):
+        """Counts the executed queries of the database connection of the current thread."""
+
+        self._local.queries += 1
+        return execute(sql, params, many, context)
+
+    def __iterate(self, name: str, iterable):
+        """Yields the items of an iterable and measures every pulled item as a span."""
+
+        iterator = iter(iterable)
+        while True:
+            self._open_span(False)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._close_span(name, None)
+            yield item
+
+    def __remove_old_trace_files(self):
+        """Removes the oldest trace files, so that there are at most HL7_TRACE_MAX_FILES files."""
+
+        trace_files = sorted(filename for filename in os.listdir(self._directory) if filename.endswith(".jsonl"))
+        for filename in trace_files[:max(len(trace_files) - settings.HL7_TRACE_MAX_FILES, 0)]:
+            os.remove(os.path.join(self._directory, filename))
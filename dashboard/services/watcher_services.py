@@ -0,0 +1,193 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+
+# max time to wait for events, before it is checked if the watcher is stopped
+WATCHER_STOP_CHECK_INTERVAL = 0.5
+
+
+class HL7DirectoryWatcher:
+    """
+    A class for watching a HL7 directory and calling a callback with the directory path,
+    as soon as new HL7-files are completely written into it.
+    On Linux inotify is used and bursts of files are debounced into one call,
+    otherwise the directory is polled for HL7-files in a fixed interval.
+    With inotify the callback is also called after the poll interval, if the last call failed
+    or left HL7-files in the directory, so that they are not kept until the next file is written.
+    With watch_modifications every write into a HL7-file is watched instead of only the completed files.
+    """
+
+    def __init__(self, path: str, callback, debounce: float = None, max_delay: float = None,
+                 poll_interval: float = None, use_inotify: bool = True, watch_modifications: bool = False):
+        self._path = path
+        self._callback = callback
+        self._debounce = debounce if debounce is not None else settings.HL7_WATCH_DEBOUNCE
+        self._max_delay = max_delay if max_delay is not None else settings.HL7_WATCH_MAX_DELAY
+        self._poll_interval = poll_interval if poll_interval is not None else settings.HL7_WATCH_POLL_INTERVAL
+        self._use_inotify = use_inotify
+        self._watch_modifications = watch_modifications
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts watching the directory in a daemon thread."""
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name="HL7DirectoryWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops watching the directory and waits for the running callback."""
+
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def run(self):
+        """Watches the directory until the watcher is stopped."""
+
+        # the watch is created first, so that no file written during the initial call is missed
+        inotify_fd = self.__create_inotify_watch() if self._use_inotify else None
+
+        # parse the files, that were written while the watcher was not running
+        succeeded = self.__call_callback()
+
+        if inotify_fd is None:
+            logger.info("Polling %s every %s s for HL7-files", self._path, self._poll_interval)
+            self.__poll()
+        else:
+            logger.info("Watching %s with inotify for HL7-files", self._path)
+            try:
+                self.__watch(inotify_fd, succeeded)
+            finally:
+                os.close(inotify_fd)
+
+    def __call_callback(self):
+        """
+        Calls the callback and logs its exceptions, so that the watcher keeps running.
+        Returns False if the callback failed.
+        """
+
+        try:
+            # the thread lives as long as the application, so outdated database connections have to be closed
+            close_old_connections()
+            self._callback(self._path)
+        except Exception:
+            logger.exception("The HL7-files in %s could not be parsed", self._path)
+            return False
+        return True
+
+    def __has_hl7_files(self):
+        """Returns True if there are HL7-files in the directory."""
+        return any(filename.endswith(".hl7") for filename in os.listdir(self._path))
+
+    def __poll(self):
+        """Calls the callback in a fixed interval, if there are HL7-files in the directory."""
+
+        while not self._stop_event.wait(self._poll_interval):
+            if self.__has_hl7_files():
+                self.__call_callback()
+
+    def __get_retry_time(self, succeeded: bool):
+        """
+        Returns the time of the next call without a written HL7-file
+        or None if the last call succeeded and there are no HL7-files left.
+        """
+
+        try:
+            if succeeded and not self.__has_hl7_files():
+                return None
+        except OSError:
+            logger.exception("The HL7-files in %s could not be listed", self._path)
+        return time.monotonic() + self._poll_interval
+
+    def __watch(self, inotify_fd: int, succeeded: bool):
+        """
+        Calls the callback for every debounced burst of written HL7-files
+        and after the poll interval, while the last call failed or left HL7-files.
+        """
+
+        retry_time = self.__get_retry_time(succeeded)
+        while not self._stop_event.is_set():
+            timeout = WATCHER_STOP_CHECK_INTERVAL
+            if retry_time is not None:
+                timeout = min(timeout, max(retry_time - time.monotonic(), 0))
+
+            if not self.__wait_for_hl7_file(inotify_fd, timeout):
+                if retry_time is not None and time.monotonic() >= retry_time:
+                    retry_time = self.__get_retry_time(self.__call_callback())
+                continue
+
+            # collect the following files, until there is a quiet period or the max delay is reached
+            burst_start = time.monotonic()
+            while time.monotonic() - burst_start < self._max_delay:
+                timeout = min(self._debounce, self._max_delay - (time.monotonic() - burst_start))
+                if not self.__wait_for_hl7_file(inotify_fd, max(timeout, 0)):
+                    break
+
+            retry_time = self.__get_retry_time(self.__call_callback())
+
+    @staticmethod
+    def __wait_for_hl7_file(inotify_fd: int, timeout: float):
+        """Waits for the given timeout and returns True, if an HL7-file is written in this time."""
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            readable = select.select([inotify_fd], [], [], max(remaining, 0))[0]
+            if not readable:
+                return False
+
+            data = os.read(inotify_fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                _, _, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+                offset += INOTIFY_EVENT_HEADER.size
+                name = data[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+                if name.endswith(b".hl7"):
+                    return True
+
+    def __create_inotify_watch(self):
+        """Returns a non-blocking inotify file descriptor watching the directory or None if it is not available."""
+
+        library_name = ctypes.util.find_library("c")
+        if not library_name:
+            return None
+
+        try:
+            libc = ctypes.CDLL(library_name, use_errno=True)
+            inotify_fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if inotify_fd < 0:
+            return None
+
+        events = IN_CLOSE_WRITE | IN_MOVED_TO
+        if self._watch_modifications:
+            events |= IN_MODIFY
+        watch_descriptor = libc.inotify_add_watch(inotify_fd, os.fsencode(self._path), events)
+        if watch_descriptor < 0:
+            os.close(inotify_fd)
+            return None
+
+        return inotify_fd
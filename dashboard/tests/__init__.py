@@ -1,3 +1,18 @@
 from .hl7_tests import TestAdmissionHL7Message, TestTransferHL7Message, TestDischargeHL7Message, TestUpdateHL7Message, \
-    TestCancelAdmissionHL7Message, TestCancelTransferHL7Message, TestCancelDischargeHL7Message, TestHL7MessageParser
+    TestCancelAdmissionHL7Message, TestCancelTransferHL7Message, TestCancelDischargeHL7Message, TestHL7MessageBatch, \
+    TestHL7MessageCompactor, TestHL7MessageRecord, TestHL7FastMessage, TestHL7MessageParser, \
+    TestHL7MessageQuarantine, TestHL7ParallelApply, TestHL7PriorityScheduler
 from .rfc_tests import TestRFCLocationParser
+from .cache_tests import TestLRUCache, TestLocationCache, TestOpenStayCache, \
+    TestOpenStayCacheTransaction
+from .mllp_tests import TestMLLPServer, TestParseHL7MessageString
+from .watcher_tests import TestHL7DirectoryWatcher
+from .benchmark_tests import TestHL7IngestionBenchmark
+from .backfill_tests import TestHL7Backfill
+from .tail_tests import TestHL7FileTailer
+from .replay_tests import TestHL7LagHistogram, TestHL7Replayer
+from .trace_tests import TestHL7Trace
+from .metrics_tests import TestMetricsRegistry, TestMetricsView
+from .dedup_tests import TestBloomFilter, TestHL7MessageDeduplicator
+from .occupancy_tests import TestOccupancyHistory, TestOccupancyExtremesExport, TestOccupancyHistoryResolution
+from .information_tests import TestLocationInformation
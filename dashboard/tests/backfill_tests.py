@@ -0,0 +1,82 @@
+import gzip
+import os
+import shutil
+import tempfile
+import zipfile
+
+from django.db import connection
+from django.test import TransactionTestCase
+
+from dashboard.models import Visit
+from dashboard.models.hospital_models import Stay
+from dashboard.services.backfill_services import HL7Backfill
+from dashboard.services.benchmark_services import ADTMessageGenerator
+from dashboard.services.cache_services import location_cache, open_stay_cache
+from dashboard.services.hl7_dedup_services import HL7MessageDeduplicator
+
+
+class TestHL7Backfill(TransactionTestCase):
+    """Unittest class for testing the HL7Backfill class."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        HL7MessageDeduplicator.reset()
+
+        # split the generated messages into a HL7-file, a gzip-compressed HL7-file and a zip-archive
+        messages = [message + "\n" for _, message in
+                    ADTMessageGenerator(wards=2, rooms_per_ward=2, beds_per_room=2, patients=30, seed=2)
+                    .generate_messages()]
+        self.number_of_messages = len(messages)
+        # the messages of every part are shuffled against the other parts, so that the backfill has to sort them
+        parts = [messages[0::3], messages[1::3], messages[2::3]]
+
+        os.mkdir(os.path.join(self.directory, "2023"))
+        with open(os.path.join(self.directory, "2023", "messages.hl7"), "w", encoding="ISO-8859-1") as hl7_file:
+            hl7_file.writelines(parts[0])
+        with gzip.open(os.path.join(self.directory, "2023", "messages.hl7.gz"), "wt",
+                       encoding="ISO-8859-1") as gzip_file:
+            gzip_file.writelines(parts[1])
+        with zipfile.ZipFile(os.path.join(self.directory, "messages.zip"), "w") as zip_file:
+            zip_file.writestr("archive/messages.hl7", "".join(parts[2]).encode("ISO-8859-1"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        location_cache.clear()
+        open_stay_cache.clear()
+        HL7MessageDeduplicator.reset()
+
+    def test_run(self):
+        """Tests that the backfill parses all messages from all archive types and reports its progress."""
+
+        reports = []
+        statistics = HL7Backfill([self.directory], batch_size=50, memory_budget=1000, progress_interval=0,
+                                 report=reports.append).run()
+
+        self.assertEqual(statistics.number_of_messages, self.number_of_messages,
+                         msg="The backfill should read the messages of all archive types.")
+        self.assertTrue(Visit.objects.exists() and Stay.objects.exists(),
+                        msg="The backfill should save the messages in the database.")
+        self.assertTrue(any(report.startswith("Parsing") and "ETA" in report for report in reports),
+                        msg="The backfill should report its progress with an ETA.")
+        self.assertEqual(len(os.listdir(self.directory)), 2,
+                         msg="The backfill should not delete or extract the archives.")
+
+    def test_run_with_deferred_indexes(self):
+        """Tests that the deferred indexes exist again after the backfill."""
+
+        def get_index_names():
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, Stay._meta.db_table)
+            return {name for name, constraint in constraints.items() if constraint["index"]}
+
+        index_names = get_index_names()
+        self.assertIn("stay_visit_open_idx", index_names,
+                      msg="The open stay index should exist before the backfill.")
+
+        statistics = HL7Backfill([self.directory], batch_size=50, report=lambda report: None) \
+            .run(defer_indexes=True)
+
+        self.assertEqual(statistics.number_of_messages, self.number_of_messages,
+                         msg="The backfill with deferred indexes should parse all messages.")
+        self.assertEqual(get_index_names(), index_names,
+                         msg="The deferred indexes should be recreated after the backfill.")
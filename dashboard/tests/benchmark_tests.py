@@ -0,0 +1,55 @@
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from dashboard.models import Stay
+from dashboard.services.benchmark_services import ADTMessageGenerator, HL7IngestionBenchmark
+from dashboard.services.cache_services import location_cache, open_stay_cache
+
+
+class TestHL7IngestionBenchmark(TestCase):
+    """Unittest class for testing the ADTMessageGenerator and HL7IngestionBenchmark classes."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    def test_generate_messages(self):
+        """Tests that the generated messages are sorted and contain all message types."""
+
+        messages = ADTMessageGenerator(wards=2, rooms_per_ward=2, beds_per_room=2, patients=500, seed=1) \
+            .generate_messages()
+
+        message_creations = [message_creation for message_creation, _ in messages]
+        self.assertEqual(message_creations, sorted(message_creations),
+                         msg="The generated messages should be sorted by their creation.")
+
+        trigger_events = {message.split("|", 9)[8].split("^")[1] for _, message in messages}
+        self.assertEqual(trigger_events, {"A01", "A02", "A03", "A08", "A11", "A12", "A13"},
+                         msg="The generated messages should contain all parsed message types.")
+
+        self.assertEqual(messages, ADTMessageGenerator(wards=2, rooms_per_ward=2, beds_per_room=2, patients=500,
+                                                       seed=1).generate_messages(),
+                         msg="The same seed should generate the same messages.")
+
+    def test_run(self):
+        """Tests that the benchmark parses all generated messages and reports the results."""
+
+        trigger_events = ADTMessageGenerator(wards=2, rooms_per_ward=2, beds_per_room=2, patients=20) \
+            .write_hl7_files(self.directory, messages_per_file=5)
+
+        results = HL7IngestionBenchmark(self.directory).run()
+
+        self.assertEqual(results["messages"], sum(trigger_events.values()),
+                         msg="The benchmark should parse all generated messages.")
+        self.assertGreater(results["queries_per_message"], 0, msg="The benchmark should count the queries.")
+        self.assertGreater(results["peak_memory_bytes"], 0, msg="The benchmark should measure the peak memory.")
+
+        self.assertTrue(Stay.objects.exists(), msg="The generated messages should create stays.")
+        self.assertFalse(Stay.objects.filter(end_date=None, visit__discharge_date__isnull=False).exists(),
+                         msg="The discharged visits should not have open stays.")
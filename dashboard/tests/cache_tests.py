@@ -0,0 +1,222 @@
+import os
+
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from django.utils import timezone
+
+from dashboard.models import Stay, HL7CacheGeneration
+from dashboard.services import HL7MessageParser
+from dashboard.services.cache_services import LRUCache, location_cache, open_stay_cache, check_cache_generations
+
+directory_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_hl7_messages")
+
+
+class TestLRUCache(TestCase):
+    """Unittest class for testing the LRUCache class."""
+
+    def test_get_or_load(self):
+        """Tests the method get_or_load with the hit and miss counters and the eviction."""
+
+        cache = LRUCache(max_size=2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(cache.get_or_load("a", lambda: 1), 1)
+            self.assertEqual(cache.get_or_load("b", lambda: 2), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(cache.get_or_load("a", lambda: 3), 1,
+                             msg="The cached value should be returned instead of loading a new one.")
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.get_or_load("c", lambda: 3)
+
+        self.assertEqual((cache.hits, cache.misses), (1, 3),
+                         msg="The cache should count 1 hit and 3 misses.")
+
+        # b is the least recently used entry, so it should be evicted
+        self.assertEqual(len(cache), 2, msg="The cache should not exceed its max_size.")
+        self.assertEqual(cache.get_or_load("b", lambda: 4), 4,
+                         msg="The least recently used entry should be evicted.")
+
+    def test_rolled_back_values(self):
+        """Tests that values loaded in a not committed transaction are not cached."""
+
+        cache = LRUCache(max_size=2)
+
+        with self.captureOnCommitCallbacks(execute=False):
+            cache.get_or_load("a", lambda: 1)
+
+        self.assertEqual(len(cache), 0, msg="The value of a not committed transaction should not be cached.")
+
+    def test_cleared_during_transaction(self):
+        """Tests that values loaded before the cache is cleared are not cached after the commit."""
+
+        cache = LRUCache(max_size=2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.begin()
+            cache.get_or_load("a", lambda: 1)
+            cache.update("b", 2)
+            cache.clear()
+
+        self.assertEqual(len(cache), 0, msg="The values loaded before the clear should not be cached.")
+
+
+class TestLocationCache(TestCase):
+    """Unittest class for testing the usage of the location_cache by the HL7-messages."""
+
+    def tearDown(self):
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    def test_create_stay(self):
+        """Tests that the locations of a stay are only queried once."""
+
+        location_cache.clear()
+        open_stay_cache.clear()
+
+        transfer_message = open(os.path.join(directory_path, "transfer_message.hl7"), "r").read()
+        transfer_message = transfer_message.replace("\n", "\r")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            HL7MessageParser._create_hl7_message_from_string(transfer_message).parse_message()
+
+        # the second transfer needs 5 queries less than the first one, because the locations and open stays are cached
+        # (patient, visit, update of the stay and creation of the new stay)
+        with self.assertNumQueries(4):
+            HL7MessageParser._create_hl7_message_from_string(transfer_message).parse_message()
+
+        self.assertEqual(Stay.objects.filter(visit_id=6223045829).count(), 2,
+                         msg="The transfer messages with cached locations should create 2 stays.")
+
+
+class TestOpenStayCache(TestCase):
+    """Unittest class for testing the usage of the open_stay_cache by the HL7-messages."""
+
+    def setUp(self):
+        open_stay_cache.clear()
+
+    def tearDown(self):
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    def test_update(self):
+        """Tests that updated values are only cached after the transaction is committed."""
+
+        cache = LRUCache(max_size=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.get_or_load("a", lambda: 1)
+
+        with self.captureOnCommitCallbacks(execute=False):
+            cache.update("a", 2)
+        self.assertEqual(len(cache), 0, msg="The updated value should be removed until the transaction is committed.")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.update("a", 3)
+        self.assertEqual(cache.get_or_load("a", lambda: 4), 3,
+                         msg="The updated value should be cached after the transaction is committed.")
+
+    def test_open_stays(self):
+        """Tests that the cached open stays are kept current by the HL7-messages."""
+
+        transfer_message = open(os.path.join(directory_path, "transfer_message.hl7"), "r").read()
+        transfer_message = transfer_message.replace("\n", "\r")
+        discharge_message = open(os.path.join(directory_path, "discharge_message.hl7"), "r").read()
+        discharge_message = discharge_message.replace("\n", "\r")
+
+        for message in (transfer_message, transfer_message, discharge_message):
+            hl7_message = HL7MessageParser._create_hl7_message_from_string(message)
+            with self.captureOnCommitCallbacks(execute=True):
+                hl7_message.parse_message()
+
+            visit_id = hl7_message.record.visit_id
+            self.assertEqual(
+                open_stay_cache.get_or_load(visit_id, lambda: None),
+                tuple(Stay.objects.filter(visit_id=visit_id, end_date=None).order_by("id").values_list("id", flat=True)),
+                msg="The cached open stays should be the same as the open stays in the database.")
+
+
+def create_visit_message(trigger_event: str, message_id: int, movement_id: int, bed: str, start_date: str):
+    """Returns a HL7-message of the visit 1000000000 in the format of the SAP system."""
+
+    pv1_fields = [""] * 46
+    pv1_fields[0] = "PV1"
+    pv1_fields[2] = "I"
+    pv1_fields[3] = f"W00^W00R00^W00R00{bed}^W00"
+    pv1_fields[19] = "1000000000"
+    pv1_fields[44] = "20230101080000"
+
+    return "\r".join([
+        f"MSH|^~\\&|SAP IS-H^MCI|003^0001^PSB|Dashboard^Dashboard|ZIEL_FOE^ZIEL_BEREICH|{start_date}||"
+        f"ADT^{trigger_event}^ADT_{trigger_event}|{message_id:010}|P|2.6",
+        f"EVN|{trigger_event}|{start_date}",
+        "PID||0010000000|0010000000||^^^^^^||19700101|F",
+        "|".join(pv1_fields),
+        f"ZBE|{movement_id:05}|{start_date}|99991231240000|{'CANCEL' if trigger_event == 'A12' else 'INSERT'}",
+    ])
+
+
+class TestOpenStayCacheTransaction(TransactionTestCase):
+    """Unittest class for testing the open_stay_cache after a committed chunk of HL7-messages."""
+
+    def tearDown(self):
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    @override_settings(HL7_COMPACTION_WINDOW=0, HL7_PRIORITY_LANES=False, HL7_DEDUPLICATION=False)
+    def test_canceled_transfer_in_chunk(self):
+        """Tests that a stay deleted by a cancellation is not cached by the puts deferred to the commit of its chunk."""
+
+        location_cache.clear()
+        open_stay_cache.clear()
+
+        # the admission, transfer, update and canceled transfer of one visit are parsed in the same chunk
+        messages = [create_visit_message("A01", 1, 1, "B0", "20230101080000"),
+                    create_visit_message("A02", 2, 2, "B1", "20230101090000"),
+                    create_visit_message("A08", 3, 2, "B1", "20230101100000"),
+                    create_visit_message("A12", 4, 2, "B0", "20230101110000")]
+        HL7MessageParser.parse_hl7_messages(
+            [HL7MessageParser._create_hl7_message_from_string(message) for message in messages], batch_size=0)
+
+        open_stay_ids = tuple(Stay.objects.filter(visit_id=1000000000, end_date=None).order_by("id")
+                              .values_list("id", flat=True))
+        self.assertEqual(len(open_stay_ids), 1, msg="Only the stay of the admission should be open.")
+        self.assertEqual(open_stay_cache.get_or_load(1000000000, lambda: open_stay_ids), open_stay_ids,
+                         msg="The cached open stays should be the open stays in the database after the commit.")
+
+        # the discharge of the next run closes the cached open stay
+        discharge_message = create_visit_message("A03", 5, 3, "B0", "20230101120000")
+        statistics = HL7MessageParser.parse_hl7_messages(
+            [HL7MessageParser._create_hl7_message_from_string(discharge_message)], batch_size=0)
+        self.assertEqual(statistics.number_of_quarantined_messages, 0, msg="The discharge should not fail.")
+
+    @override_settings(HL7_COMPACTION_WINDOW=0, HL7_PRIORITY_LANES=False, HL7_DEDUPLICATION=False)
+    def test_stay_changed_by_other_process(self):
+        """Tests that the cached open stays are cleared after another process has committed a change of them."""
+
+        location_cache.clear()
+        open_stay_cache.clear()
+
+        admission_message = create_visit_message("A01", 1, 1, "B0", "20230101080000")
+        HL7MessageParser.parse_hl7_messages([HL7MessageParser._create_hl7_message_from_string(admission_message)],
+                                            batch_size=0)
+        stay = Stay.objects.get(visit_id=1000000000)
+        self.assertEqual(open_stay_cache.get_or_load(1000000000, lambda: None), (stay.id,),
+                         msg="The open stay of the admission should be cached.")
+
+        # another process closes the stay and increases its generation in the same transaction
+        end_date = timezone.make_aware(timezone.datetime(2023, 1, 1, 9))
+        Stay.objects.filter(id=stay.id).update(end_date=end_date)
+        HL7CacheGeneration.objects.create(writer="other:MainThread", process="other", generation=1)
+
+        check_cache_generations()
+        self.assertEqual(len(open_stay_cache), 0,
+                         msg="The caches should be cleared after the change of the other process.")
+
+        transfer_message = create_visit_message("A02", 2, 2, "B1", "20230101100000")
+        statistics = HL7MessageParser.parse_hl7_messages(
+            [HL7MessageParser._create_hl7_message_from_string(transfer_message)], batch_size=0)
+
+        self.assertEqual(statistics.number_of_quarantined_messages, 0, msg="The transfer should not fail.")
+        self.assertEqual(Stay.objects.get(id=stay.id).end_date, end_date,
+                         msg="The transfer should not close the stay closed by the other process again.")
+        self.assertTrue(HL7CacheGeneration.objects.exclude(process="other").exists(),
+                        msg="The parsing process should increase its own generation.")
@@ -0,0 +1,128 @@
+import datetime
+import os
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from dashboard.models import ProcessedHL7Message, Stay
+from dashboard.services import HL7MessageParser
+from dashboard.services.hl7_dedup_services import BloomFilter, HL7MessageDeduplicator, get_control_id_hash
+
+directory_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_hl7_messages")
+
+
+class TestBloomFilter(TestCase):
+    """Unittest class for testing the BloomFilter class."""
+
+    def test_contains(self):
+        """Tests that added keys are always contained and only a few other keys are reported."""
+
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        for number in range(1000):
+            bloom_filter.add(f"{number:010}")
+
+        self.assertTrue(all(f"{number:010}" in bloom_filter for number in range(1000)),
+                        msg="The Bloom filter should contain every added key.")
+
+        false_positives = sum(f"x{number:010}" in bloom_filter for number in range(10000))
+        self.assertLess(false_positives, 300, msg="The Bloom filter should report only a few not added keys.")
+
+
+class TestHL7MessageDeduplicator(TestCase):
+    """Unittest class for testing the HL7MessageDeduplicator class."""
+
+    def setUp(self):
+        HL7MessageDeduplicator.reset()
+
+        transfer_message = open(os.path.join(directory_path, "transfer_message.hl7"), "r").read()
+        self.transfer_message = transfer_message.replace("\n", "\r")
+
+    def test_drop_duplicates(self):
+        """Tests that resent messages are dropped in the same and in a later run."""
+
+        hl7_message = HL7MessageParser._create_hl7_message_from_string(self.transfer_message)
+        number_of_duplicates = HL7MessageParser.parse_hl7_messages([hl7_message, hl7_message],
+                                                                   batch_size=0).number_of_duplicates
+
+        self.assertEqual(number_of_duplicates, 1, msg="The resent message should be dropped in the same run.")
+        self.assertEqual(Stay.objects.filter(visit_id=6223045829).count(), 1,
+                         msg="The resent transfer message should not create a second stay.")
+        control_id_hash = get_control_id_hash(hl7_message.record.control_id)
+        self.assertTrue(ProcessedHL7Message.objects.filter(control_id_hash=control_id_hash).exists(),
+                        msg="The control id of the parsed message should be stored as its hash.")
+
+        # the Bloom filter is loaded from the stored control ids again
+        HL7MessageDeduplicator.reset()
+        number_of_duplicates = HL7MessageParser.parse_hl7_messages([hl7_message], batch_size=2).number_of_duplicates
+        self.assertEqual(number_of_duplicates, 1, msg="The resent message should be dropped in a later run.")
+        self.assertEqual(Stay.objects.filter(visit_id=6223045829).count(), 1,
+                         msg="The resent transfer message should not create a second stay.")
+
+    def test_parse_hl7_message_string(self):
+        """Tests that the real-time messages are deduplicated too."""
+
+        HL7MessageParser.parse_hl7_message_string(self.transfer_message)
+        with self.assertNumQueries(2):
+            # only the control ids stored since the last run and the stored control id are queried,
+            # because the Bloom filter contains it
+            HL7MessageParser.parse_hl7_message_string(self.transfer_message)
+
+    def test_long_control_id(self):
+        """Tests that a message with a control id longer than the stored hash is parsed and deduplicated."""
+
+        long_control_id = "1" * 100
+        hl7_message = HL7MessageParser._create_hl7_message_from_string(
+            self.transfer_message.replace("|0000062753|", f"|{long_control_id}|"))
+        statistics = HL7MessageParser.parse_hl7_messages([hl7_message], batch_size=0)
+
+        self.assertEqual(statistics.number_of_quarantined_messages, 0,
+                         msg="The message with the long control id should not fail.")
+        self.assertTrue(ProcessedHL7Message.objects.filter(control_id_hash=get_control_id_hash(long_control_id))
+                        .exists(), msg="The long control id should be stored as its hash.")
+
+        HL7MessageDeduplicator.reset()
+        number_of_duplicates = HL7MessageParser.parse_hl7_messages([hl7_message], batch_size=0).number_of_duplicates
+        self.assertEqual(number_of_duplicates, 1, msg="The resent message with the long control id should be dropped.")
+
+    def test_control_ids_of_other_processes(self):
+        """Tests that the control ids stored by other processes after the Bloom filter is loaded are recognised."""
+
+        HL7MessageParser.parse_hl7_messages([], batch_size=0)
+
+        # another process parses the message after the Bloom filter of this process is loaded
+        hl7_message = HL7MessageParser._create_hl7_message_from_string(self.transfer_message)
+        ProcessedHL7Message.objects.create(control_id_hash=get_control_id_hash(hl7_message.record.control_id))
+
+        number_of_duplicates = HL7MessageParser.parse_hl7_messages([hl7_message], batch_size=0).number_of_duplicates
+        self.assertEqual(number_of_duplicates, 1,
+                         msg="The message parsed by another process should be dropped.")
+
+    def test_rebuild_bloom_filter(self):
+        """Tests that the Bloom filter is rebuilt after a purge and as soon as it is over its capacity."""
+
+        control_id_hash = get_control_id_hash("purged")
+        ProcessedHL7Message.objects.create(control_id_hash=control_id_hash)
+        HL7MessageParser.parse_hl7_messages([], batch_size=0)
+        self.assertIn(control_id_hash, HL7MessageDeduplicator._bloom_filter,
+                      msg="The stored control id should be loaded into the Bloom filter.")
+
+        # the control id is older than the retention period at the next purge
+        ProcessedHL7Message.objects.update(processed_at=timezone.now() - datetime.timedelta(days=365))
+        HL7MessageDeduplicator._last_purge = 0.0
+        HL7MessageParser.parse_hl7_messages([], batch_size=0)
+        self.assertNotIn(control_id_hash, HL7MessageDeduplicator._bloom_filter,
+                         msg="The purged control id should not be in the rebuilt Bloom filter.")
+
+        with override_settings(HL7_DEDUP_BLOOM_CAPACITY=2):
+            HL7MessageDeduplicator.reset()
+            HL7MessageParser.parse_hl7_messages([], batch_size=0)
+            ProcessedHL7Message.objects.bulk_create(
+                [ProcessedHL7Message(control_id_hash=get_control_id_hash(str(number))) for number in range(5)])
+            HL7MessageParser.parse_hl7_messages([], batch_size=0)
+            self.assertEqual(HL7MessageDeduplicator._bloom_filter.number_of_keys, 5,
+                             msg="The hashes stored since the last load should be added.")
+
+            HL7MessageParser.parse_hl7_messages([], batch_size=0)
+            bloom_filter = HL7MessageDeduplicator._bloom_filter
+            self.assertEqual((bloom_filter.capacity, bloom_filter.number_of_keys), (10, 5),
+                             msg="The Bloom filter over its capacity should be rebuilt with a bigger capacity.")
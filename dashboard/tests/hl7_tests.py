@@ -1,15 +1,26 @@
+import datetime
 import os
 import shutil
+import tempfile
 
 import hl7
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 
-from dashboard.models import Stay
+from dashboard.models import Stay, ProcessedHL7Message
 from dashboard.models.hospital_models import Bed, Visit, Room, Ward, Patient, Discharge
 from dashboard.services import HL7MessageParser
+from dashboard.services.benchmark_services import ADTMessageGenerator
+from dashboard.services.cache_services import location_cache, open_stay_cache
+from dashboard.services.hl7_dedup_services import get_control_id_hash
+from dashboard.services.hl7_extract_services import HL7FastMessage, parse_hl7_message_fast
 from dashboard.services.hl7_services import AdmissionHL7Message, DischargeHL7Message, TransferHL7Message, \
-    UpdateHL7Message, CancelTransferHL7Message, CancelDischargeHL7Message, CancelAdmissionHL7Message, HL7Message
+    UpdateHL7Message, CancelTransferHL7Message, CancelDischargeHL7Message, CancelAdmissionHL7Message, HL7Message, \
+    HL7MessageRecord, HL7PriorityScheduler, \
+    MSH_MESSAGE_CREATION_FIELD, MSH_MESSAGE_TYPE_FIELD, MESSAGE_TYPE_TYPE_COMPONENT, MESSAGE_TYPE_TRIGGER_EVENT_COMPONENT, \
+    PID_PATIENT_ID_FIELD, PID_DOB_FIELD, PID_SEX_FILED, PV1_VISIT_ID_FIELD, PV1_ADMISSION_DATE_FIELD, \
+    PV1_DISCHARGE_DATE_FIELD, PV1_PATIENT_LOCATION_FIELD, PATIENT_LOCATION_WARD_COMPONENT, \
+    PATIENT_LOCATION_ROOM_COMPONENT, PATIENT_LOCATION_BED_COMPONENT, ZBE_MOVEMENT_ID_FIELD, ZBE_START_DATE_FIELD
 
 directory_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_hl7_messages")
 order_directory_path = os.path.join(directory_path, "test_order")
@@ -221,6 +232,256 @@ class TestCancelDischargeHL7Message(TestCase):
                         msg="The cancel discharge message does not reset the discharge_date of the visit to None.")
 
 
+class TestHL7MessageBatch(TestCase):
+    """Unittest class for testing the HL7MessageBatch class."""
+
+    @staticmethod
+    def create_hl7_messages():
+        """Returns a list of Hl7Message instances from the test files, that covers all message types."""
+
+        hl7_messages = []
+        for file_path in (os.path.join(order_directory_path, "inpatient_admission_message.hl7"),
+                          os.path.join(directory_path, "transfer_message.hl7"),
+                          os.path.join(directory_path, "transfer_message.hl7"),
+                          os.path.join(directory_path, "update_message.hl7"),
+                          os.path.join(order_directory_path, "discharge_message.hl7"),
+                          os.path.join(directory_path, "cancel_discharge_message.hl7"),
+                          os.path.join(directory_path, "two_messages.hl7"),
+                          os.path.join(directory_path, "inpatient_admission_message.hl7"),
+                          os.path.join(directory_path, "cancel_admission_message.hl7")):
+            hl7_messages += HL7MessageParser._create_hl7_messages_from_file(file_path)
+        return hl7_messages
+
+    @staticmethod
+    def get_database_state():
+        """Returns the state of all hospital models without the generated primary keys."""
+
+        return {
+            "patients": sorted(Patient.objects.values_list("patient_id", "date_of_birth", "sex")),
+            "visits": sorted(Visit.objects.values_list("visit_id", "admission_date", "discharge_date", "patient_id")),
+            "wards": sorted(Ward.objects.values_list("id", "name", "date_of_activation", "date_of_expiry")),
+            "rooms": sorted(Room.objects.values_list("id", "ward_id", "date_of_activation", "date_of_expiry")),
+            "beds": sorted(Bed.objects.values_list("id", "room_id", "date_of_activation", "date_of_expiry")),
+            "stays": sorted(Stay.objects.values_list("visit_id", "movement_id", "start_date", "end_date",
+                                                     "ward_id", "room_id", "bed_id"),
+                            key=str),
+            "discharges": sorted(Discharge.objects.values_list("movement_id", "stay__visit_id", "stay__movement_id")),
+        }
+
+    # the test messages contain the same transfer message twice
+    @override_settings(HL7_DEDUPLICATION=False)
+    def test_parse(self):
+        """Tests that the batches result in the same database state as parsing every message on its own."""
+
+        HL7MessageParser.parse_hl7_messages(self.create_hl7_messages(), batch_size=0)
+        expected_state = self.get_database_state()
+
+        self.assertTrue(expected_state["discharges"],
+                        msg="The test messages should create a discharge.")
+
+        Patient.objects.all().delete()
+        Ward.objects.all().delete()
+
+        HL7MessageParser.parse_hl7_messages(self.create_hl7_messages(), batch_size=4)
+
+        self.assertEqual(self.get_database_state(), expected_state,
+                         msg="The batches should result in the same state as parsing every message on its own.")
+
+
+class TestHL7MessageCompactor(TestCase):
+    """Unittest class for testing the HL7MessageCompactor class."""
+
+    @staticmethod
+    def create_hl7_message(file_path: str, replacements: dict = None):
+        """Returns the Hl7Message instance of a test file with the given replacements in the message string."""
+
+        message = open(file_path, "r").read().replace("\n", "\r")
+        for old, new in (replacements or {}).items():
+            message = message.replace(old, new)
+        return HL7MessageParser._create_hl7_message_from_string(message)
+
+    def create_hl7_messages(self, names):
+        """Returns the Hl7Message instances with the given names, that all belong to the same visit."""
+
+        hl7_messages = {
+            "admission": lambda: self.create_hl7_message(
+                os.path.join(order_directory_path, "inpatient_admission_message.hl7")),
+            "discharge": lambda: self.create_hl7_message(os.path.join(order_directory_path, "discharge_message.hl7")),
+            "transfer": lambda: self.create_hl7_message(os.path.join(directory_path, "transfer_message.hl7"),
+                                                        {"6223045829": "4223045829"}),
+            "update": lambda: self.create_hl7_message(os.path.join(directory_path, "update_message.hl7")),
+            "cancel_admission": lambda: self.create_hl7_message(
+                os.path.join(directory_path, "cancel_admission_message.hl7"), {"4223045827": "4223045829"}),
+            "cancel_transfer": lambda: self.create_hl7_message(
+                os.path.join(directory_path, "cancel_transfer_message.hl7"),
+                {"8223023649": "4223045829", "ZBE|00002|": "ZBE|00016|"}),
+        }
+        return [hl7_messages[name]() for name in names]
+
+    @staticmethod
+    def clear_database():
+        """Deletes all hospital models and the stored control ids."""
+
+        Patient.objects.all().delete()
+        Ward.objects.all().delete()
+        ProcessedHL7Message.objects.all().delete()
+
+    def assert_same_state(self, names, number_of_compacted_messages: int, batch_size: int = 0):
+        """Asserts that the compacted messages result in the same database state as the sequential parsing."""
+
+        self.clear_database()
+        with override_settings(HL7_COMPACTION_WINDOW=0):
+            HL7MessageParser.parse_hl7_messages(self.create_hl7_messages(names), batch_size=batch_size)
+        expected_state = TestHL7MessageBatch.get_database_state()
+        expected_control_ids = sorted(ProcessedHL7Message.objects.values_list("control_id_hash", flat=True))
+
+        self.clear_database()
+        statistics = HL7MessageParser.parse_hl7_messages(self.create_hl7_messages(names), batch_size=batch_size)
+
+        self.assertEqual(statistics.number_of_compacted_messages, number_of_compacted_messages,
+                         msg=f"The messages {names} should be compacted.")
+        self.assertEqual(TestHL7MessageBatch.get_database_state(), expected_state,
+                         msg=f"The compacted messages {names} should result in the same state as the sequential parsing.")
+        self.assertEqual(sorted(ProcessedHL7Message.objects.values_list("control_id_hash", flat=True)),
+                         expected_control_ids,
+                         msg="The control ids of the compacted messages should be stored too.")
+
+    def test_compact_admission(self):
+        """Tests the compaction of an admission and its cancellation."""
+
+        self.assert_same_state(["admission", "cancel_admission"], 2)
+        self.assert_same_state(["admission", "cancel_admission"], 2, batch_size=10)
+        # the update of another visit does not prevent the compaction
+        self.assert_same_state(["admission", "update", "cancel_admission", "admission"], 2)
+        # the discharge of the visit between the messages prevents the compaction
+        self.assert_same_state(["admission", "discharge", "cancel_admission"], 0)
+
+    def test_compact_transfer(self):
+        """Tests the compaction of a transfer and its cancellation."""
+
+        # the stay closed by the transfer is the stay reopened by the cancellation
+        self.assert_same_state(["admission", "transfer", "cancel_transfer"], 2)
+        self.assert_same_state(["admission", "transfer", "cancel_transfer"], 2, batch_size=10)
+        # there is no open stay, so the cancellation reopens the discharged stay
+        self.assert_same_state(["admission", "discharge", "transfer", "cancel_transfer", "update"], 2)
+        # there are no stays at all
+        self.assert_same_state(["transfer", "cancel_transfer"], 2)
+
+    @override_settings(HL7_DEDUPLICATION=False)
+    def test_compact_transfer_after_transfer_in_batch(self):
+        """Tests that a compacted transfer parsed on its own in a batch does not use the cached open stays."""
+
+        first_transfer = self.create_hl7_message(os.path.join(directory_path, "transfer_message.hl7"),
+                                                 {"6223045829": "4223045829",
+                                                  "ZBE|00016|20230516092341": "ZBE|00015|20230516080000"})
+
+        # the open stay of the admission is cached by the run before the batch
+        self.addCleanup(location_cache.clear)
+        self.addCleanup(open_stay_cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            HL7MessageParser.parse_hl7_messages(self.create_hl7_messages(["admission"]), batch_size=0)
+        self.assertEqual(len(open_stay_cache), 1, msg="The open stay of the admission should be cached.")
+
+        # the first transfer is applied in bulk, the compacted transfer is parsed on its own
+        HL7MessageParser.parse_hl7_messages([first_transfer] + self.create_hl7_messages(["transfer", "cancel_transfer"]),
+                                            batch_size=10)
+
+        self.assertEqual(list(Stay.objects.filter(visit_id=4223045829).order_by("movement_id")
+                              .values_list("movement_id", "end_date")),
+                         [(1, timezone.make_aware(timezone.datetime(2023, 5, 16, 8), datetime.timezone.utc)),
+                          (15, None)],
+                         msg="The compacted transfer should not close the stay closed by the transfer before again.")
+
+
+class TestHL7MessageRecord(TestCase):
+    """Unittest class for testing the HL7MessageRecord class."""
+
+    def test_decode(self):
+        """Tests that the fields are decoded once into typed values."""
+
+        admission_message = open(os.path.join(directory_path, "inpatient_admission_message.hl7"), "r").read()
+        admission_message = admission_message.replace("\n", "\r")
+        record = HL7MessageRecord(parse_hl7_message_fast(admission_message))
+
+        self.assertEqual(record.trigger_event, "A01", msg="The trigger event should be decoded from MSH-9.")
+        self.assertEqual(record.patient_id, 36058958, msg="The patient id should be decoded as integer.")
+        self.assertEqual(record.visit_id, 5223045829, msg="The visit id should be decoded as integer.")
+        self.assertEqual(record.date_of_birth, timezone.datetime(1964, 11, 5).date(),
+                         msg="The date of birth should be decoded as date.")
+        self.assertIsInstance(record.start_date, timezone.datetime, msg="The start date should be decoded as datetime.")
+        self.assertTrue(record.bed_id, msg="The bed id should be decoded from the patient location.")
+
+        # test that fields, which are not usable, are decoded as None
+        self.assertIsNone(record.discharge_date, msg="An empty discharge date should be decoded as None.")
+        self.assertFalse(hasattr(record, "__dict__"), msg="The record should only use slots.")
+
+
+class TestHL7FastMessage(TestCase):
+    """Unittest class for testing the HL7FastMessage class."""
+
+    def test_extract_field(self):
+        """Tests that the fast extractor returns the same fields as the hl7 library for all test messages."""
+
+        used_fields = {"MSH": [(MSH_MESSAGE_CREATION_FIELD, 1), (MSH_MESSAGE_TYPE_FIELD, MESSAGE_TYPE_TYPE_COMPONENT),
+                               (MSH_MESSAGE_TYPE_FIELD, MESSAGE_TYPE_TRIGGER_EVENT_COMPONENT)],
+                       "PID": [(PID_PATIENT_ID_FIELD, 1), (PID_DOB_FIELD, 1), (PID_SEX_FILED, 1)],
+                       "PV1": [(PV1_VISIT_ID_FIELD, 1), (PV1_ADMISSION_DATE_FIELD, 1), (PV1_DISCHARGE_DATE_FIELD, 1),
+                               (PV1_PATIENT_LOCATION_FIELD, PATIENT_LOCATION_WARD_COMPONENT),
+                               (PV1_PATIENT_LOCATION_FIELD, PATIENT_LOCATION_ROOM_COMPONENT),
+                               (PV1_PATIENT_LOCATION_FIELD, PATIENT_LOCATION_BED_COMPONENT)],
+                       "ZBE": [(ZBE_MOVEMENT_ID_FIELD, 1), (ZBE_START_DATE_FIELD, 1)]}
+
+        for filename in os.listdir(directory_path):
+            if not filename.endswith(".hl7"):
+                continue
+
+            for message in HL7MessageParser._generate_hl7_message_strings_from_file(
+                    os.path.join(directory_path, filename)):
+                hl7_message = hl7.parse(message)
+                fast_message = parse_hl7_message_fast(message)
+                self.assertIsInstance(fast_message, HL7FastMessage,
+                                      msg="A message without escape sequences should be parsed by the fast extractor.")
+
+                for segment_id, fields in used_fields.items():
+                    try:
+                        hl7_segment = hl7_message.segment(segment_id)
+                    except KeyError:
+                        with self.assertRaises(KeyError, msg="A missing segment should raise a KeyError."):
+                            fast_message.segment(segment_id)
+                        continue
+
+                    for field_num, component_num in fields:
+                        try:
+                            expected_field = hl7_segment.extract_field(
+                                field_num=field_num, component_num=component_num)
+                        except IndexError:
+                            # the hl7 library raises an error for missing components, the fast extractor is tolerant
+                            expected_field = ""
+
+                        self.assertEqual(
+                            fast_message.segment(segment_id).extract_field(field_num=field_num,
+                                                                           component_num=component_num),
+                            expected_field,
+                            msg=f"The fast extractor returns another {segment_id}-{field_num}.{component_num} "
+                                f"than the hl7 library for {filename}.")
+
+    def test_parse_hl7_message_fast(self):
+        """Tests the function parse_hl7_message_fast."""
+
+        admission_message = open(os.path.join(directory_path, "inpatient_admission_message.hl7"), "r").read()
+        admission_message = admission_message.replace("\n", "\r")
+
+        # test that messages with escape sequences are parsed by the hl7 library, because only it unescapes them
+        escaped_message = admission_message.replace("PID|", "PID|\\T\\", 1)
+        self.assertIsInstance(parse_hl7_message_fast(escaped_message), hl7.Message,
+                              msg="A message with escape sequences should be parsed by the hl7 library.")
+
+        # test that the fast message can be parsed like the hl7 message
+        AdmissionHL7Message(parse_hl7_message_fast(admission_message)).parse_message()
+        self.assertTrue(Stay.objects.filter(visit_id=5223045829, end_date=None).exists(),
+                        msg="The admission message from the fast extractor does not create a stay.")
+
+
 class TestHL7MessageParser(TestCase):
     """Unittest class for testing the Hl7MessageParser class."""
 
@@ -349,3 +610,273 @@ class TestHL7MessageParser(TestCase):
 
         # delete the created test directory
         shutil.rmtree(new_directory)
+
+    def test_stream_hl7_messages_from_directory(self):
+        """Tests the method stream_hl7_messages_from_directory with spilled runs."""
+
+        # create a test directory and copy all important hl7 files in it
+        new_directory = os.path.join(directory_path, "deletable_test_stream")
+
+        try:
+            os.mkdir(new_directory)
+        except FileExistsError:
+            shutil.rmtree(new_directory)
+            os.mkdir(new_directory)
+
+        for filename in ("two_messages.hl7", "discharge_message.hl7", "transfer_message.hl7",
+                         "inpatient_admission_message.hl7", "update_message.hl7"):
+            shutil.copy2(os.path.join(directory_path, filename), os.path.join(new_directory, filename))
+
+        # test the method with a memory budget of one character, so that every message is spilled to its own run
+        hl7_messages = list(HL7MessageParser.stream_hl7_messages_from_directory(new_directory, memory_budget=1))
+
+        self.assertEqual(len(hl7_messages), 6,
+                         msg="The method stream_hl7_messages_from_directory should return all 6 messages.")
+
+        message_creations = [hl7_message.message_creation for hl7_message in hl7_messages]
+        self.assertEqual(message_creations, sorted(message_creations),
+                         msg="The method stream_hl7_messages_from_directory should return the messages sorted " +
+                             "by their creation.")
+
+        self.assertEqual(len(os.listdir(new_directory)), 0,
+                         msg="The method stream_hl7_messages_from_directory should delete all hl7 files.")
+
+        # delete the created test directory
+        shutil.rmtree(new_directory)
+
+    @override_settings(HL7_PARSE_POOL_MIN_BYTES=1, HL7_PARSE_CHUNK_SIZE=1)
+    def test_stream_hl7_messages_from_directory_with_workers(self):
+        """Tests the method stream_hl7_messages_from_directory with the parsing in worker processes."""
+
+        # create a test directory and copy all important hl7 files in it
+        new_directory = os.path.join(directory_path, "deletable_test_workers")
+
+        try:
+            os.mkdir(new_directory)
+        except FileExistsError:
+            shutil.rmtree(new_directory)
+            os.mkdir(new_directory)
+
+        for filename in ("two_messages.hl7", "discharge_message.hl7", "merge_message.hl7",
+                         "inpatient_admission_message.hl7"):
+            shutil.copy2(os.path.join(directory_path, filename), os.path.join(new_directory, filename))
+
+        # test the method with 2 worker processes and chunks of one message
+        hl7_messages = list(HL7MessageParser.stream_hl7_messages_from_directory(new_directory, workers=2))
+
+        self.assertEqual(len(hl7_messages), 4,
+                         msg="The worker processes should return all 4 usable messages.")
+
+        message_creations = [hl7_message.message_creation for hl7_message in hl7_messages]
+        self.assertEqual(message_creations, sorted(message_creations),
+                         msg="The messages from the worker processes should be sorted by their creation.")
+
+        self.assertEqual(len(os.listdir(new_directory)), 0,
+                         msg="The method stream_hl7_messages_from_directory should delete all hl7 files.")
+
+        # delete the created test directory
+        shutil.rmtree(new_directory)
+
+
+class TestHL7MessageQuarantine(TestCase):
+    """Unittest class for testing the quarantine of HL7-messages, that can not be parsed."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.quarantine_directory = os.path.join(self.directory, "quarantine")
+
+        # an admission of another patient without admission date, so that its visit can not be created
+        admission_message = open(os.path.join(directory_path, "inpatient_admission_message.hl7"), "r").read()
+        broken_admission_message = admission_message.replace("0000062752", "0000062799") \
+            .replace("0036058958", "0036058959").replace("5223045829", "5223045830") \
+            .replace("20230516090000||||||||\nZBE", "2023XX16090000||||||||\nZBE")
+
+        for filename, message in (("admission.hl7", admission_message),
+                                  ("broken_admission.hl7", broken_admission_message)):
+            with open(os.path.join(self.directory, filename), "w") as hl7_file:
+                hl7_file.write(message)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    def assert_quarantined(self, batch_size: int):
+        """Parses the test directory with the given batch size and tests that only the broken message failed."""
+
+        with override_settings(HL7_QUARANTINE_DIRECTORY=self.quarantine_directory):
+            statistics = HL7MessageParser.parse_hl7_messages_from_directory(self.directory, batch_size=batch_size)
+
+        self.assertEqual(statistics.number_of_quarantined_messages, 1,
+                         msg="The broken message should be quarantined.")
+        self.assertTrue(Visit.objects.filter(visit_id=5223045829).exists(),
+                        msg="The other message of the chunk should be committed.")
+        self.assertFalse(Patient.objects.filter(patient_id=36058959).exists(),
+                         msg="The broken message should be rolled back to its savepoint.")
+        self.assertFalse(ProcessedHL7Message.objects.filter(control_id_hash=get_control_id_hash("0000062799"))
+                         .exists(),
+                         msg="The control id of the quarantined message should not be stored.")
+
+        self.assertEqual([filename for filename in os.listdir(self.directory) if filename.endswith(".hl7")], [],
+                         msg="The HL7-files should be deleted after their messages are committed or quarantined.")
+
+        quarantined_files = sorted(os.listdir(self.quarantine_directory))
+        self.assertEqual([os.path.splitext(filename)[1] for filename in quarantined_files], [".error", ".hl7"],
+                         msg="The broken message should be quarantined with its error.")
+        self.assertIn("0000062799", open(os.path.join(self.quarantine_directory, quarantined_files[1])).read(),
+                      msg="The quarantined HL7-file should contain the broken message.")
+
+    def test_parse_hl7_messages_on_their_own(self):
+        """Tests the quarantine of a message, that is parsed in a chunk with a savepoint per message."""
+        self.assert_quarantined(batch_size=0)
+
+    def test_parse_hl7_messages_in_batches(self):
+        """Tests the quarantine of a message, that lets its batch fail."""
+        self.assert_quarantined(batch_size=10)
+
+
+class TestHL7ParallelApply(TransactionTestCase):
+    """Unittest class for testing the parsing of HL7-messages by several apply workers."""
+
+    def tearDown(self):
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    @staticmethod
+    def create_hl7_messages():
+        """Returns the Hl7Message instances of generated messages of many patients with all message types."""
+
+        return [HL7MessageParser._create_hl7_message_from_string(message) for _, message in
+                ADTMessageGenerator(wards=2, rooms_per_ward=3, beds_per_room=2, patients=60, seed=3)
+                .generate_messages()]
+
+    def assert_same_state(self, batch_size: int):
+        """Tests that 4 apply workers result in the same database state as parsing the messages in order."""
+
+        HL7MessageParser.parse_hl7_messages(self.create_hl7_messages(), batch_size=batch_size, apply_workers=1)
+        expected_state = TestHL7MessageBatch.get_database_state()
+
+        Patient.objects.all().delete()
+        Ward.objects.all().delete()
+        location_cache.clear()
+        open_stay_cache.clear()
+
+        statistics = HL7MessageParser.parse_hl7_messages(self.create_hl7_messages(), batch_size=batch_size,
+                                                         apply_workers=4)
+
+        self.assertEqual(statistics.number_of_quarantined_messages, 0,
+                         msg="No message should fail in the apply workers.")
+        self.assertEqual(TestHL7MessageBatch.get_database_state(), expected_state,
+                         msg="The apply workers should result in the same state as parsing the messages in order.")
+
+    @override_settings(HL7_DEDUPLICATION=False)
+    def test_parse_hl7_messages_on_their_own(self):
+        """Tests the apply workers with messages parsed on their own."""
+        self.assert_same_state(batch_size=0)
+
+    @override_settings(HL7_DEDUPLICATION=False)
+    def test_parse_hl7_messages_in_batches(self):
+        """Tests the apply workers with messages parsed in batches."""
+        self.assert_same_state(batch_size=20)
+
+    @override_settings(HL7_DEDUPLICATION=False, HL7_COMPACTION_WINDOW=0)
+    def test_changed_patient_of_visit(self):
+        """Tests that the partitions are drained, if the patient id of a visit changes to another partition."""
+
+        # the later messages of the first visit of the patient 10000000 (partition 0 of 4) have the patient
+        # 10000001 (partition 1 of 4), whose own messages are parsed by another worker
+        messages = [message for _, message in ADTMessageGenerator(wards=2, rooms_per_ward=3, beds_per_room=2,
+                                                                  patients=20, seed=5).generate_messages()]
+        visit_id = None
+        for index, message in enumerate(messages):
+            if visit_id is None and "PID||0010000000|" in message:
+                visit_id = message.split("PV1|", 1)[1].split("|")[18]
+            elif visit_id is not None and f"|{visit_id}|" in message:
+                messages[index] = message.replace("PID||0010000000|0010000000|", "PID||0010000001|0010000001|")
+
+        HL7MessageParser.parse_hl7_messages(
+            [HL7MessageParser._create_hl7_message_from_string(message) for message in messages], batch_size=0,
+            apply_workers=1)
+        expected_state = TestHL7MessageBatch.get_database_state()
+
+        Patient.objects.all().delete()
+        Ward.objects.all().delete()
+        location_cache.clear()
+        open_stay_cache.clear()
+
+        with self.assertLogs("dashboard.services.hl7_services", level="INFO") as logs:
+            statistics = HL7MessageParser.parse_hl7_messages(
+                [HL7MessageParser._create_hl7_message_from_string(message) for message in messages], batch_size=0,
+                apply_workers=4)
+
+        self.assertEqual(statistics.number_of_quarantined_messages, 0,
+                         msg="No message should fail in the apply workers.")
+        self.assertTrue(any("drained" in line for line in logs.output),
+                        msg="The partitions of the visit and its new patient should be drained.")
+        self.assertEqual(TestHL7MessageBatch.get_database_state(), expected_state,
+                         msg="The apply workers should result in the same state as parsing the messages in order.")
+
+
+class TestHL7PriorityScheduler(TestCase):
+    """Unittest class for testing the HL7PriorityScheduler class."""
+
+    def test_schedule(self):
+        """Tests that the most recent visits are scheduled first and every visit and patient keeps its order."""
+
+        start = timezone.datetime.now() - timezone.timedelta(days=3)
+        hl7_messages = [HL7MessageParser._create_hl7_message_from_string(message) for _, message in
+                        ADTMessageGenerator(patients=40, days=3, seed=4, start=start).generate_messages()]
+
+        scheduler = HL7PriorityScheduler(near_time_age=6 * 3600)
+        scheduled_messages = list(scheduler.schedule(hl7_messages))
+
+        self.assertEqual(sorted(id(hl7_message) for hl7_message in scheduled_messages),
+                         sorted(id(hl7_message) for hl7_message in hl7_messages),
+                         msg="The scheduler should yield every message once.")
+
+        patient_ids = [hl7_message.record.patient_id for hl7_message in scheduled_messages]
+        for patient_id in set(patient_ids):
+            self.assertEqual([hl7_message for hl7_message in scheduled_messages
+                              if hl7_message.record.patient_id == patient_id],
+                             [hl7_message for hl7_message in hl7_messages
+                              if hl7_message.record.patient_id == patient_id],
+                             msg="The messages of every patient should keep their order.")
+
+        # the visits of a generated patient belong to the same group, so the last message of every group is the one
+        # of the patient
+        last_creations = [hl7_message.message_creation for number, hl7_message in enumerate(scheduled_messages)
+                          if number + 1 == len(scheduled_messages) or patient_ids[number + 1] != patient_ids[number]]
+        self.assertEqual(len(last_creations), len(set(patient_ids)),
+                         msg="The messages of every patient should be scheduled together.")
+        self.assertEqual(last_creations, sorted(last_creations, reverse=True),
+                         msg="The visits with the most recent activity should be scheduled first.")
+
+        near_time_lane = scheduler.lanes[HL7PriorityScheduler.NEAR_TIME_LANE]
+        backlog_lane = scheduler.lanes[HL7PriorityScheduler.BACKLOG_LANE]
+        self.assertEqual(near_time_lane["messages"] + backlog_lane["messages"], len(hl7_messages),
+                         msg="Every message should be counted in a lane.")
+        self.assertTrue(near_time_lane["visits"] and backlog_lane["visits"],
+                        msg="The generated visits should be in both lanes.")
+        self.assertGreater(backlog_lane["age"], 6 * 3600,
+                           msg="The backlog lane should report the age of its oldest message.")
+
+    def test_schedule_in_windows(self):
+        """Tests that the messages are only scheduled within their window and every patient keeps its order."""
+
+        hl7_messages = [HL7MessageParser._create_hl7_message_from_string(message) for _, message in
+                        ADTMessageGenerator(patients=40, days=3, seed=4).generate_messages()]
+
+        scheduler = HL7PriorityScheduler(window=10)
+        scheduled_messages = list(scheduler.schedule(iter(hl7_messages)))
+
+        for index in range(0, len(hl7_messages), 10):
+            self.assertEqual(sorted(id(hl7_message) for hl7_message in scheduled_messages[index:index + 10]),
+                             sorted(id(hl7_message) for hl7_message in hl7_messages[index:index + 10]),
+                             msg="Every window should yield its own messages.")
+
+        for patient_id in {hl7_message.record.patient_id for hl7_message in hl7_messages}:
+            self.assertEqual([hl7_message for hl7_message in scheduled_messages
+                              if hl7_message.record.patient_id == patient_id],
+                             [hl7_message for hl7_message in hl7_messages
+                              if hl7_message.record.patient_id == patient_id],
+                             msg="The messages of every patient should keep their order across the windows.")
@@ -0,0 +1,142 @@
+import datetime
+import random
+
+from django.db import models
+from django.test import TestCase
+from django.utils import timezone
+
+from dashboard.models.hospital_models import Patient, Visit, Ward, Room, Bed, Stay
+
+# start of the generated stays and activations, all times are whole hours, so that they meet the sample times
+INFORMATION_START = timezone.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def get_time(hours: int):
+    """Returns the time the given number of hours after the start of the generated stays."""
+    return INFORMATION_START + datetime.timedelta(hours=hours)
+
+
+def get_joined_occupancy(query_set, time: datetime.datetime, bed_field: str):
+    """Returns the occupancy of the locations, that are joined with their stays and beds, like before."""
+
+    return query_set.annotate(
+        number=models.Count('stay', distinct=True,
+                            filter=models.Q(stay__start_date__lt=time) & (
+                                    models.Q(stay__end_date=None) | models.Q(stay__end_date__gt=time))),
+        max_number=models.Count(bed_field, distinct=True,
+                                filter=models.Q(**{f"{bed_field}__date_of_activation__lt": time,
+                                                   f"{bed_field}__date_of_expiry__gt": time}))
+    )
+
+
+def get_joined_information(query_set, time: datetime.datetime, bed_field: str):
+    """Returns the information of the locations, that are joined with their stays and beds, like before."""
+
+    if bed_field == "bed":
+        query_set = query_set.sex_annotation(time).age_annotation(time)
+    else:
+        query_set = query_set.sex_annotation(time)
+
+    return query_set.annotate(
+        max_number=models.Count(bed_field, distinct=True,
+                                filter=models.Q(**{f"{bed_field}__date_of_activation__lt": time,
+                                                   f"{bed_field}__date_of_expiry__gt": time})),
+        number=models.F("number_of_men") + models.F("number_of_women") + models.F("number_of_diverse")
+    )
+
+
+class TestLocationInformation(TestCase):
+    """Unittest class for testing the information and occupancy of the wards and rooms against the joined queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        generator = random.Random(2)
+
+        # many rooms with a few stays, so that some rooms have at most one stay at every time
+        beds = []
+        for ward_number in range(2):
+            ward = Ward.objects.create(id=f"W{ward_number}", name=f"W{ward_number}", date_of_activation=get_time(-10),
+                                       date_of_expiry=get_time(200))
+            for room_number in range(8):
+                room = Room.objects.create(id=f"{ward.id}R{room_number}", name=f"R{room_number}", ward=ward,
+                                           date_of_activation=get_time(generator.randrange(-10, 20)),
+                                           date_of_expiry=get_time(200))
+                for bed_number in range(3):
+                    beds.append(Bed.objects.create(
+                        id=f"{room.id}B{bed_number}", name=f"B{bed_number}", room=room,
+                        date_of_activation=get_time(generator.randrange(-10, 40)),
+                        date_of_expiry=get_time(generator.randrange(60, 130))))
+
+        for number in range(40):
+            patient = Patient.objects.create(patient_id=number,
+                                             date_of_birth=datetime.date(generator.randrange(1930, 2020),
+                                                                         generator.randrange(1, 13), 1),
+                                             sex=generator.choice(Patient.SexChoices.values))
+            visit = Visit.objects.create(visit_id=number, admission_date=get_time(0), patient=patient)
+            bed = generator.choice(beds)
+            start_date = generator.randrange(-20, 110)
+            end_date = start_date + generator.randrange(1, 40) if generator.random() < 0.8 else None
+            Stay.objects.create(visit=visit, bed=bed, room=bed.room, ward=bed.room.ward, movement_id=number,
+                                start_date=get_time(start_date),
+                                end_date=get_time(end_date) if end_date is not None else None)
+
+        cls.times = [get_time(hours) for hours in range(-15, 125, 9)]
+
+    def test_ward_information(self):
+        """Tests that the information and occupancy of the wards equal the joined queries."""
+
+        for time in self.times:
+            query_set = Ward.objects.filter_for_time(time).order_by("id")
+            self.assertEqual(list(query_set.get_information(time).values()),
+                             list(get_joined_information(query_set, time, "room__bed").values()),
+                             msg=f"The information of the wards should equal the joined query at {time}.")
+            self.assertEqual(list(query_set.get_occupancy(time).values()),
+                             list(get_joined_occupancy(query_set, time, "room__bed").values()),
+                             msg=f"The occupancy of the wards should equal the joined query at {time}.")
+
+    def test_room_information(self):
+        """Tests that the information and occupancy of the rooms equal the joined queries with one row per room."""
+
+        number_of_compared_rooms = 0
+        for time in self.times:
+            query_set = Room.objects.filter_for_time(time).order_by("id")
+            information = list(query_set.get_information(time).values())
+            self.assertEqual([room["id"] for room in information], list(query_set.values_list("id", flat=True)),
+                             msg="The information should contain every room once.")
+
+            # the joined query returns a row for every different age of the stays of a room
+            joined_information = dict()
+            for room in get_joined_information(query_set, time, "bed").values():
+                joined_information.setdefault(room["id"], []).append(room)
+
+            for room in information:
+                joined_rooms = joined_information[room["id"]]
+                for name in ("number_of_men", "number_of_women", "number_of_diverse", "number"):
+                    self.assertEqual(room[name], sum(joined_room[name] for joined_room in joined_rooms),
+                                     msg=f"The {name} of the room {room['id']} should equal the joined query.")
+                if len(joined_rooms) == 1:
+                    number_of_compared_rooms += 1
+                    self.assertEqual(room, joined_rooms[0],
+                                     msg=f"The information of the room {room['id']} should equal the joined query.")
+
+            self.assertEqual(list(query_set.get_occupancy(time).values()),
+                             list(get_joined_occupancy(query_set, time, "bed").values()),
+                             msg=f"The occupancy of the rooms should equal the joined query at {time}.")
+
+        self.assertGreater(number_of_compared_rooms, 0, msg="Some rooms should be compared completely.")
+
+    def test_room_average_age(self):
+        """Tests that the average age of a room is the average of the ages of its patients at the time."""
+
+        time = get_time(50)
+        for room in Room.objects.filter_for_time(time).get_information(time):
+            ages = [time.year - date_of_birth.year - ((date_of_birth.month, date_of_birth.day) > (time.month, time.day))
+                    for date_of_birth in Stay.objects.filter(
+                        models.Q(room=room, start_date__lt=time) &
+                        (models.Q(end_date=None) | models.Q(end_date__gt=time))
+                    ).values_list("visit__patient__date_of_birth", flat=True)]
+            if ages:
+                self.assertAlmostEqual(room.average_age, sum(ages) / len(ages), delta=1,
+                                       msg=f"The average age of the room {room.id} should be the average of its ages.")
+            else:
+                self.assertIsNone(room.average_age, msg=f"The empty room {room.id} should have no average age.")
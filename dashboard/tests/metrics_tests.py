@@ -0,0 +1,121 @@
+import os
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from dashboard.models import DataRepresentation, User, UserDataRepresentation
+from dashboard.services import HL7MessageParser
+from dashboard.services.cache_services import location_cache, open_stay_cache
+from dashboard.services.metrics_services import Counter, Histogram, MetricsRegistry, get_data_request_duration, \
+    hl7_messages_ingested, hl7_ingest_batch_duration
+
+directory_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_hl7_messages")
+
+
+class TestMetricsRegistry(SimpleTestCase):
+    """Unittest class for testing the MetricsRegistry class with its metrics."""
+
+    def test_render(self):
+        """Tests that the counters and histograms are rendered in the text exposition format."""
+
+        registry = MetricsRegistry()
+        counter = registry.register(Counter("test_total", "A test counter.", ("event",)))
+        histogram = registry.register(Histogram("test_seconds", "A test histogram.", buckets=(0.1, 1)))
+
+        counter.inc(event="A01")
+        counter.inc(2, event='A"02')
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE test_total counter", lines, msg="The type of the counter should be rendered.")
+        self.assertIn('test_total{event="A01"} 1', lines, msg="The counter should be rendered with its label.")
+        self.assertIn('test_total{event="A\\"02"} 2', lines, msg="The label values should be escaped.")
+        for line in ('test_seconds_bucket{le="0.1"} 1', 'test_seconds_bucket{le="1"} 2',
+                     'test_seconds_bucket{le="+Inf"} 3', "test_seconds_sum 5.55", "test_seconds_count 3"):
+            self.assertIn(line, lines, msg="The buckets of the histogram should be cumulative.")
+
+        with self.assertRaises(ValueError, msg="The labels of a metric should be checked."):
+            counter.inc(trigger_event="A01")
+        with self.assertRaises(ValueError, msg="A metric should only be registered once."):
+            registry.register(Counter("test_total", "A test counter."))
+
+
+class TestMetricsView(TestCase):
+    """Unittest class for testing the metrics of the ingestion and the /get_data/ requests with the MetricsView."""
+
+    def tearDown(self):
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    def test_hl7_metrics(self):
+        """Tests that the committed HL7-messages are counted by their trigger event and served by the view."""
+
+        number_of_admissions = hl7_messages_ingested.get(trigger_event="A01")
+        number_of_chunks = hl7_ingest_batch_duration.get_count(mode="chunk")
+
+        with open(os.path.join(directory_path, "test_order", "inpatient_admission_message.hl7"),
+                  encoding="ISO-8859-1") as hl7_file:
+            HL7MessageParser.parse_hl7_message_string(hl7_file.read().replace("\n", "\r"))
+
+        self.assertEqual(hl7_messages_ingested.get(trigger_event="A01"), number_of_admissions + 1,
+                         msg="The committed admission should be counted.")
+        self.assertEqual(hl7_ingest_batch_duration.get_count(mode="chunk"), number_of_chunks + 1,
+                         msg="The duration of the committed chunk should be observed.")
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200,
+                         msg="The metrics should be served without login to an allowed address.")
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"),
+                        msg="The metrics should be served in the text exposition format.")
+        content = response.content.decode()
+        for name in ("hl7_messages_ingested_total", "hl7_ingest_batch_duration_seconds", "hl7_backlog_files",
+                     "rfc_sync_duration_seconds", "get_data_request_duration_seconds"):
+            self.assertIn(f"# TYPE {name} ", content, msg=f"The metric {name} should be served.")
+
+    @override_settings(METRICS_ALLOWED_IPS=["10.0.0.1"])
+    def test_not_allowed_address(self):
+        """Tests that the metrics are not served to an address, that is not allowed."""
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 403, msg="The metrics should not be served to other addresses.")
+
+        response = self.client.get("/metrics", REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 200, msg="The metrics should be served to an allowed address.")
+
+    @override_settings(METRICS_ALLOWED_IPS=["10.0.0.1"], METRICS_CLIENT_IP_HEADER="HTTP_X_FORWARDED_FOR")
+    def test_load_balancer_address(self):
+        """Tests that the client address is the last address appended to the header by the load balancer."""
+
+        response = self.client.get("/metrics", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="10.0.0.2")
+        self.assertEqual(response.status_code, 403,
+                         msg="The address of the load balancer should not be allowed for every client.")
+
+        response = self.client.get("/metrics", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="10.0.0.2, 10.0.0.1")
+        self.assertEqual(response.status_code, 200,
+                         msg="The metrics should be served to the client address appended by the load balancer.")
+
+        response = self.client.get("/metrics", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="10.0.0.1, 10.0.0.2")
+        self.assertEqual(response.status_code, 403,
+                         msg="An address forged by the client before the appended one should not be allowed.")
+
+    def test_get_data_latency(self):
+        """Tests that the latency of the /get_data/ requests is observed by the DataRepresentation."""
+
+        user = User.objects.create(username="metrics")
+        data_representation, _ = DataRepresentation.objects.get_or_create(
+            location_type=DataRepresentation.LocationChoices.HOSPITAL,
+            theme_type=DataRepresentation.ThemeChoices.INFORMATION,
+            time_type=DataRepresentation.TimeChoices.NEARTIME)
+        user_data_representation = UserDataRepresentation.objects.create(user=user,
+                                                                          data_representation=data_representation)
+        labels = {"location_type": "H", "theme_type": "I", "time_type": "N"}
+        number_of_requests = get_data_request_duration.get_count(**labels)
+
+        self.client.force_login(user)
+        response = self.client.get("/get_data/", {"id": user_data_representation.id, "update_flag": "false",
+                                                  "download": "false"})
+
+        self.assertEqual(response.status_code, 200, msg="The data should be returned.")
+        self.assertEqual(get_data_request_duration.get_count(**labels), number_of_requests + 1,
+                         msg="The latency of the request should be observed with its DataRepresentation.")
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from dashboard.services.mllp_services import MLLPServer, MLLP_START_BLOCK, MLLP_END_BLOCK, MLLP_ENCODING, \
+    MLLP_MAX_MESSAGE_SIZE, parse_hl7_message_string
+
+directory_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_hl7_messages")
+
+
+class TestMLLPServer(SimpleTestCase):
+    """Unittest class for testing the MLLPServer class."""
+
+    def test_receive_messages(self):
+        """Tests the receiving, acknowledging and handling of messages from a local socket client."""
+
+        transfer_message = open(os.path.join(directory_path, "transfer_message.hl7"), "r").read()
+        discharge_message = open(os.path.join(directory_path, "discharge_message.hl7"), "r").read()
+
+        handled_messages = []
+
+        def handle_message(message: str):
+            handled_messages.append(message)
+            # the discharge fails like a message, that can not be committed
+            if "0000062765" in message:
+                raise ValueError("The message could not be committed")
+
+        server = MLLPServer(host="127.0.0.1", port=0, queue_size=1, handler=handle_message)
+
+        async def send_messages():
+            await server.start()
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            acknowledgements = []
+            for message in (transfer_message, discharge_message, "no hl7 message"):
+                writer.write(MLLP_START_BLOCK + message.encode(MLLP_ENCODING) + MLLP_END_BLOCK)
+                await writer.drain()
+                acknowledgement = await reader.readuntil(MLLP_END_BLOCK)
+                acknowledgements.append(acknowledgement.decode(MLLP_ENCODING))
+                self.assertEqual(len(handled_messages), min(len(acknowledgements), 2),
+                                 msg="A message should only be acknowledged after it is handled.")
+            writer.close()
+
+            await server.stop()
+            return acknowledgements
+
+        acknowledgements = asyncio.run(send_messages())
+
+        self.assertIn("MSA|AA|0000062753", acknowledgements[0],
+                      msg="The first message should be acknowledged with its message control id.")
+        self.assertIn("ACK^A02", acknowledgements[0],
+                      msg="The acknowledgement should contain the trigger event of the message.")
+        self.assertIn("MSA|AE|0000062765", acknowledgements[1],
+                      msg="The failed second message should be answered with an application error.")
+        self.assertIn("MSA|AR", acknowledgements[2],
+                      msg="A message without a message header should be rejected.")
+
+        self.assertEqual(len(handled_messages), 2, msg="Both HL7-messages should be handled.")
+        self.assertTrue(handled_messages[0].startswith("MSH") and "\n" not in handled_messages[0],
+                        msg="The handled messages should be unframed and use '\\r' as segment delimiter.")
+
+        self.assertEqual(len(server.latencies), 1,
+                         msg="The server should record the end-to-end latency of every committed message.")
+
+    def test_reject_oversized_message(self):
+        """Tests that a message bigger than the max message size is rejected without closing the connection."""
+
+        transfer_message = open(os.path.join(directory_path, "transfer_message.hl7"), "r").read()
+        handled_messages = []
+        server = MLLPServer(host="127.0.0.1", port=0, queue_size=1, handler=handled_messages.append)
+
+        async def send_messages():
+            await server.start()
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            acknowledgements = []
+            for message in ("MSH|" + "x" * (2 * MLLP_MAX_MESSAGE_SIZE), transfer_message):
+                writer.write(MLLP_START_BLOCK + message.encode(MLLP_ENCODING) + MLLP_END_BLOCK)
+                await writer.drain()
+                acknowledgement = await reader.readuntil(MLLP_END_BLOCK)
+                acknowledgements.append(acknowledgement.decode(MLLP_ENCODING))
+            writer.close()
+
+            await server.stop()
+            return acknowledgements
+
+        acknowledgements = asyncio.run(send_messages())
+
+        self.assertIn("MSA|AR", acknowledgements[0], msg="The oversized message should be rejected.")
+        self.assertIn("MSA|AA|0000062753", acknowledgements[1],
+                      msg="The next message of the connection should be acknowledged.")
+        self.assertEqual(len(handled_messages), 1, msg="Only the next message should be handled.")
+
+
+class TestParseHL7MessageString(TestCase):
+    """Unittest class for testing the function parse_hl7_message_string of the MLLPServer."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_quarantined_message(self):
+        """Tests that a message, that can not be decoded, fails like a message, that can not be parsed."""
+
+        # the message has no PID segment
+        message = "MSH|^~\\&|SAP IS-H^MCI|003^0001^PSB|Dashboard^Dashboard|ZIEL_FOE^ZIEL_BEREICH|20230516092410||" \
+                  "ADT^A02^ADT_A02|0000062753|P|2.6\rEVN|A02|20230516092410"
+
+        with override_settings(HL7_QUARANTINE_DIRECTORY=self.directory):
+            with self.assertRaises(ValueError, msg="The message, that can not be decoded, should fail."):
+                parse_hl7_message_string(message)
+
+        self.assertEqual(len([filename for filename in os.listdir(self.directory) if filename.endswith(".hl7")]), 1,
+                         msg="The message should be quarantined.")
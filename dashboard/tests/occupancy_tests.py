@@ -0,0 +1,226 @@
+import datetime
+import random
+import unittest
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from dashboard.models import DataRepresentation, User, UserDataRepresentation
+from dashboard.models.hospital_models import Patient, Visit, Ward, Room, Bed, Stay
+from dashboard.orm.occupancy_sweeps import SWEEP_BACKEND, NUMPY_BACKEND, count_intervals_at, \
+    count_intervals_at_with_numpy, find_occupancy_extremes, numpy
+from dashboard.utils import DATE_FORMAT, GERMAN_DATE_FORMAT
+
+# start of the generated stays and activations, all times are whole hours, so that they meet the sample times
+HISTORY_START = timezone.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def get_time(hours: int):
+    """Returns the time the given number of hours after the start of the generated history."""
+    return HISTORY_START + datetime.timedelta(hours=hours)
+
+
+class TestOccupancyHistory(TestCase):
+    """Unittest class for testing the occupancy_history method of the QuerySets against the occupancy method."""
+
+    @classmethod
+    def setUpTestData(cls):
+        generator = random.Random(1)
+
+        # some wards, rooms and beds are activated and expired during the generated history
+        beds = []
+        for ward_number in range(2):
+            ward = Ward.objects.create(id=f"W{ward_number}", name=f"W{ward_number}", date_of_activation=get_time(-10),
+                                       date_of_expiry=get_time(90 + ward_number * 20))
+            for room_number in range(3):
+                room = Room.objects.create(id=f"{ward.id}R{room_number}", name=f"R{room_number}", ward=ward,
+                                           date_of_activation=get_time(room_number * 10),
+                                           date_of_expiry=get_time(200))
+                for bed_number in range(3):
+                    beds.append(Bed.objects.create(
+                        id=f"{room.id}B{bed_number}", name=f"B{bed_number}", room=room,
+                        date_of_activation=get_time(generator.randrange(-10, 40)),
+                        date_of_expiry=get_time(generator.randrange(60, 130))))
+
+        # the stays start and end at whole hours, some of them are not discharged yet
+        for number in range(80):
+            patient = Patient.objects.create(patient_id=number, date_of_birth=datetime.date(1970, 1, 1),
+                                             sex=Patient.SexChoices.FEMALE)
+            visit = Visit.objects.create(visit_id=number, admission_date=get_time(0), patient=patient)
+            bed = generator.choice(beds)
+            start_date = generator.randrange(-20, 110)
+            end_date = start_date + generator.randrange(1, 40) if generator.random() < 0.8 else None
+            Stay.objects.create(visit=visit, bed=bed, room=bed.room, ward=bed.room.ward, movement_id=number,
+                                start_date=get_time(start_date),
+                                end_date=get_time(end_date) if end_date is not None else None)
+
+        cls.times = [get_time(hours) for hours in range(-15, 125, 7)]
+
+    def test_location_occupancy_history(self):
+        """Tests that the occupancy history of the wards and rooms equals their occupancy at every time."""
+
+        for backend in (SWEEP_BACKEND, NUMPY_BACKEND):
+            for query_set in (Ward.objects.filter_for_id("W1"), Room.objects.filter_for_id("W0R1"),
+                              Room.objects.order_by("id")):
+                history = query_set.occupancy_history(self.times, backend)
+                for time, occupancy in zip(self.times, history):
+                    self.assertEqual(occupancy, list(query_set.occupancy(time).values()),
+                                     msg=f"The {backend} occupancy history should equal the occupancy at {time}.")
+
+    def test_hospital_occupancy_history(self):
+        """Tests that the occupancy history of the hospital equals its occupancy at every time."""
+
+        query_set = Bed.hospital_objects.all()
+        for backend in (SWEEP_BACKEND, NUMPY_BACKEND):
+            history = query_set.occupancy_history(self.times, backend)
+            for time, occupancy in zip(self.times, history):
+                self.assertEqual(occupancy, query_set.occupancy(time),
+                                 msg=f"The {backend} occupancy history should equal the occupancy at {time}.")
+
+    def test_number_of_queries(self):
+        """Tests that the number of queries of the occupancy history does not depend on the number of times."""
+
+        many_times = [get_time(hours) for hours in range(-15, 125)]
+        with self.assertNumQueries(3):
+            Ward.objects.filter_for_id("W0").occupancy_history(many_times)
+        with self.assertNumQueries(2):
+            Bed.hospital_objects.all().occupancy_history(many_times)
+
+    def test_count_intervals_at(self):
+        """Tests that the intervals only contain the times strictly between their start and end."""
+
+        intervals = [(1, 3), (2, None), (3, 3), (4, 2)]
+        self.assertEqual(count_intervals_at(intervals, [4, 0, 1, 2, 3]), [1, 0, 0, 1, 1],
+                         msg="The counts should be in the order of the times and exclude empty intervals.")
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_count_intervals_at_with_numpy(self):
+        """Tests that the vectorized counts equal the counts of the sweep in python."""
+
+        intervals = [(get_time(start), get_time(end) if end is not None else None)
+                     for start, end in [(1, 3), (2, None), (3, 3), (4, 2), (0, 5)]]
+        times = [get_time(hours) for hours in (4, 0, 1, 2, 3, 5)]
+        self.assertEqual(count_intervals_at_with_numpy(intervals, times), count_intervals_at(intervals, times),
+                         msg="The numpy backend should count like the sweep in python.")
+
+    def test_occupancy_extremes(self):
+        """Tests that the occupancy extremes equal the extremes of the occupancy between all stay changes."""
+
+        # all stays start and end at whole hours, so the half hours are between all changes
+        start, end = get_time(-15), get_time(125)
+        half_hours = [get_time(hours) + datetime.timedelta(minutes=30) for hours in range(-15, 125)]
+
+        hospital = Bed.hospital_objects.all()
+        numbers = [occupancy["number"] for occupancy in hospital.occupancy_history(half_hours)]
+        extremes = hospital.occupancy_extremes(start, end)
+        self.assertEqual((extremes["peak_number"], extremes["trough_number"]), (max(numbers), min(numbers)),
+                         msg="The extremes of the hospital should be the extremes between all changes.")
+        self.assertEqual(numbers[half_hours.index(extremes["peak_time"] + datetime.timedelta(minutes=30))],
+                         extremes["peak_number"], msg="The peak should be reached at its time.")
+
+        wards = Ward.objects.all()
+        for ward_id, extremes in wards.occupancy_extremes(start, end).items():
+            numbers = [count_intervals_at(list(Stay.objects.filter(ward_id=ward_id).values_list(
+                "start_date", "end_date")), [time])[0] for time in half_hours]
+            self.assertEqual((extremes["peak_number"], extremes["trough_number"]), (max(numbers), min(numbers)),
+                             msg=f"The extremes of the ward {ward_id} should be the extremes between all changes.")
+
+    def test_find_occupancy_extremes(self):
+        """Tests that the instant of a transfer is not a trough and the first time of an extreme is returned."""
+
+        intervals = [(0, None), (1, 5), (2, 4), (4, 6), (8, 12)]
+        self.assertEqual(find_occupancy_extremes(intervals, 0, 10),
+                         {"peak_number": 3, "peak_time": 2, "trough_number": 1, "trough_time": 0},
+                         msg="The extremes should be taken between the changes in the period.")
+
+
+class TestOccupancyExtremesExport(TestCase):
+    """Unittest class for testing the occupancy extremes in the data of the periods and their csv export."""
+
+    def setUp(self):
+        ward = Ward.objects.create(id="W0", name="W0", date_of_activation=get_time(-10), date_of_expiry=get_time(100))
+        room = Room.objects.create(id="W0R0", name="R0", ward=ward, date_of_activation=get_time(-10),
+                                   date_of_expiry=get_time(100))
+        for number in range(2):
+            bed = Bed.objects.create(id=f"W0R0B{number}", name=f"B{number}", room=room,
+                                     date_of_activation=get_time(-10), date_of_expiry=get_time(100))
+            patient = Patient.objects.create(patient_id=number, date_of_birth=datetime.date(1970, 1, 1),
+                                             sex=Patient.SexChoices.MALE)
+            visit = Visit.objects.create(visit_id=number, admission_date=get_time(0), patient=patient)
+            Stay.objects.create(visit=visit, bed=bed, room=room, ward=ward, movement_id=1,
+                                start_date=get_time(number * 2), end_date=get_time(5))
+
+        self.user = User.objects.create(username="extremes")
+        data_representation, _ = DataRepresentation.objects.get_or_create(
+            location_type=DataRepresentation.LocationChoices.HOSPITAL,
+            theme_type=DataRepresentation.ThemeChoices.ALL_WARDS,
+            time_type=DataRepresentation.TimeChoices.PERIOD)
+        self.user_data_representation = UserDataRepresentation.objects.create(
+            user=self.user, data_representation=data_representation, time=get_time(1), end_time=get_time(10))
+        self.client.force_login(self.user)
+
+    def get_data(self, download: bool):
+        """Returns the response of the /get_data/ request for the wards in the period."""
+
+        return self.client.get("/get_data/", {"id": self.user_data_representation.id, "update_flag": "false",
+                                              "download": "true" if download else "false"})
+
+    def test_json(self):
+        """Tests that the wards of a period contain their occupancy extremes and their annotations."""
+
+        ward = self.get_data(download=False).json()["data"][0]
+        self.assertEqual((ward["peak_number"], ward["peak_time"], ward["trough_number"], ward["trough_time"]),
+                         (2, get_time(2).strftime(DATE_FORMAT), 0, get_time(5).strftime(DATE_FORMAT)),
+                         msg="The ward should contain the peak and trough occupancy with their times.")
+        self.assertIn("max_number", ward, msg="The ward should still contain its annotations.")
+
+    def test_csv(self):
+        """Tests that the csv export of the wards of a period contains their occupancy extremes."""
+
+        rows = self.get_data(download=True).content.decode().splitlines()
+        self.assertEqual(rows[0].split(";")[-4:],
+                         ["Max. belegte Betten", "Zeitpunkt Maximum", "Min. belegte Betten", "Zeitpunkt Minimum"],
+                         msg="The csv file should contain the columns of the occupancy extremes.")
+        self.assertEqual(rows[1].split(";")[-4:], ["2", get_time(2).strftime(GERMAN_DATE_FORMAT), "0",
+                                                   get_time(5).strftime(GERMAN_DATE_FORMAT)],
+                         msg="The csv file should contain the occupancy extremes of the ward.")
+
+
+class TestOccupancyHistoryResolution(TestCase):
+    """Unittest class for testing the number of samples of the occupancy history of a period."""
+
+    def setUp(self):
+        self.user = User.objects.create(username="history")
+        data_representation, _ = DataRepresentation.objects.get_or_create(
+            location_type=DataRepresentation.LocationChoices.HOSPITAL,
+            theme_type=DataRepresentation.ThemeChoices.HISTORY,
+            time_type=DataRepresentation.TimeChoices.PERIOD)
+        self.user_data_representation = UserDataRepresentation.objects.create(
+            user=self.user, data_representation=data_representation, time=get_time(0), end_time=get_time(0))
+        self.client.force_login(self.user)
+
+    def get_history(self, minutes: float):
+        """Returns the occupancy history of the hospital for a period with the given number of minutes."""
+
+        self.user_data_representation.end_time = get_time(0) + datetime.timedelta(minutes=minutes)
+        self.user_data_representation.save()
+        return self.client.get("/get_data/", {"id": self.user_data_representation.id, "update_flag": "false",
+                                              "download": "false"}).json()["data"]
+
+    @override_settings(OCCUPANCY_HISTORY_SAMPLES=10)
+    def test_number_of_samples(self):
+        """Tests that every sample is returned, if the samples are at least one minute apart."""
+
+        self.assertEqual(len(self.get_history(minutes=90)), 10, msg="All 10 samples should be returned.")
+        self.assertEqual(len(self.get_history(minutes=9)), 10, msg="All 10 samples should be returned.")
+
+    @override_settings(OCCUPANCY_HISTORY_SAMPLES=1000)
+    def test_clamped_number_of_samples(self):
+        """Tests that the samples of a short period are reduced to one per minute instead of overwriting each other."""
+
+        history = self.get_history(minutes=30)
+        self.assertEqual(len(history), 31, msg="The samples should be reduced to one per minute.")
+        self.assertEqual(list(history)[-1], (get_time(0) + datetime.timedelta(minutes=30)).strftime(DATE_FORMAT),
+                         msg="The last sample should be the end of the period.")
+
+        self.assertEqual(len(self.get_history(minutes=0.5)), 1, msg="A period shorter than a minute has one sample.")
@@ -0,0 +1,80 @@
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, TransactionTestCase
+
+from dashboard.models import ProcessedHL7Message
+from dashboard.models.hospital_models import Stay
+from dashboard.services import HL7MessageParser
+from dashboard.services.benchmark_services import ADTMessageGenerator
+from dashboard.services.cache_services import location_cache, open_stay_cache
+from dashboard.services.hl7_dedup_services import HL7MessageDeduplicator
+from dashboard.services.replay_services import HL7LagHistogram, HL7Replayer
+from dashboard.services.watcher_services import HL7DirectoryWatcher
+
+
+class TestHL7LagHistogram(SimpleTestCase):
+    """Unittest class for testing the HL7LagHistogram class."""
+
+    def test_add(self):
+        """Tests that the lags are counted in their buckets and the percentiles are calculated from all lags."""
+
+        histogram = HL7LagHistogram(buckets=(1, 10))
+        for lag in (0.5, 1, 2, 3, 20):
+            histogram.add(lag)
+
+        self.assertEqual(histogram.to_dict()["buckets"], {"<= 1 s": 2, "<= 10 s": 2, "> 10 s": 1},
+                         msg="Every lag should be counted in the smallest bucket containing it.")
+        self.assertEqual(histogram.percentile(50), 2, msg="The median should be the middle lag.")
+        self.assertEqual(histogram.percentile(100), 20, msg="The 100th percentile should be the max lag.")
+        self.assertIsNone(HL7LagHistogram().percentile(50), msg="An empty histogram should have no percentiles.")
+
+
+class TestHL7Replayer(TransactionTestCase):
+    """Unittest class for testing the HL7Replayer class."""
+
+    def setUp(self):
+        self.recording = tempfile.mkdtemp()
+        self.target_directory = tempfile.mkdtemp()
+        HL7MessageDeduplicator.reset()
+
+    def tearDown(self):
+        shutil.rmtree(self.recording)
+        shutil.rmtree(self.target_directory)
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    def test_run(self):
+        """Tests that the replayed messages are parsed by the watcher and their freshness lag is measured."""
+
+        trigger_events = ADTMessageGenerator(wards=2, rooms_per_ward=2, beds_per_room=2, patients=10, days=2) \
+            .write_hl7_files(self.recording, messages_per_file=20)
+        number_of_messages = sum(trigger_events.values())
+
+        watcher = HL7DirectoryWatcher(self.target_directory, HL7MessageParser.parse_hl7_messages_from_directory,
+                                      use_inotify=False, poll_interval=0.05)
+        watcher.start()
+        try:
+            # the two days of the recording are replayed in about two seconds
+            results = HL7Replayer([self.recording], speedup=86400, target_directory=self.target_directory,
+                                  poll_interval=0.05, timeout=30).run()
+        finally:
+            watcher.stop()
+
+        self.assertEqual(results["messages"], number_of_messages, msg="All recorded messages should be replayed.")
+        self.assertEqual(results["visible"], number_of_messages, msg="All replayed messages should become visible.")
+        self.assertEqual(results["not_visible"], 0, msg="No replayed message should be missing.")
+        self.assertEqual(results["lag"]["count"], number_of_messages,
+                         msg="The histogram should contain the lag of every visible message.")
+        self.assertGreater(results["recorded_duration"], results["replay_duration"],
+                           msg="The recording should be replayed faster than real time.")
+        self.assertEqual(ProcessedHL7Message.objects.count(), number_of_messages,
+                         msg="Every replayed message should be parsed.")
+        self.assertTrue(Stay.objects.exists(), msg="The replayed messages should create stays.")
+
+        # the already parsed messages are not measured again
+        results = HL7Replayer([self.recording], speedup=86400, target_directory=self.target_directory,
+                              poll_interval=0.05, timeout=0).run()
+        self.assertEqual(results["already_processed"], number_of_messages,
+                         msg="The already parsed messages should be recognised.")
+        self.assertEqual(results["visible"], 0, msg="The already parsed messages should not be measured.")
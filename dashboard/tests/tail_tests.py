@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.test import TestCase, override_settings
+
+from dashboard.models import Stay, Visit, HL7FileCheckpoint
+from dashboard.services.cache_services import location_cache, open_stay_cache
+from dashboard.services.hl7_tail_services import HL7FileTailer
+
+directory_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_hl7_messages")
+
+
+class TestHL7FileTailer(TestCase):
+    """Unittest class for testing the HL7FileTailer class."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, "adt.hl7")
+
+        with open(os.path.join(directory_path, "test_order", "inpatient_admission_message.hl7"), "rb") as hl7_file:
+            self.admission_message = hl7_file.read()
+        # the writer terminates every segment
+        with open(os.path.join(directory_path, "transfer_message.hl7"), "rb") as hl7_file:
+            self.transfer_message = hl7_file.read() + b"\r"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    def append(self, data: bytes, idle: bool):
+        """Appends the given bytes to the tailed file and sets its modification time."""
+
+        with open(self.file_path, "ab") as hl7_file:
+            hl7_file.write(data)
+        if idle:
+            modification_time = time.time() - 60
+            os.utime(self.file_path, (modification_time, modification_time))
+
+    def rotate(self):
+        """Starts writing a newer file, so that the writer of the tailed file has rotated."""
+
+        with open(os.path.join(self.directory, "adt_rotated.hl7"), "wb") as hl7_file:
+            hl7_file.write(self.admission_message)
+
+    def get_offset(self):
+        """Returns the read position of the tailed file."""
+        return HL7FileCheckpoint.objects.get(path=self.file_path).offset
+
+    @override_settings(HL7_TAIL_IDLE_TIME=10)
+    def test_parse_hl7_messages_from_directory(self):
+        """Tests that only the appended complete messages are parsed and the file is never deleted."""
+
+        # the transfer is not complete, because its writer is still writing
+        transfer_start = self.transfer_message.index(b"\r") + 1
+        self.append(self.admission_message + self.transfer_message[:transfer_start], idle=False)
+        statistics = HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+
+        self.assertEqual(statistics.number_of_messages, 1,
+                         msg="Only the complete admission should be parsed.")
+        self.assertTrue(Visit.objects.filter(visit_id=4223045829).exists(),
+                        msg="The admission should be saved in the database.")
+        self.assertEqual(self.get_offset(), len(self.admission_message),
+                         msg="The read position should be the start of the incomplete transfer.")
+
+        # the transfer is the last message of the newest file, so it is not complete, even if its writer is idle
+        self.append(self.transfer_message[transfer_start:], idle=True)
+        statistics = HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+
+        self.assertEqual(statistics.number_of_messages, 0,
+                         msg="The last message of the newest file should not be parsed.")
+
+        # the transfer is complete, after the writer has rotated to a newer file
+        self.rotate()
+        statistics = HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+
+        self.assertEqual(statistics.number_of_messages, 1,
+                         msg="Only the appended transfer should be parsed.")
+        self.assertTrue(Visit.objects.filter(visit_id=6223045829).exists(),
+                        msg="The transfer should be saved in the database.")
+        self.assertEqual(self.get_offset(), os.path.getsize(self.file_path),
+                         msg="The read position should be the end of the file.")
+        self.assertTrue(os.path.exists(self.file_path),
+                        msg="The tailed file should not be deleted.")
+
+        statistics = HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+        self.assertEqual(statistics.number_of_messages, 0,
+                         msg="The file should not be read again without appended messages.")
+
+    @override_settings(HL7_TAIL_IDLE_TIME=10)
+    def test_message_written_in_two_parts(self):
+        """Tests that a message, whose writer is idle after one of its segments, is not parsed truncated."""
+
+        # the first part ends after the PID segment of the transfer
+        transfer_split = self.transfer_message.index(b"PV1")
+        self.append(self.admission_message + self.transfer_message[:transfer_split], idle=True)
+        statistics = HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+
+        self.assertEqual(statistics.number_of_messages, 1,
+                         msg="Only the complete admission should be parsed.")
+        self.assertEqual(self.get_offset(), len(self.admission_message),
+                         msg="The read position should be the start of the transfer without its last segments.")
+
+        # the transfer is complete, as soon as the next message starts
+        self.append(self.transfer_message[transfer_split:] + self.admission_message, idle=True)
+        statistics = HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+
+        self.assertEqual(statistics.number_of_messages, 1,
+                         msg="Only the transfer should be parsed.")
+        self.assertEqual(statistics.number_of_quarantined_messages, 0,
+                         msg="The transfer should not be parsed truncated.")
+        self.assertTrue(Stay.objects.filter(visit_id=6223045829, bed_id="A214A").exists(),
+                        msg="The transfer should create the stay in the bed of its PV1 segment.")
+        self.assertEqual(self.get_offset(), len(self.admission_message) + len(self.transfer_message),
+                         msg="The read position should be the start of the next message.")
+
+    def test_rotated_files(self):
+        """Tests that a truncated file is read from the start and the checkpoint of a removed file is deleted."""
+
+        self.append(self.admission_message + self.transfer_message, idle=True)
+        self.rotate()
+        HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+
+        # the file is rotated by truncating it
+        with open(self.file_path, "wb"):
+            pass
+        self.append(self.transfer_message, idle=True)
+        HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+
+        self.assertEqual(self.get_offset(), len(self.transfer_message),
+                         msg="A truncated file should be read from the start.")
+
+        os.remove(self.file_path)
+        HL7FileTailer.parse_hl7_messages_from_directory(self.directory)
+
+        self.assertFalse(HL7FileCheckpoint.objects.exists(),
+                         msg="The checkpoint of a removed file should be deleted.")
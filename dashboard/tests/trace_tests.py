@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from dashboard.models import Ward
+from dashboard.services import HL7MessageParser
+from dashboard.services.benchmark_services import ADTMessageGenerator
+from dashboard.services.cache_services import location_cache, open_stay_cache
+from dashboard.services.trace_services import HL7Trace
+
+
+class TestHL7Trace(TestCase):
+    """Unittest class for testing the HL7Trace class."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        location_cache.clear()
+        open_stay_cache.clear()
+
+    def read_trace_file(self):
+        """Returns the run and the spans by their name and message type from the only trace file."""
+
+        trace_files = os.listdir(self.directory)
+        self.assertEqual(len(trace_files), 1, msg="Every run should write one trace file.")
+
+        with open(os.path.join(self.directory, trace_files[0])) as trace_file:
+            lines = [json.loads(line) for line in trace_file]
+        return lines[0], {(span["span"], span["type"]): span for span in lines[1:]}
+
+    def test_span(self):
+        """Tests that the nested spans are subtracted from the self values and the queries are counted."""
+
+        trace = HL7Trace("test", enabled=True, directory=self.directory)
+        with trace.span("outer"):
+            with trace.span("inner"):
+                time.sleep(0.05)
+                list(Ward.objects.all())
+            for _ in trace.iterate("pull", range(3)):
+                pass
+        trace.close(messages=3)
+
+        run, spans = self.read_trace_file()
+        self.assertEqual(run["messages"], 3, msg="The attributes of the run should be written.")
+
+        outer = spans[("outer", None)]
+        inner = spans[("inner", None)]
+        self.assertGreaterEqual(inner["wall"], 0.05, msg="The wall time of the span should be measured.")
+        self.assertLess(outer["self_wall"], 0.05, msg="The time of the nested spans should be subtracted.")
+        self.assertEqual((inner["queries"], outer["queries"], outer["self_queries"]), (1, 1, 0),
+                         msg="The queries should be counted in the span executing them.")
+        self.assertEqual(spans[("pull", None)]["count"], 4,
+                         msg="Every pulled item and the end of the iterable should be measured.")
+        self.assertNotIn(trace._HL7Trace__count_query, connection.execute_wrappers,
+                         msg="The trace should not count the queries after it is closed.")
+
+    def test_disabled(self):
+        """Tests that a disabled trace neither measures nor writes anything."""
+
+        trace = HL7Trace("test", enabled=False, directory=self.directory)
+        with trace.span("outer"):
+            pass
+        items = [1, 2]
+        self.assertIs(trace.iterate("pull", items), items, msg="The iterable should not be wrapped.")
+        self.assertIsNone(trace.close(), msg="A disabled trace should not write a trace file.")
+        self.assertEqual(os.listdir(self.directory), [], msg="A disabled trace should not write a trace file.")
+
+    def test_parse_hl7_messages_from_directory(self):
+        """Tests that the stages of a parsing run and the messages of every type are traced."""
+
+        hl7_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, hl7_directory)
+        trigger_events = ADTMessageGenerator(wards=2, rooms_per_ward=2, beds_per_room=2, patients=20) \
+            .write_hl7_files(hl7_directory, messages_per_file=10)
+
+        with override_settings(HL7_TRACING=True, HL7_TRACE_DIRECTORY=self.directory):
+            HL7MessageParser.parse_hl7_messages_from_directory(hl7_directory, batch_size=0)
+
+        run, spans = self.read_trace_file()
+
+        self.assertEqual(run["messages"], sum(trigger_events.values()), msg="The run should contain its statistics.")
+        for name in ("run", "read", "sort", "decode", "deduplicate", "compact", "apply", "commit_chunk"):
+            self.assertIn((name, None), spans, msg=f"The stage {name} should be traced.")
+        self.assertIsNotNone(spans[("run", None)]["memory_delta"], msg="The memory of the run should be measured.")
+
+        admissions = spans[("parse_message", "AdmissionHL7Message")]
+        self.assertGreater(admissions["count"], 0, msg="Every parsed message should be traced by its type.")
+        self.assertGreater(admissions["self_queries"], 0, msg="The queries of the messages should be counted.")
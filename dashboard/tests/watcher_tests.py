@@ -0,0 +1,95 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from django.test import SimpleTestCase
+
+from dashboard.services.watcher_services import HL7DirectoryWatcher
+
+
+class TestHL7DirectoryWatcher(SimpleTestCase):
+    """Unittest class for testing the HL7DirectoryWatcher class."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def wait_for_calls(self, number_of_calls: int, timeout: float = 5):
+        """Waits until the callback is called the given number of times or the timeout is reached."""
+
+        deadline = time.monotonic() + timeout
+        while len(self.calls) < number_of_calls and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def write_hl7_files(self, number_of_files: int):
+        """Writes the given number of HL7-files into the watched directory."""
+
+        for number in range(number_of_files):
+            with open(os.path.join(self.directory, f"{number}.hl7"), "w") as hl7_file:
+                hl7_file.write("MSH|^~\\&|")
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is only available on Linux")
+    def test_watch_with_inotify(self):
+        """Tests that a burst of written HL7-files results in one call of the callback."""
+
+        watcher = HL7DirectoryWatcher(self.directory, self.calls.append, debounce=0.5, max_delay=5)
+        watcher.start()
+        try:
+            # the first call parses the files written while the watcher was not running
+            self.wait_for_calls(1)
+            self.write_hl7_files(5)
+            self.wait_for_calls(2)
+            time.sleep(1)
+        finally:
+            watcher.stop()
+
+        self.assertEqual(len(self.calls), 2,
+                         msg="The burst of HL7-files should be debounced into one call of the callback.")
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is only available on Linux")
+    def test_retry_with_inotify(self):
+        """Tests that a failed call is repeated after the poll interval without a new HL7-file."""
+
+        def callback(path: str):
+            self.calls.append(path)
+            if len(self.calls) == 1:
+                raise ValueError("The database is not available.")
+            # the second call parses and removes the HL7-file
+            os.remove(os.path.join(path, "0.hl7"))
+
+        self.write_hl7_files(1)
+        watcher = HL7DirectoryWatcher(self.directory, callback, poll_interval=0.3)
+        watcher.start()
+        try:
+            self.wait_for_calls(2)
+            # there are no HL7-files left, so the callback should not be called again
+            time.sleep(1)
+        finally:
+            watcher.stop()
+
+        self.assertEqual(len(self.calls), 2,
+                         msg="The failed call should be repeated once without a new HL7-file.")
+
+    def test_watch_with_polling(self):
+        """Tests the polling, if inotify is not used."""
+
+        watcher = HL7DirectoryWatcher(self.directory, self.calls.append, poll_interval=0.1, use_inotify=False)
+        watcher.start()
+        try:
+            self.wait_for_calls(1)
+            # the callback should not be called for an empty directory
+            time.sleep(0.3)
+            self.assertEqual(len(self.calls), 1, msg="The callback should not be called for an empty directory.")
+
+            self.write_hl7_files(1)
+            self.wait_for_calls(2)
+        finally:
+            watcher.stop()
+
+        self.assertGreaterEqual(len(self.calls), 2, msg="The polling should call the callback for a new HL7-file.")
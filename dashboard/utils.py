@@ -24,13 +24,13 @@ class ModelJSONEncoder(DjangoJSONEncoder):
         return super(ModelJSONEncoder, self).default(o)
 
 
-def get_sex_from_location(location):
-    """Returns the right string representation of the sex based on number attributes of a given location."""
-    if location.number_of_men > 0:
+def get_sex_from_location(location: dict):
+    """Returns the right string representation of the sex based on the number values of a given location."""
+    if location["number_of_men"] > 0:
         return hospital_models.Patient.SexChoices.MALE
-    elif location.number_of_women > 0:
+    elif location["number_of_women"] > 0:
         return hospital_models.Patient.SexChoices.FEMALE
-    elif location.number_of_diverse > 0:
+    elif location["number_of_diverse"] > 0:
         return hospital_models.Patient.SexChoices.DIVERSE
     else:
         return "Leer"
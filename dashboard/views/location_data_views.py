@@ -1,18 +1,25 @@
 import csv
+import time
 from abc import ABC, abstractmethod
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import Manager
+from django.db.models import Manager, QuerySet
 from django.http import JsonResponse, HttpResponse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views import View
 
 from dashboard.models import DataRepresentation, UserDataRepresentation, hospital_models
+from dashboard.orm.hopital_query_sets import LocationOccupancyQuerySet
+from dashboard.services.metrics_services import get_data_request_duration
 from dashboard.utils import ModelJSONEncoder, DATE_FORMAT, GERMAN_DATE_FORMAT, get_sex_from_location
 
 from django.db.utils import IntegrityError
 
+# min time between the samples of an occupancy history, that are keyed by their time formatted with DATE_FORMAT
+HISTORY_MIN_SAMPLE_SPACING = timezone.timedelta(minutes=1)
+
 
 class DataGenerator(ABC):
     """Strategy interface for the generation of the data."""
@@ -35,13 +42,33 @@ class LocationInformationGenerator(DataGenerator, ABC):
         # perform the right operation with the right parameters on the query_set
         # based on the time_type from the given UserDataRepresentation
         if data_representation.time_type == DataRepresentation.TimeChoices.PERIOD:
-            return query_set.information_for_period(user_data_representation.time,
-                                                    user_data_representation.end_time)
+            start = user_data_representation.time
+            end = user_data_representation.end_time
+            data = query_set.information_for_period(start, end)
+
+            # the peak and trough occupancy are found by a sweep over the stays and added to the annotated data
+            if isinstance(query_set, LocationOccupancyQuerySet):
+                data = self.add_occupancy_extremes(data, query_set.occupancy_extremes(start, end))
+            return data
         elif data_representation.time_type == DataRepresentation.TimeChoices.TIME:
             return query_set.information_for_time(user_data_representation.time)
         else:
             return query_set.information_for_time(timezone.now())
 
+    @staticmethod
+    def add_occupancy_extremes(data, occupancy_extremes: dict):
+        """
+        Returns the given data with the given occupancy extremes.
+        The data of the hospital is a dictionary, the data of the wards and rooms is a list of the dictionaries
+        with the values of the locations.
+        """
+
+        if isinstance(data, dict):
+            data.update(occupancy_extremes)
+            return data
+
+        return [dict(location, **occupancy_extremes[location["id"]]) for location in data.values()]
+
     @abstractmethod
     def get_query_set(self, user_data_representation, manager: Manager):
         """Returns the right QuerySet to perform the operations on."""
@@ -91,10 +118,14 @@ class LocationHistoryGenerator(DataGenerator, ABC):
         # calling the template method
         query_set = self.get_query_set(user_data_representation, manager)
 
-        # go through 10 times from start to end and generate the occupancy for these times
-        # they are organised in a dictionary with the formatted times as keys
-        for time in (start + ((end - start) / 9) * n for n in range(10)):
-            context[time.strftime(DATE_FORMAT)] = query_set.occupancy(time)
+        # generate the occupancy for OCCUPANCY_HISTORY_SAMPLES times from start to end with the configured backend
+        # they are organised in a dictionary with the times formatted to the minute as keys,
+        # so the times are at least one minute apart, that no sample overwrites another one
+        samples = max(settings.OCCUPANCY_HISTORY_SAMPLES, 2)
+        samples = min(samples, (end - start) // HISTORY_MIN_SAMPLE_SPACING + 1)
+        times = [start + ((end - start) / (samples - 1)) * n for n in range(samples)] if samples > 1 else [start]
+        for time, occupancy in zip(times, query_set.occupancy_history(times, settings.OCCUPANCY_HISTORY_BACKEND)):
+            context[time.strftime(DATE_FORMAT)] = occupancy
 
         return context
 
@@ -194,6 +225,16 @@ class DataGeneratorFactory:
         # use the dialect 'excel' and the delimiter ';' so that the file can be opened with excel
         writer = csv.writer(response, dialect='excel', delimiter=';')
 
+        # the locations are written like the dictionaries with their values of a period
+        if isinstance(data, QuerySet):
+            data = list(data.values())
+
+        # the data of a period contains the peak and trough occupancy in addition
+        extremes_header = []
+        if data_representation.time_type == DataRepresentation.TimeChoices.PERIOD:
+            extremes_header = ["Max. belegte Betten", "Zeitpunkt Maximum", "Min. belegte Betten", "Zeitpunkt Minimum"]
+        get_extremes_columns = DataGeneratorFactory.get_occupancy_extremes_columns
+
         # fill the csv file with the right data
         if data_representation.theme_type == DataRepresentation.ThemeChoices.HISTORY:
             writer.writerow(["Zeitpunkt", "Anzahl Betten", "Belegte Betten"])
@@ -202,43 +243,58 @@ class DataGeneratorFactory:
         elif data_representation.theme_type == DataRepresentation.ThemeChoices.INFORMATION:
             if data_representation.location_type == DataRepresentation.LocationChoices.ROOM:
                 writer.writerow(
-                    ["Geschlecht", "Durchschnittliches Alter", "Anzahl Betten", "Belegte Betten"])
+                    ["Geschlecht", "Durchschnittliches Alter", "Anzahl Betten", "Belegte Betten"] + extremes_header)
                 room = data[0]
-                writer.writerow([get_sex_from_location(room), room.average_age, room.max_number, room.number])
+                writer.writerow([get_sex_from_location(room), room["average_age"], room["max_number"],
+                                 room["number"]] + get_extremes_columns(room))
             elif data_representation.location_type == DataRepresentation.LocationChoices.WARD:
                 writer.writerow(["Anzahl Betten", "Belegte Betten", "Anzahl Maenner",
-                                 "Anzahl Frauen", "Anzahl Diverse"])
+                                 "Anzahl Frauen", "Anzahl Diverse"] + extremes_header)
                 ward = data[0]
-                writer.writerow(
-                    [ward.max_number, ward.number, ward.number_of_men, ward.number_of_women, ward.number_of_diverse])
+                writer.writerow([ward["max_number"], ward["number"], ward["number_of_men"], ward["number_of_women"],
+                                 ward["number_of_diverse"]] + get_extremes_columns(ward))
             else:
                 writer.writerow(["Anzahl Betten", "Belegte Betten", "Anzahl Maenner",
-                                 "Anzahl Frauen", "Anzahl Diverse"])
+                                 "Anzahl Frauen", "Anzahl Diverse"] + extremes_header)
                 max_number = data["max_number"]
                 number = data["number"]
                 writer.writerow(
-                    [max_number, number, data["number_of_men"], data["number_of_women"], data["number_of_diverse"]])
+                    [max_number, number, data["number_of_men"], data["number_of_women"], data["number_of_diverse"]] +
+                    get_extremes_columns(data))
         else:
             if data_representation.theme_type == DataRepresentation.ThemeChoices.ALL_ROOMS:
-                writer.writerow(["ID", "Geschlecht", "Durchschnittliches Alter", "Anzahl Betten", "Belegte Betten"])
+                writer.writerow(["ID", "Geschlecht", "Durchschnittliches Alter", "Anzahl Betten", "Belegte Betten"] +
+                                extremes_header)
                 for room in data:
-                    writer.writerow(
-                        [room.id, get_sex_from_location(room), room.average_age, room.max_number, room.number])
+                    writer.writerow([room["id"], get_sex_from_location(room), room["average_age"],
+                                     room["max_number"], room["number"]] + get_extremes_columns(room))
             elif data_representation.theme_type == DataRepresentation.ThemeChoices.ALL_WARDS:
                 writer.writerow(
                     ["ID", "Anzahl Betten", "Belegte Betten",
-                     "Anzahl Maenner", "Anzahl Frauen", "Anzahl Diverse"])
+                     "Anzahl Maenner", "Anzahl Frauen", "Anzahl Diverse"] + extremes_header)
                 for ward in data:
-                    writer.writerow([ward.id, ward.max_number, ward.number, ward.number_of_men, ward.number_of_women,
-                                     ward.number_of_diverse])
+                    writer.writerow([ward["id"], ward["max_number"], ward["number"], ward["number_of_men"],
+                                     ward["number_of_women"], ward["number_of_diverse"]] + get_extremes_columns(ward))
             else:
                 writer.writerow(
                     ["ID", "Alter", "Geschlecht"])
                 for bed in data:
-                    writer.writerow([bed.id, bed.average_age, get_sex_from_location(bed)])
+                    writer.writerow([bed["id"], bed["average_age"], get_sex_from_location(bed)])
 
         return response
 
+    @staticmethod
+    def get_occupancy_extremes_columns(location: dict):
+        """
+        Returns the csv columns with the peak and trough occupancy of the dictionary of a location or the hospital
+        or no columns, if the occupancy extremes are not added to its data.
+        """
+
+        if "peak_number" not in location:
+            return []
+        return [location["peak_number"], location["peak_time"].strftime(GERMAN_DATE_FORMAT),
+                location["trough_number"], location["trough_time"].strftime(GERMAN_DATE_FORMAT)]
+
 
 class LocationDataResponseView(View):
     """View for dynamically returning the requested data to the template."""
@@ -247,6 +303,8 @@ class LocationDataResponseView(View):
     def get(self, request):
         """Returns the right data in a HttpResponse for the template and Updates the UserDataRepresentation"""
 
+        start = time.perf_counter()
+
         user_data_representation = UserDataRepresentation.objects.select_related('data_representation').get(
             id=request.GET["id"])
 
@@ -318,7 +376,7 @@ class LocationDataResponseView(View):
         context["user_data_representation"] = UserDataRepresentation.objects.get(id=request.GET["id"])
 
         if request.GET["download"] == "true":
-            return DataGeneratorFactory.generate_csv_file_response(data, user_data_representation)
+            response = DataGeneratorFactory.generate_csv_file_response(data, user_data_representation)
         else:
             # get locations if not already got
             if locations is None:
@@ -326,4 +384,12 @@ class LocationDataResponseView(View):
 
             if locations:
                 context["locations"] = locations
-            return JsonResponse(context, ModelJSONEncoder)
+            response = JsonResponse(context, ModelJSONEncoder)
+
+        # the latency is measured for every kind of DataRepresentation, because their queries are different
+        data_representation = user_data_representation.data_representation
+        get_data_request_duration.observe(time.perf_counter() - start,
+                                          location_type=data_representation.location_type,
+                                          theme_type=data_representation.theme_type,
+                                          time_type=data_representation.time_type)
+        return response
@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views import View
+
+from dashboard.services.metrics_services import registry, METRICS_CONTENT_TYPE
+
+
+class MetricsView(View):
+    """
+    View for the metrics of the process in the text exposition format of Prometheus.
+    The metrics are served without login, but only to the addresses in METRICS_ALLOWED_IPS.
+    """
+
+    def get(self, request):
+        """Returns all registered metrics of the process or 403 for a not allowed address."""
+
+        if self.get_client_ip(request) not in settings.METRICS_ALLOWED_IPS:
+            return HttpResponseForbidden()
+        return HttpResponse(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+    @staticmethod
+    def get_client_ip(request):
+        """
+        Returns the address of the client, that is appended last to the METRICS_CLIENT_IP_HEADER by the load balancer,
+        or the address of the connection without such a header.
+        """
+
+        if settings.METRICS_CLIENT_IP_HEADER:
+            addresses = request.META.get(settings.METRICS_CLIENT_IP_HEADER, "").split(",")
+            return addresses[-1].strip() or None
+        return request.META.get("REMOTE_ADDR")